@@ -0,0 +1,338 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from clinic_schedule import ClinicSchedule, compile_day, segment_slot_starts
+from event_time import to_clinic_minutes
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+class AvailabilityEngine:
+    """
+    Motor de disponibilidade baseado em bitmaps de minutos.
+    Representa cada dia de cada recurso (cadeira ou dentista) como um vetor
+    booleano de ticks (padrão: 5 minutos) e encontra os slots livres com
+    operações vetorizadas do NumPy sobre a matriz recursos x dias x ticks.
+    """
+    
+    def __init__(self, business_hours: Dict[int, Optional[Dict[str, Any]]], tick_minutes: int = 5, resources: Optional[Dict[str, Optional[Dict[int, Optional[Dict[str, Any]]]]]] = None, schedule: Optional[ClinicSchedule] = None):
+        """
+        Inicializa o motor de disponibilidade.
+        
+        Args:
+            business_hours: Horário de funcionamento por dia da semana (0 = segunda),
+                com as chaves start, end, lunch_start, lunch_end (HH:MM) e breaks
+                (lista opcional de pares [início, fim]), ou None para dias fechados.
+            tick_minutes: Resolução dos bitmaps em minutos (padrão: 5).
+            resources: Horários por recurso, no mesmo formato de business_hours,
+                ou None para usar business_hours (padrão: um único recurso "clinic").
+            schedule: Calendário da clínica; feriados e exceções por data substituem
+                o horário semanal de todos os recursos (opcional).
+        """
+        if (24 * 60) % tick_minutes:
+            raise ValueError("tick_minutes deve dividir um dia em partes inteiras.")
+        
+        self.tick_minutes = tick_minutes
+        self.ticks_per_day = (24 * 60) // tick_minutes
+        self.schedule = schedule
+        
+        resources = resources or {"clinic": None}
+        self.resource_ids = list(resources)
+        
+        # Segmentos abertos por recurso e dia da semana, em minutos desde a meia-noite
+        self._segments = [
+            {weekday: compile_day(hours.get(weekday)) for weekday in range(7)}
+            for hours in (resources[resource_id] or business_hours for resource_id in self.resource_ids)
+        ]
+        
+        # Máscara de funcionamento por recurso e dia da semana (recursos x 7 x ticks)
+        self._open_templates = np.zeros((len(self.resource_ids), 7, self.ticks_per_day), dtype=bool)
+        for index, segments_by_weekday in enumerate(self._segments):
+            for weekday, segments in segments_by_weekday.items():
+                for segment_start, segment_end in self._to_ticks(segments):
+                    self._open_templates[index, weekday, segment_start:segment_end] = True
+        
+        # Rótulos HH:MM de cada tick, para evitar strftime por slot
+        self._time_labels = np.array([
+            f"{(tick * tick_minutes) // 60:02d}:{(tick * tick_minutes) % 60:02d}"
+            for tick in range(self.ticks_per_day)
+        ])
+        
+        # Máscaras de início de slot por duração, calculadas sob demanda
+        self._start_templates: Dict[int, np.ndarray] = {}
+    
+    def _to_ticks(self, segments: Sequence[Tuple[int, int]]) -> List[tuple]:
+        """
+        Converte segmentos em minutos para segmentos em ticks.
+        
+        Args:
+            segments: Segmentos abertos (início, fim) em minutos desde a meia-noite.
+            
+        Returns:
+            Lista de segmentos abertos em ticks.
+            
+        Raises:
+            ValueError: Se algum limite não cair em um tick.
+        """
+        if any(start % self.tick_minutes or end % self.tick_minutes for start, end in segments):
+            raise ValueError("Os horários de funcionamento devem ser múltiplos de tick_minutes.")
+        
+        return [(start // self.tick_minutes, end // self.tick_minutes) for start, end in segments]
+    
+    def _mark_starts(self, row: np.ndarray, segments: Sequence[Tuple[int, int]], duration_minutes: int) -> None:
+        """
+        Marca em uma linha de ticks os inícios de slot do calendário da clínica.
+        
+        Args:
+            row: Vetor booleano de ticks de um dia.
+            segments: Segmentos abertos do dia em minutos desde a meia-noite.
+            duration_minutes: Duração da consulta em minutos.
+        """
+        for start in segment_slot_starts(segments, duration_minutes):
+            row[start // self.tick_minutes] = True
+    
+    def _date_overrides(self, start_date: date, days: int) -> List[Tuple[int, List[tuple]]]:
+        """
+        Obtém os dias do intervalo cujo horário vem do calendário, e não do modelo semanal.
+        
+        Args:
+            start_date: Primeiro dia do intervalo.
+            days: Número de dias.
+            
+        Returns:
+            Lista de pares (índice do dia, segmentos em minutos); sem segmentos se fechado.
+        """
+        if self.schedule is None:
+            return []
+        
+        overrides = []
+        for offset in range(days):
+            day = start_date + timedelta(days=offset)
+            if self.schedule.has_override(day):
+                overrides.append((offset, list(self.schedule.segments_for(day))))
+        
+        return overrides
+    
+    def _get_start_template(self, duration_minutes: int) -> np.ndarray:
+        """
+        Obtém a máscara de inícios de slot por recurso e dia da semana.
+        Os inícios são os mesmos de ClinicSchedule.slot_starts, como na grade
+        exibida aos pacientes.
+        
+        Args:
+            duration_minutes: Duração da consulta em minutos.
+            
+        Returns:
+            Matriz booleana recursos x 7 x ticks.
+        """
+        if duration_minutes not in self._start_templates:
+            template = np.zeros(self._open_templates.shape, dtype=bool)
+            for index, segments_by_weekday in enumerate(self._segments):
+                for weekday, segments in segments_by_weekday.items():
+                    self._mark_starts(template[index, weekday], segments, duration_minutes)
+            self._start_templates[duration_minutes] = template
+        
+        return self._start_templates[duration_minutes]
+    
+    def busy_mask(self, start_date: date, days: int, busy_starts: Sequence[int], busy_ends: Sequence[int]) -> np.ndarray:
+        """
+        Constrói a máscara de ocupação para um intervalo de dias.
+        
+        Args:
+            start_date: Primeiro dia do intervalo.
+            days: Número de dias.
+            busy_starts: Inícios dos intervalos ocupados (minutos no horário da clínica).
+            busy_ends: Fins dos intervalos ocupados (minutos no horário da clínica).
+            
+        Returns:
+            Matriz booleana dias x ticks, True onde há ocupação.
+        """
+        total_ticks = days * self.ticks_per_day
+        
+        if not len(busy_starts):
+            return np.zeros((days, self.ticks_per_day), dtype=bool)
+        
+        base = to_clinic_minutes(start_date)
+        starts = np.asarray(busy_starts, dtype=np.int64) - base
+        ends = np.asarray(busy_ends, dtype=np.int64) - base
+        
+        # Ticks parcialmente ocupados contam como ocupados
+        start_ticks = np.clip(np.floor_divide(starts, self.tick_minutes), 0, total_ticks)
+        end_ticks = np.clip(-np.floor_divide(-ends, self.tick_minutes), 0, total_ticks)
+        
+        # Marcar os intervalos com diferenças acumuladas
+        delta = np.zeros(total_ticks + 1, dtype=np.int32)
+        np.add.at(delta, start_ticks, 1)
+        np.add.at(delta, end_ticks, -1)
+        busy = np.cumsum(delta[:-1]) > 0
+        
+        return busy.reshape(days, self.ticks_per_day)
+    
+    def resource_busy_mask(self, start_date: date, days: int, busy_by_resource: Dict[str, Tuple[Sequence[int], Sequence[int]]]) -> np.ndarray:
+        """
+        Constrói a máscara de ocupação de cada recurso em uma única passada.
+        
+        Args:
+            start_date: Primeiro dia do intervalo.
+            days: Número de dias.
+            busy_by_resource: Intervalos ocupados (inícios, fins) por ID de recurso.
+            
+        Returns:
+            Matriz booleana recursos x dias x ticks, True onde há ocupação.
+        """
+        total_ticks = days * self.ticks_per_day
+        row_size = total_ticks + 1
+        
+        rows = []
+        starts = []
+        ends = []
+        for index, resource_id in enumerate(self.resource_ids):
+            resource_starts, resource_ends = busy_by_resource.get(resource_id, ((), ()))
+            rows.extend([index] * len(resource_starts))
+            starts.extend(resource_starts)
+            ends.extend(resource_ends)
+        
+        if not starts:
+            return np.zeros((len(self.resource_ids), days, self.ticks_per_day), dtype=bool)
+        
+        base = to_clinic_minutes(start_date)
+        start_minutes = np.asarray(starts, dtype=np.int64) - base
+        end_minutes = np.asarray(ends, dtype=np.int64) - base
+        offsets = np.array(rows, dtype=np.int64) * row_size
+        
+        # Ticks parcialmente ocupados contam como ocupados
+        start_ticks = np.clip(np.floor_divide(start_minutes, self.tick_minutes), 0, total_ticks) + offsets
+        end_ticks = np.clip(-np.floor_divide(-end_minutes, self.tick_minutes), 0, total_ticks) + offsets
+        
+        # Diferenças acumuladas por linha: uma operação para todos os recursos
+        delta = np.zeros(len(self.resource_ids) * row_size, dtype=np.int32)
+        np.add.at(delta, start_ticks, 1)
+        np.add.at(delta, end_ticks, -1)
+        busy = np.cumsum(delta.reshape(len(self.resource_ids), row_size), axis=1)[:, :-1] > 0
+        
+        return busy.reshape(len(self.resource_ids), days, self.ticks_per_day)
+    
+    def open_mask(self, start_date: date, days: int) -> np.ndarray:
+        """
+        Constrói a máscara de funcionamento para um intervalo de dias.
+        
+        Args:
+            start_date: Primeiro dia do intervalo.
+            days: Número de dias.
+            
+        Returns:
+            Matriz booleana recursos x dias x ticks, True onde o recurso está disponível.
+        """
+        weekdays = (np.arange(days) + start_date.weekday()) % 7
+        mask = self._open_templates[:, weekdays]
+        
+        # Feriados e exceções valem para todos os recursos
+        for offset, segments in self._date_overrides(start_date, days):
+            mask[:, offset] = False
+            for segment_start, segment_end in self._to_ticks(segments):
+                mask[:, offset, segment_start:segment_end] = True
+        
+        return mask
+    
+    def fitting_starts(self, free: np.ndarray, start_date: date, duration_minutes: int) -> np.ndarray:
+        """
+        Identifica os inícios de slot em que a consulta cabe inteira.
+        
+        Args:
+            free: Matriz booleana recursos x dias x ticks de ticks livres.
+            start_date: Primeiro dia do intervalo.
+            duration_minutes: Duração da consulta em minutos.
+            
+        Returns:
+            Matriz booleana com o mesmo formato de free.
+            
+        Raises:
+            ValueError: Se a duração não for um múltiplo positivo de tick_minutes.
+        """
+        if duration_minutes <= 0 or duration_minutes % self.tick_minutes:
+            raise ValueError("duration_minutes deve ser um múltiplo positivo de tick_minutes.")
+        
+        slot_ticks = duration_minutes // self.tick_minutes
+        days = free.shape[-2]
+        
+        if slot_ticks > self.ticks_per_day:
+            return np.zeros(free.shape, dtype=bool)
+        
+        # Convolução com uma janela de slot_ticks, via soma acumulada
+        counts = np.cumsum(free, axis=-1, dtype=np.int32)
+        padded = np.concatenate([np.zeros(free.shape[:-1] + (1,), dtype=np.int32), counts], axis=-1)
+        window = np.zeros(free.shape, dtype=np.int32)
+        window[..., :self.ticks_per_day - slot_ticks + 1] = padded[..., slot_ticks:] - padded[..., :-slot_ticks]
+        fits = window == slot_ticks
+        
+        weekdays = (np.arange(days) + start_date.weekday()) % 7
+        starts = self._get_start_template(duration_minutes)[:, weekdays]
+        
+        for offset, segments in self._date_overrides(start_date, days):
+            starts[:, offset] = False
+            for index in range(len(self.resource_ids)):
+                self._mark_starts(starts[index, offset], segments, duration_minutes)
+        
+        return fits & starts
+    
+    def find_slots(self, start_date: date, days: int, busy_starts: Sequence[int], busy_ends: Sequence[int], duration_minutes: int = 30, busy_by_resource: Optional[Dict[str, Tuple[Sequence[int], Sequence[int]]]] = None, with_resources: bool = False) -> List[Dict[str, Any]]:
+        """
+        Encontra todos os slots livres em um intervalo de dias.
+        Um slot está livre se algum recurso estiver livre durante toda a consulta.
+        
+        Args:
+            start_date: Primeiro dia do intervalo.
+            days: Número de dias.
+            busy_starts: Inícios dos intervalos que ocupam todos os recursos (minutos no horário da clínica).
+            busy_ends: Fins dos intervalos que ocupam todos os recursos (minutos no horário da clínica).
+            duration_minutes: Duração da consulta em minutos (padrão: 30).
+            busy_by_resource: Intervalos ocupados de cada recurso (opcional).
+            with_resources: Se True, inclui em cada slot a lista resources com os
+                recursos livres (padrão: False).
+                
+        Returns:
+            Lista de slots disponíveis no formato {date: YYYY-MM-DD, time: HH:MM}.
+        """
+        if days <= 0:
+            return []
+        
+        free = self.open_mask(start_date, days) & ~self.busy_mask(start_date, days, busy_starts, busy_ends)
+        if busy_by_resource:
+            free &= ~self.resource_busy_mask(start_date, days, busy_by_resource)
+        
+        starts = self.fitting_starts(free, start_date, duration_minutes)
+        
+        # Livre se algum recurso estiver livre
+        available = starts.any(axis=0)
+        slots = self._to_slots(start_date, available)
+        
+        if with_resources:
+            day_indexes, tick_indexes = np.nonzero(available)
+            for slot, free_resources in zip(slots, starts[:, day_indexes, tick_indexes].T.tolist()):
+                slot["resources"] = [resource_id for resource_id, is_free in zip(self.resource_ids, free_resources) if is_free]
+        
+        return slots
+    
+    def _to_slots(self, start_date: date, starts: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Converte uma matriz dias x ticks de inícios livres em slots.
+        
+        Args:
+            start_date: Primeiro dia do intervalo.
+            starts: Matriz booleana dias x ticks.
+            
+        Returns:
+            Lista de slots no formato {date: YYYY-MM-DD, time: HH:MM}.
+        """
+        day_indexes, tick_indexes = np.nonzero(starts)
+        date_labels = [(start_date + timedelta(days=offset)).isoformat() for offset in range(starts.shape[0])]
+        time_labels = self._time_labels[tick_indexes]
+        
+        return [
+            {"date": date_labels[day], "time": time_label}
+            for day, time_label in zip(day_indexes.tolist(), time_labels.tolist())
+        ]
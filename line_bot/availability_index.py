@@ -0,0 +1,354 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Slots que começam a partir deste minuto do dia contam como tarde
+NOON_MINUTES = 12 * 60
+MINUTES_PER_DAY = 24 * 60
+
+@lru_cache(maxsize=1024)
+def _decode_bitmap(bitmap: int) -> Tuple[str, ...]:
+    """
+    Converte um bitmap de slots livres em horários no formato HH:MM.
+    
+    Args:
+        bitmap: Inteiro onde o bit m indica um slot que começa m minutos após a meia-noite.
+        
+    Returns:
+        Tupla de horários livres em ordem crescente.
+    """
+    times = []
+    while bitmap:
+        lowest = bitmap & -bitmap
+        minutes = lowest.bit_length() - 1
+        times.append(f"{minutes // 60:02d}:{minutes % 60:02d}")
+        bitmap ^= lowest
+    return tuple(times)
+
+@lru_cache(maxsize=1024)
+def _count_slots(bitmap: int) -> Tuple[int, int]:
+    """
+    Conta os slots livres de um bitmap antes e a partir do meio-dia.
+    
+    Args:
+        bitmap: Inteiro onde o bit m indica um slot que começa m minutos após a meia-noite.
+        
+    Returns:
+        Tupla (manhã, tarde) com o número de slots livres.
+    """
+    morning_mask = (1 << NOON_MINUTES) - 1
+    return bin(bitmap & morning_mask).count("1"), bin(bitmap & ~morning_mask).count("1")
+
+class AvailabilityIndex:
+    """
+    Índice compartilhado de disponibilidade de horários.
+    Mantém, para cada data e recurso, um bitmap dos slots livres calculado a
+    partir de CalendarManager.get_available_slots_with_status, com um bit por
+    minuto do dia para aceitar inícios fora da grade de slot_minutes (como
+    09:15 no calendário da clínica), evitando
+    consultas aos provedores de calendário a cada exibição do seletor de horários.
+    """
+    
+    def __init__(self, calendar_manager, slot_minutes: int = 30, horizon_days: int = 14, ttl_seconds: int = 300, stale_ttl_seconds: int = 30):
+        """
+        Inicializa o índice de disponibilidade.
+        
+        Args:
+            calendar_manager: Instância do gerenciador de calendário.
+            slot_minutes: Duração de cada slot em minutos, pedida ao calendário (padrão: 30).
+            horizon_days: Número de dias carregados a cada atualização (padrão: 14).
+            ttl_seconds: Validade dos bitmaps em segundos (padrão: 300).
+            stale_ttl_seconds: Validade dos bitmaps calculados com fontes
+                indisponíveis, em segundos (padrão: 30).
+        """
+        self.calendar_manager = calendar_manager
+        self.slot_minutes = slot_minutes
+        self.horizon_days = horizon_days
+        self.ttl_seconds = ttl_seconds
+        self.stale_ttl_seconds = stale_ttl_seconds
+        
+        # Bitmaps por data (YYYY-MM-DD) e recurso, e instante de expiração
+        self._bitmaps: Dict[str, Dict[str, int]] = {}
+        self._expires_at: Dict[str, float] = {}
+        
+        # Gerações por data e do índice inteiro, incrementadas por invalidate: uma
+        # atualização não grava datas invalidadas enquanto calculava
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        
+        # Atualizações em andamento por (data inicial, dias), compartilhadas por pedidos simultâneos
+        self._inflight: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        
+        # Fontes que estavam indisponíveis na última atualização
+        self.stale_sources: List[str] = []
+        self._lock = threading.Lock()
+    
+    def get_free_times(self, date_str: str, exclude: Iterable[Tuple[str, str]] = ()) -> List[str]:
+        """
+        Obtém os horários de uma data em que algum recurso está livre.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD.
+            exclude: Pares (recurso, HH:MM) a desconsiderar, como reservas temporárias (opcional).
+            
+        Returns:
+            Lista de horários livres no formato HH:MM.
+        """
+        combined = self._combine(self._get_bitmaps(date_str), exclude)
+        return list(_decode_bitmap(combined))
+    
+    def get_summary(self, start_date: str, days: int, exclude: Optional[Dict[str, Iterable[Tuple[str, str]]]] = None) -> List[Dict[str, Any]]:
+        """
+        Conta os slots livres de cada dia de um intervalo, no dia inteiro e por período.
+        Os dias ausentes ou vencidos no índice são recarregados em uma única
+        atualização; os demais vêm dos bitmaps já calculados.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            days: Número de dias.
+            exclude: Pares (recurso, HH:MM) a desconsiderar por data (opcional).
+            
+        Returns:
+            Lista com {date, free, morning, afternoon} para cada dia.
+        """
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+        dates = [(start_dt + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days)]
+        exclude = exclude or {}
+        
+        # Recarregar de uma vez o trecho que contém todos os dias vencidos
+        now = time.monotonic()
+        with self._lock:
+            expired = [index for index, date_str in enumerate(dates) if not now < self._expires_at.get(date_str, 0)]
+        
+        refreshed = {}
+        if expired:
+            refreshed = self.refresh(dates[expired[0]], expired[-1] - expired[0] + 1)
+        
+        summary = []
+        for date_str in dates:
+            if date_str in refreshed:
+                bitmaps = refreshed[date_str]
+            else:
+                with self._lock:
+                    bitmaps = self._bitmaps.get(date_str, {})
+            
+            morning, afternoon = _count_slots(self._combine(bitmaps, exclude.get(date_str, ())))
+            summary.append({
+                "date": date_str,
+                "free": morning + afternoon,
+                "morning": morning,
+                "afternoon": afternoon
+            })
+        
+        return summary
+    
+    def _combine(self, bitmaps: Dict[str, int], exclude: Iterable[Tuple[str, str]] = ()) -> int:
+        """
+        Combina os bitmaps dos recursos em um bitmap dos slots com algum recurso livre.
+        
+        Args:
+            bitmaps: Bitmaps dos slots livres por recurso.
+            exclude: Pares (recurso, HH:MM) a desconsiderar (opcional).
+            
+        Returns:
+            Bitmap combinado.
+        """
+        bitmaps = dict(bitmaps)
+        
+        for resource_id, time_str in exclude:
+            slot = self._slot_index(time_str)
+            if slot is not None and resource_id in bitmaps:
+                bitmaps[resource_id] &= ~(1 << slot)
+        
+        combined = 0
+        for bitmap in bitmaps.values():
+            combined |= bitmap
+        
+        return combined
+    
+    def is_free(self, date_str: str, time_str: str) -> bool:
+        """
+        Verifica se algum recurso está livre em um horário.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD.
+            time_str: Horário no formato HH:MM.
+            
+        Returns:
+            True se o slot estiver livre, False caso contrário.
+        """
+        return bool(self.get_free_resources(date_str, time_str))
+    
+    def get_free_resources(self, date_str: str, time_str: str) -> List[str]:
+        """
+        Obtém os recursos livres em um horário.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD.
+            time_str: Horário no formato HH:MM.
+            
+        Returns:
+            Lista de IDs de recursos livres.
+        """
+        slot = self._slot_index(time_str)
+        if slot is None:
+            return []
+        
+        bitmaps = self._get_bitmaps(date_str)
+        return [resource_id for resource_id, bitmap in bitmaps.items() if bitmap >> slot & 1]
+    
+    def _slot_index(self, time_str: str) -> Optional[int]:
+        """
+        Converte um horário HH:MM na posição do slot no bitmap (minutos desde a meia-noite).
+        
+        Args:
+            time_str: Horário no formato HH:MM.
+            
+        Returns:
+            Posição do slot, ou None se o horário estiver fora do dia.
+        """
+        hours, minutes = map(int, time_str.split(":"))
+        offset = hours * 60 + minutes
+        if not 0 <= offset < MINUTES_PER_DAY:
+            return None
+        return offset
+    
+    def refresh(self, start_date: str, days: Optional[int] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Recarrega os bitmaps de um intervalo de datas a partir do calendário.
+        Pedidos simultâneos do mesmo intervalo aguardam uma única atualização,
+        desde que nenhuma das datas tenha sido invalidada depois que ela começou.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            days: Número de dias a carregar (padrão: horizon_days).
+            
+        Returns:
+            Bitmaps calculados por data e recurso.
+        """
+        days = days or self.horizon_days
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+        dates = [(start_dt + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days)]
+        key = (start_date, days)
+        
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None and self._unchanged(entry):
+                future = entry["future"]
+            else:
+                entry = {
+                    "future": Future(),
+                    "epoch": self._epoch,
+                    "generations": {date_str: self._generations.get(date_str, 0) for date_str in dates}
+                }
+                self._inflight[key] = entry
+                future = None
+        
+        if future is not None:
+            return future.result()
+        
+        try:
+            bitmaps = self._load(start_date, days, entry)
+            entry["future"].set_result(bitmaps)
+            return bitmaps
+        except Exception as e:
+            entry["future"].set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+    
+    def _unchanged(self, entry: Dict[str, Any]) -> bool:
+        """
+        Verifica se nenhuma data de uma atualização foi invalidada desde o seu início.
+        Chamado com o lock adquirido.
+        """
+        if entry["epoch"] != self._epoch:
+            return False
+        return all(self._generations.get(date_str, 0) == generation for date_str, generation in entry["generations"].items())
+    
+    def _load(self, start_date: str, days: int, entry: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        """
+        Calcula os bitmaps de um intervalo e grava no índice as datas não invalidadas durante o cálculo.
+        """
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+        end_date = (start_dt + timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        
+        result = self.calendar_manager.get_available_slots_with_status(start_date, end_date, self.slot_minutes, with_resources=True)
+        slots = result["slots"]
+        
+        # Datas sem slots livres ficam sem bitmaps
+        bitmaps = {
+            (start_dt + timedelta(days=offset)).strftime("%Y-%m-%d"): {}
+            for offset in range(days)
+        }
+        
+        for slot in slots:
+            index = self._slot_index(slot["time"])
+            if index is None or slot["date"] not in bitmaps:
+                continue
+            day_bitmaps = bitmaps[slot["date"]]
+            for resource_id in slot["resources"]:
+                day_bitmaps[resource_id] = day_bitmaps.get(resource_id, 0) | 1 << index
+        
+        # Resultados parciais expiram antes para buscar as fontes atrasadas
+        ttl = self.stale_ttl_seconds if result["partial"] else self.ttl_seconds
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            # Datas invalidadas durante o cálculo podem ter mudado: não gravar os bitmaps anteriores
+            if entry["epoch"] == self._epoch:
+                for date_str, day_bitmaps in bitmaps.items():
+                    if self._generations.get(date_str, 0) == entry["generations"][date_str]:
+                        self._bitmaps[date_str] = day_bitmaps
+                        self._expires_at[date_str] = expires_at
+            self.stale_sources = result["stale_sources"]
+        
+        if result["partial"]:
+            logger.warning(f"Índice de disponibilidade atualizado sem as fontes: {', '.join(result['stale_sources'])}")
+        
+        logger.info(f"Índice de disponibilidade atualizado: {start_date} a {end_date}")
+        
+        return bitmaps
+    
+    def invalidate(self, date_str: Optional[str] = None):
+        """
+        Invalida os bitmaps de uma data ou de todo o índice.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD (opcional, padrão: todas as datas).
+        """
+        with self._lock:
+            if date_str is None:
+                self._epoch += 1
+                self._bitmaps.clear()
+                self._expires_at.clear()
+            else:
+                self._generations[date_str] = self._generations.get(date_str, 0) + 1
+                self._bitmaps.pop(date_str, None)
+                self._expires_at.pop(date_str, None)
+    
+    def _get_bitmaps(self, date_str: str) -> Dict[str, int]:
+        """
+        Obtém os bitmaps de uma data, recarregando o horizonte se necessário.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD.
+            
+        Returns:
+            Bitmaps dos slots livres da data por recurso.
+        """
+        with self._lock:
+            expires_at = self._expires_at.get(date_str)
+            if expires_at is not None and time.monotonic() < expires_at:
+                return self._bitmaps[date_str]
+        
+        return self.refresh(date_str).get(date_str, {})
@@ -0,0 +1,101 @@
+"""
+Benchmark da leitura em blocos de feeds iCal grandes.
+
+Gera um arquivo .ics de vários megabytes (anos de histórico de uma clínica
+com vários dentistas) e compara o pico de memória e o tempo da interpretação
+completa com icalendar.Calendar.from_ical e do leitor iter_vevents.
+
+Uso:
+    python benchmarks/bench_ical_stream.py [anos]
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ical_feed import expand_ical_events, iter_vevents
+
+def _write_fixture(path: str, years: int, events_per_day: int = 16):
+    """
+    Escreve um feed sintético com eventos de 30 minutos em dias úteis.
+    """
+    start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=365 * years)
+    with open(path, "w", newline="") as f:
+        f.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//benchmark//EN\r\n")
+        for day in range(365 * years + 60):
+            current = start + timedelta(days=day)
+            if current.weekday() >= 5:
+                continue
+            for slot in range(events_per_day):
+                event_start = current.replace(hour=0) + timedelta(minutes=30 * slot)
+                event_end = event_start + timedelta(minutes=30)
+                f.write(
+                    "BEGIN:VEVENT\r\n"
+                    f"UID:{day}-{slot}@benchmark\r\n"
+                    f"SUMMARY:Consulta {day}-{slot}\r\n"
+                    f"DESCRIPTION:Paciente de teste com uma descrição longa o bastante para\r\n"
+                    f" ocupar uma linha dobrada no arquivo gerado ({day}/{slot})\r\n"
+                    f"DTSTART:{event_start.strftime('%Y%m%dT%H%M%SZ')}\r\n"
+                    f"DTEND:{event_end.strftime('%Y%m%dT%H%M%SZ')}\r\n"
+                    "END:VEVENT\r\n"
+                )
+        f.write("END:VCALENDAR\r\n")
+
+def _read_chunks(path: str, chunk_size: int = 64 * 1024):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def _measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+def main():
+    import icalendar
+    
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    
+    now = datetime.now(timezone.utc)
+    window_start = now - timedelta(days=7)
+    window_end = now + timedelta(days=30)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "feed.ics")
+        _write_fixture(path, years)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        
+        def full_parse():
+            with open(path, "rb") as f:
+                calendar = icalendar.Calendar.from_ical(f.read())
+            return len(expand_ical_events(calendar, window_start, window_end))
+        
+        def streaming_parse():
+            calendar = icalendar.Calendar()
+            for event in iter_vevents(_read_chunks(path), window_start, window_end):
+                calendar.add_component(event)
+            return len(expand_ical_events(calendar, window_start, window_end))
+        
+        full_time, full_peak, full_count = _measure(full_parse)
+        stream_time, stream_peak, stream_count = _measure(streaming_parse)
+        
+        assert full_count == stream_count, "Os dois leitores encontraram eventos diferentes"
+        
+        print(f"Feed: {size_mb:.1f} MB, {stream_count} eventos na janela")
+        print(f"{'leitor':>12} {'tempo (s)':>10} {'pico (MB)':>10}")
+        print(f"{'completo':>12} {full_time:>10.2f} {full_peak / (1024 * 1024):>10.1f}")
+        print(f"{'em blocos':>12} {stream_time:>10.2f} {stream_peak / (1024 * 1024):>10.1f}")
+
+if __name__ == "__main__":
+    main()
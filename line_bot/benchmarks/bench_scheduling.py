@@ -0,0 +1,108 @@
+"""
+Benchmark do caminho de agendamento com provedores simulados.
+
+Liga o CalendarManager às simulações de Google Calendar, Outlook, iCal e
+Supabase (provider_sim) e mede vazão e latência (p50/p95) de get_events,
+get_available_slots e create_calendar_event, além da entrega da fila de
+calendário, para clínicas de 1, 10 e 100 cadeiras.
+
+Uso:
+    python benchmarks/bench_scheduling.py [latencia_ms] [taxa_de_falha] [escalas]
+
+Exemplo:
+    python benchmarks/bench_scheduling.py 20 0.05 1,10
+"""
+import os
+import sys
+import time
+import logging
+from datetime import timedelta
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from provider_sim import SimulationProfile, build_simulated_manager
+
+def _measure(func: Callable, calls: List[Tuple]) -> Tuple[float, float, float]:
+    """
+    Executa func para cada tupla de argumentos e mede cada chamada.
+    
+    Returns:
+        Tupla (chamadas por segundo, p50 em ms, p95 em ms).
+    """
+    latencies = []
+    started = time.perf_counter()
+    for args in calls:
+        call_started = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+    return len(calls) / elapsed, p50, p95
+
+def _drain_outbox(manager) -> int:
+    delivered = 0
+    while True:
+        processed = manager.process_calendar_outbox()
+        if not processed:
+            return delivered
+        delivered += processed
+
+def run(scale: int, latency: float, failure_rate: float, repeat: int = 20):
+    profile = SimulationProfile(scale=scale, latency=latency, jitter=latency / 2, failure_rate=failure_rate)
+    
+    setup_started = time.perf_counter()
+    manager, supabase = build_simulated_manager(profile)
+    setup_time = time.perf_counter() - setup_started
+    
+    # Janelas de uma semana em dias diferentes do período simulado
+    windows = []
+    for index in range(repeat):
+        start = profile.start_date + timedelta(days=index % max(1, profile.days - 7))
+        windows.append((start.isoformat(), (start + timedelta(days=6)).isoformat()))
+    
+    # Novos agendamentos confirmados que ainda não têm evento nos calendários
+    appointment_ids = []
+    for index in range(repeat):
+        day = profile.dates()[index % len(profile.dates())]
+        appointment = supabase.create_appointment(day.isoformat(), "08:30", 1 + index, f"sim-{index % scale}", status="confirmed", delay=False)
+        appointment_ids.append((appointment["id"],))
+    
+    rows = [
+        ("get_events", *_measure(manager.get_events, windows)),
+        ("get_available_slots", *_measure(manager.get_available_slots, windows)),
+        ("create_calendar_event", *_measure(manager.create_calendar_event, appointment_ids))
+    ]
+    
+    drain_started = time.perf_counter()
+    delivered = _drain_outbox(manager)
+    drain_time = time.perf_counter() - drain_started
+    
+    events = len(supabase.appointments) + sum(
+        len(source.events_by_id) for source in (manager.google_calendar, manager.outlook_client)
+    )
+    print(f"\nEscala {scale}x: {scale} cadeira(s), {events} eventos, preparação em {setup_time:.2f}s")
+    print(f"{'operação':>22} {'ops/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+    for name, throughput, p50, p95 in rows:
+        print(f"{name:>22} {throughput:>9.1f} {p50:>9.2f} {p95:>9.2f}")
+    print(f"{'entrega da fila':>22} {delivered / max(drain_time, 1e-9):>9.1f} tarefas/s ({delivered} tarefas, {manager.calendar_outbox.get_stats()['pending']} pendentes)")
+    
+    manager.stop_outbox_workers()
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.0
+    failure_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    scales = [int(scale) for scale in sys.argv[3].split(",")] if len(sys.argv) > 3 else [1, 10, 100]
+    
+    # Falhas simuladas geram logs de erro esperados
+    logging.disable(logging.ERROR)
+    
+    print(f"Latência simulada: {latency * 1000:.0f} ms, taxa de falhas: {failure_rate:.0%}")
+    for scale in scales:
+        run(scale, latency, failure_rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark da detecção de conflitos de CalendarManager._filter_available_slots.
+
+Gera calendários sintéticos com milhares de eventos e compara a varredura
+por intervalos ordenados e o motor vetorizado de bitmaps com a comparação
+slot × evento original.
+
+Uso:
+    python benchmarks/bench_slot_filter.py
+"""
+import os
+import sys
+import time
+import random
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calendar_manager import CalendarManager
+from provider_sim import isolated_environment
+
+class _EmptySupabaseManager:
+    def get_appointments_by_date_range(self, start_date, end_date, clinic_id=None):
+        return []
+
+def _naive_filter(all_slots, existing_events, duration_minutes):
+    """
+    Implementação original O(slots × eventos), usada como referência.
+    """
+    available_slots = []
+    for slot in all_slots:
+        slot_datetime = datetime.strptime(f"{slot['date']} {slot['time']}", "%Y-%m-%d %H:%M")
+        slot_end_datetime = slot_datetime + timedelta(minutes=duration_minutes)
+        conflict = False
+        for event in existing_events:
+            event_start = datetime.fromisoformat(event["start"].replace("Z", "+00:00"))
+            event_end = datetime.fromisoformat(event["end"].replace("Z", "+00:00"))
+            if event_start.tzinfo:
+                event_start = event_start.astimezone(None).replace(tzinfo=None)
+            if event_end.tzinfo:
+                event_end = event_end.astimezone(None).replace(tzinfo=None)
+            if slot_datetime < event_end and slot_end_datetime > event_start:
+                conflict = True
+                break
+        if not conflict:
+            available_slots.append(slot)
+    return available_slots
+
+def _synthetic_events(start: datetime, days: int, events_per_day: int, seed: int = 42):
+    """
+    Gera eventos aleatórios de 15 a 90 minutos dentro do horário comercial.
+    """
+    rng = random.Random(seed)
+    events = []
+    for day in range(days):
+        base = start + timedelta(days=day)
+        for i in range(events_per_day):
+            event_start = base.replace(hour=9) + timedelta(minutes=rng.randrange(0, 9 * 60, 5))
+            event_end = event_start + timedelta(minutes=rng.choice([15, 30, 45, 60, 90]))
+            events.append({
+                "id": f"evt-{day}-{i}",
+                "title": "Busy",
+                "start": event_start.isoformat(),
+                "end": event_end.isoformat(),
+                "source": "benchmark"
+            })
+    return events
+
+def _timed(func, *args, repeat: int = 3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    with isolated_environment():
+        manager = CalendarManager(_EmptySupabaseManager())
+    start = datetime(2025, 5, 1)
+    days = 31
+    duration_minutes = 30
+    
+    all_slots = manager._generate_all_slots(start, start + timedelta(days=days), duration_minutes)
+    
+    print(f"{'eventos':>8} {'slots':>6} {'original (s)':>13} {'intervalos (s)':>15} {'motor (s)':>10}")
+    for events_per_day in (10, 50, 100, 200):
+        events = _synthetic_events(start, days, events_per_day)
+        
+        indexed_time, indexed = _timed(manager._filter_available_slots, all_slots, events, duration_minutes)
+        naive_time, naive = _timed(_naive_filter, all_slots, events, duration_minutes, repeat=1)
+        
+        def engine_search():
+            busy_starts, busy_ends = manager._build_busy_intervals(events)
+            return manager.availability_engine.find_slots(start.date(), days, busy_starts, busy_ends, duration_minutes)
+        
+        engine_time, engine = _timed(engine_search)
+        
+        assert indexed == naive == engine, "Resultados divergentes entre as implementações"
+        
+        print(f"{len(events):>8} {len(all_slots):>6} {naive_time:>13.4f} {indexed_time:>15.4f} {engine_time:>10.4f}")
+
+if __name__ == "__main__":
+    main()
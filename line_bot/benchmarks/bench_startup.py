@@ -0,0 +1,74 @@
+"""
+Benchmark do custo de inicialização do ReportingManager.
+
+Mede, em processos novos, o tempo para importar reporting_manager e criar o
+ReportingManager e o pico de memória (RSS) do processo, como no worker do
+webhook, que nunca gera gráficos. Compara com o carregamento antecipado de
+pandas, matplotlib e seaborn (comportamento anterior) e mostra onde o custo
+passa a ser pago: no primeiro relatório.
+
+Uso:
+    python benchmarks/bench_startup.py [repeticoes]
+"""
+import os
+import sys
+import json
+import subprocess
+from typing import Any, Dict, List
+
+LINE_BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PRELUDE = """
+import sys, time, json, resource
+sys.path.insert(0, {path!r})
+started = time.perf_counter()
+"""
+
+_EPILOGUE = """
+elapsed = time.perf_counter() - started
+heavy = [name for name in ("pandas", "matplotlib", "seaborn") if name in sys.modules]
+print(json.dumps({"seconds": elapsed, "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "heavy": heavy}))
+"""
+
+_MANAGER = """
+from chart_renderer import ChartRenderer
+from report_rollups import ReportRollupStore
+from reporting_manager import ReportingManager
+
+class Supabase:
+    def get_appointments_by_date_range(self, start_date, end_date, clinic_id=None):
+        return [{"id": 1, "patient_id": 1, "appointment_date": "2025-05-01", "appointment_time": "10:00", "status": "confirmed", "language": "ja"}]
+
+# Contagens em memória: cada execução agrega do zero, sem tocar o arquivo compartilhado
+manager = ReportingManager(Supabase(), rollups=ReportRollupStore(), chart_renderer=ChartRenderer(max_workers=0))
+"""
+
+SCENARIOS = {
+    # Importações no topo do módulo e sns.set no construtor, como antes
+    "antecipado": """
+import pandas, matplotlib.pyplot, seaborn
+seaborn.set(style="whitegrid")
+""" + _MANAGER,
+    "webhook (sob demanda)": _MANAGER,
+    "primeiro relatório": _MANAGER + """
+manager.generate_appointment_report("2025-05-01", "2025-05-31")
+"""
+}
+
+def _run(body: str) -> Dict[str, Any]:
+    code = _PRELUDE.format(path=LINE_BOT_DIR) + body + _EPILOGUE
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    
+    print(f"{'cenário':>22} {'tempo (ms)':>11} {'RSS (MB)':>9}  módulos pesados")
+    for name, body in SCENARIOS.items():
+        results: List[Dict[str, Any]] = [_run(body) for _ in range(repeat)]
+        seconds = sorted(result["seconds"] for result in results)[len(results) // 2]
+        rss = sorted(result["rss_mb"] for result in results)[len(results) // 2]
+        print(f"{name:>22} {seconds * 1000:>11.0f} {rss:>9.1f}  {', '.join(results[0]['heavy']) or '-'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""
+Simulação local dos provedores de calendário do CalendarManager.
+
+Substitui Google Calendar, Microsoft Graph (Outlook), o feed iCal e o
+Supabase por implementações em memória com densidade de eventos, eventos
+recorrentes, latência e taxa de falhas configuráveis. Os dados gerados
+dependem só da semente, então duas execuções com o mesmo perfil produzem os
+mesmos calendários e as medições podem ser comparadas entre versões.
+
+Uso:
+    from provider_sim import SimulationProfile, build_simulated_manager
+    manager, supabase = build_simulated_manager(SimulationProfile(scale=10))
+"""
+import os
+import sys
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_time import clinic_isoformat, clinic_now, parse_datetime, to_clinic_minutes
+from ical_feed import ICalEventIndex
+
+# Armazenamentos em memória e consultas diretas aos provedores simulados: cada
+# execução começa do zero e nunca grava no arquivo compartilhado (line_bot/data)
+ISOLATED_ENV = {
+    "EVENT_STORE_PATH": ":memory:",
+    "SLOT_HOLD_PATH": ":memory:",
+    "CALENDAR_OUTBOX_PATH": ":memory:",
+    "REPORT_ROLLUP_PATH": ":memory:",
+    "CALENDAR_SYNC_MODE": "live"
+}
+
+@contextmanager
+def isolated_environment(**overrides: str) -> Iterator[None]:
+    """
+    Aplica ISOLATED_ENV (e overrides) às variáveis de ambiente e restaura os valores anteriores ao sair.
+    
+    Args:
+        **overrides: Variáveis adicionais, como CLINIC_RESOURCES.
+    """
+    values = {**ISOLATED_ENV, **overrides}
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+class SimulationProfile:
+    """
+    Parâmetros de uma simulação. Os valores de densidade são os de uma clínica
+    com uma cadeira e são multiplicados por scale.
+    """
+    
+    def __init__(self, scale: int = 1, days: int = 30, google_per_day: int = 2, outlook_per_day: int = 1, ical_per_day: int = 1, appointments_per_day: int = 10, recurring_ratio: float = 0.2, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 42):
+        """
+        Inicializa o perfil.
+        
+        Args:
+            scale: Tamanho da clínica em cadeiras; multiplica a densidade de eventos (padrão: 1).
+            days: Dias com eventos gerados a partir do próximo dia (padrão: 30).
+            google_per_day: Eventos do Google Calendar por dia e cadeira (padrão: 2).
+            outlook_per_day: Eventos do Outlook por dia e cadeira (padrão: 1).
+            ical_per_day: Eventos avulsos do feed iCal por dia e cadeira (padrão: 1).
+            appointments_per_day: Agendamentos no Supabase por dia e cadeira (padrão: 10).
+            recurring_ratio: Fração dos eventos iCal criada como série semanal (padrão: 0.2).
+            latency: Latência média de cada chamada a um provedor em segundos (padrão: 0).
+            jitter: Variação máxima da latência em segundos, para mais ou para menos (padrão: 0).
+            failure_rate: Probabilidade de uma chamada falhar (padrão: 0).
+            seed: Semente dos dados e das falhas (padrão: 42).
+        """
+        self.scale = scale
+        self.days = days
+        self.google_per_day = google_per_day
+        self.outlook_per_day = outlook_per_day
+        self.ical_per_day = ical_per_day
+        self.appointments_per_day = appointments_per_day
+        self.recurring_ratio = recurring_ratio
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.seed = seed
+        
+        # Os dados começam no dia seguinte, dentro do horizonte do índice iCal
+        self.start_date = clinic_now().date() + timedelta(days=1)
+    
+    def dates(self) -> List[date]:
+        """
+        Obtém os dias úteis simulados (segunda a sábado).
+        
+        Returns:
+            Lista de datas.
+        """
+        days = [self.start_date + timedelta(days=offset) for offset in range(self.days)]
+        return [day for day in days if day.weekday() < 6]
+
+class SimulatedHttpError(Exception):
+    """
+    Erro HTTP simulado, com status em resp.status como no googleapiclient
+    e em response.status_code como no requests.
+    """
+    
+    def __init__(self, status: int, message: str = "Simulated provider error"):
+        super().__init__(f"{status} {message}")
+        self.resp = type("Response", (), {"status": status})()
+        self.response = type("Response", (), {"status_code": status})()
+
+class _SimulatedProvider:
+    """
+    Base dos provedores simulados: latência e falhas sorteadas por chamada,
+    com contadores para conferir o número de chamadas de cada operação.
+    """
+    
+    def __init__(self, profile: SimulationProfile, name: str):
+        self.profile = profile
+        self.name = name
+        self.calls: Dict[str, int] = {}
+        self._rng = random.Random(f"{profile.seed}-{name}-calls")
+        self._lock = threading.Lock()
+    
+    def _call(self, operation: str):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            delay = self.profile.latency + self._rng.uniform(-self.profile.jitter, self.profile.jitter)
+            failed = self._rng.random() < self.profile.failure_rate
+        
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            raise SimulatedHttpError(503, f"{self.name} indisponível ({operation})")
+
+def _busy_periods(profile: SimulationProfile, name: str, per_day: int) -> List[Tuple[datetime, int]]:
+    """
+    Sorteia eventos de 15 a 90 minutos entre 09:00 e 18:00 no horário da clínica.
+    """
+    rng = random.Random(f"{profile.seed}-{name}-events")
+    periods = []
+    for day in profile.dates():
+        for _ in range(per_day * profile.scale):
+            start = datetime.combine(day, datetime.min.time()) + timedelta(minutes=540 + rng.randrange(0, 540, 15))
+            periods.append((start, rng.choice((15, 30, 45, 60, 90))))
+    return periods
+
+def _utc(value: datetime) -> datetime:
+    return parse_datetime(value).astimezone(timezone.utc)
+
+class FakeGoogleCalendar(_SimulatedProvider):
+    """
+    Serviço do Google Calendar (googleapiclient) em memória: events().list,
+    insert, update e delete, e requisições em lote com new_batch_http_request.
+    """
+    
+    def __init__(self, profile: SimulationProfile):
+        super().__init__(profile, "google")
+        self.events_by_id: Dict[str, Dict[str, Any]] = {}
+        
+        for index, (start, minutes) in enumerate(_busy_periods(profile, "google", profile.google_per_day)):
+            self.events_by_id[f"g{index}"] = {
+                "id": f"g{index}",
+                "summary": "Reunião",
+                "start": {"dateTime": clinic_isoformat(start)},
+                "end": {"dateTime": clinic_isoformat(start + timedelta(minutes=minutes))}
+            }
+    
+    def events(self) -> "_GoogleEvents":
+        return _GoogleEvents(self)
+    
+    def new_batch_http_request(self, callback: Callable) -> "_GoogleBatch":
+        return _GoogleBatch(self, callback)
+
+class _GoogleRequest:
+    def __init__(self, service: FakeGoogleCalendar, operation: str, func: Callable[[], Any]):
+        self.service = service
+        self.operation = operation
+        self.func = func
+    
+    def execute(self) -> Any:
+        self.service._call(self.operation)
+        return self.func()
+
+class _GoogleEvents:
+    def __init__(self, service: FakeGoogleCalendar):
+        self.service = service
+    
+    def list(self, calendarId: str, timeMin: str, timeMax: str, **kwargs) -> _GoogleRequest:
+        def run():
+            start, end = to_clinic_minutes(timeMin), to_clinic_minutes(timeMax)
+            items = [
+                event for event in self.service.events_by_id.values()
+                if event.get("status") != "cancelled"
+                and to_clinic_minutes(event["start"]["dateTime"]) < end
+                and to_clinic_minutes(event["end"]["dateTime"]) > start
+            ]
+            return {"items": sorted(items, key=lambda event: event["start"]["dateTime"])}
+        return _GoogleRequest(self.service, "list", run)
+    
+    def insert(self, calendarId: str, body: Dict[str, Any]) -> _GoogleRequest:
+        def run():
+            event_id = body.get("id") or f"g{len(self.service.events_by_id)}"
+            if event_id in self.service.events_by_id:
+                raise SimulatedHttpError(409, "The requested identifier already exists.")
+            self.service.events_by_id[event_id] = {**body, "id": event_id}
+            return self.service.events_by_id[event_id]
+        return _GoogleRequest(self.service, "insert", run)
+    
+    def update(self, calendarId: str, eventId: str, body: Dict[str, Any]) -> _GoogleRequest:
+        def run():
+            if eventId not in self.service.events_by_id:
+                raise SimulatedHttpError(404, "Not Found")
+            self.service.events_by_id[eventId] = {**body, "id": eventId}
+            return self.service.events_by_id[eventId]
+        return _GoogleRequest(self.service, "update", run)
+    
+    def delete(self, calendarId: str, eventId: str) -> _GoogleRequest:
+        def run():
+            if self.service.events_by_id.pop(eventId, None) is None:
+                raise SimulatedHttpError(410, "Resource has been deleted")
+        return _GoogleRequest(self.service, "delete", run)
+
+class _GoogleBatch:
+    def __init__(self, service: FakeGoogleCalendar, callback: Callable):
+        self.service = service
+        self.callback = callback
+        self.requests: List[Tuple[str, _GoogleRequest]] = []
+    
+    def add(self, request: _GoogleRequest, request_id: str):
+        self.requests.append((request_id, request))
+    
+    def execute(self):
+        # Um lote custa uma única ida ao provedor; cada item pode falhar sozinho
+        self.service._call("batch")
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.func(), None)
+            except SimulatedHttpError as e:
+                self.callback(request_id, None, e)
+
+class FakeGraphClient(_SimulatedProvider):
+    """
+    OutlookGraphClient em memória: calendarView com horários em UTC, criação,
+    atualização e remoção de eventos.
+    """
+    
+    base_url = "https://graph.microsoft.com/v1.0"
+    
+    def __init__(self, profile: SimulationProfile):
+        super().__init__(profile, "outlook")
+        self.events_by_id: Dict[str, Dict[str, Any]] = {}
+        
+        for index, (start, minutes) in enumerate(_busy_periods(profile, "outlook", profile.outlook_per_day)):
+            # O Graph responde em UTC por padrão
+            start_utc = _utc(start).replace(tzinfo=None)
+            self.events_by_id[f"o{index}"] = {
+                "id": f"o{index}",
+                "subject": "Fornecedor",
+                "start": {"dateTime": f"{start_utc.isoformat()}.0000000", "timeZone": "UTC"},
+                "end": {"dateTime": f"{(start_utc + timedelta(minutes=minutes)).isoformat()}.0000000", "timeZone": "UTC"}
+            }
+    
+    def get_json(self, url: str) -> Dict[str, Any]:
+        self._call("get")
+        query = parse_qs(urlparse(url).query)
+        start = to_clinic_minutes(query["startDateTime"][0] + "+00:00")
+        end = to_clinic_minutes(query["endDateTime"][0] + "+00:00")
+        
+        value = []
+        for event in self.events_by_id.values():
+            event_start = to_clinic_minutes(event["start"]["dateTime"] + "+00:00")
+            event_end = to_clinic_minutes(event["end"]["dateTime"] + "+00:00")
+            if event_start < end and event_end > start:
+                value.append(event)
+        return {"value": value}
+    
+    def post_json(self, url: str, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        self._call("post")
+        # transactionId torna a criação idempotente, como no Graph
+        for event in self.events_by_id.values():
+            if body.get("transactionId") and event.get("transactionId") == body["transactionId"]:
+                return event
+        event_id = f"o{len(self.events_by_id)}"
+        self.events_by_id[event_id] = {**body, "id": event_id}
+        return self.events_by_id[event_id]
+    
+    def request(self, method: str, url: str, **kwargs):
+        self._call(method.lower())
+        event_id = url.rsplit("/", 1)[-1]
+        if event_id not in self.events_by_id:
+            raise SimulatedHttpError(404, "Not Found")
+        if method == "DELETE":
+            del self.events_by_id[event_id]
+        else:
+            self.events_by_id[event_id].update(kwargs.get("json") or {})
+
+class FakeICalFeed(_SimulatedProvider):
+    """
+    ICalFeedCache com um calendário gerado: eventos avulsos e séries semanais
+    (RRULE) com horários em UTC.
+    """
+    
+    def __init__(self, profile: SimulationProfile):
+        super().__init__(profile, "ical")
+        import icalendar
+        
+        rng = random.Random(f"{profile.seed}-ical-series")
+        self.calendar = icalendar.Calendar()
+        self.calendar.add("prodid", "-//simulation//EN")
+        self.calendar.add("version", "2.0")
+        self.version = 1
+        
+        for index, (start, minutes) in enumerate(_busy_periods(profile, "ical", profile.ical_per_day)):
+            start_utc = _utc(start)
+            event = icalendar.Event()
+            event.add("uid", f"i{index}@simulation")
+            event.add("summary", "Plantão")
+            event.add("dtstart", start_utc)
+            event.add("dtend", start_utc + timedelta(minutes=minutes))
+            if rng.random() < profile.recurring_ratio:
+                event.add("rrule", {"freq": "weekly", "count": max(1, profile.days // 7)})
+            self.calendar.add_component(event)
+    
+    def get_calendar(self):
+        self._call("get")
+        return self.calendar
+    
+    def refresh(self):
+        self._call("refresh")
+
+class FakeSupabaseManager(_SimulatedProvider):
+    """
+    SupabaseManager em memória com os métodos usados pelo CalendarManager.
+    Os agendamentos são distribuídos entre as cadeiras sim-0 a sim-N.
+    """
+    
+    def __init__(self, profile: SimulationProfile):
+        super().__init__(profile, "supabase")
+        rng = random.Random(f"{profile.seed}-supabase")
+        self.patients = {index: {"id": index, "name": f"Paciente {index}"} for index in range(1, 200 * profile.scale + 1)}
+        self.appointments: Dict[str, Dict[str, Any]] = {}
+        
+        for day in profile.dates():
+            for chair in range(profile.scale):
+                times = rng.sample(range(540, 1080, 30), min(profile.appointments_per_day, 18))
+                for minutes in times:
+                    self.create_appointment(day.isoformat(), f"{minutes // 60:02d}:{minutes % 60:02d}", rng.choice(list(self.patients)), f"sim-{chair}", status="confirmed", delay=False)
+    
+    def create_appointment(self, appointment_date: str, appointment_time: str, patient_id: int, resource_id: Optional[str] = None, status: str = "pending", delay: bool = True) -> Dict[str, Any]:
+        if delay:
+            self._call("insert")
+        appointment_id = str(len(self.appointments) + 1)
+        self.appointments[appointment_id] = {
+            "id": appointment_id,
+            "patient_id": patient_id,
+            "appointment_date": appointment_date,
+            "appointment_time": appointment_time,
+            "status": status,
+            "reason": "Revisão",
+            "resource_id": resource_id
+        }
+        return self.appointments[appointment_id]
+    
+    def get_appointments_by_date_range(self, start_date: str, end_date: str, clinic_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        self._call("range")
+        return [
+            appointment for appointment in self.appointments.values()
+            if start_date <= appointment["appointment_date"] <= end_date and appointment["status"] != "cancelled"
+        ]
+    
+    def get_appointment_by_id(self, appointment_id: Any) -> Optional[Dict[str, Any]]:
+        self._call("get")
+        return self.appointments.get(str(appointment_id))
+    
+    def get_patients_by_ids(self, patient_ids: List[Any]) -> List[Dict[str, Any]]:
+        self._call("patients")
+        return [self.patients[patient_id] for patient_id in patient_ids if patient_id in self.patients]
+    
+    def get_patient_by_id(self, patient_id: Any) -> Optional[Dict[str, Any]]:
+        self._call("patient")
+        return self.patients.get(patient_id)
+    
+    def update_appointment_status(self, appointment_id: Any, status: str) -> bool:
+        self._call("update")
+        appointment = self.appointments.get(str(appointment_id))
+        if not appointment:
+            return False
+        appointment["status"] = status
+        return True
+
+def build_simulated_manager(profile: SimulationProfile, providers: Tuple[str, ...] = ("google", "outlook", "ical")):
+    """
+    Cria um CalendarManager ligado aos provedores simulados.
+    A clínica tem uma cadeira por unidade de scale; workers da fila de
+    calendário não são iniciados, e o chamador entrega a fila com
+    process_calendar_outbox. Os armazenamentos ficam em memória e a
+    sincronização em segundo plano fica desligada (ISOLATED_ENV).
+    
+    Args:
+        profile: Perfil da simulação.
+        providers: Provedores externos ativos (padrão: google, outlook e ical).
+        
+    Returns:
+        Tupla (CalendarManager, FakeSupabaseManager).
+    """
+    from calendar_manager import CalendarManager
+    
+    resources = json.dumps([{"id": f"sim-{chair}"} for chair in range(profile.scale)])
+    with isolated_environment(CLINIC_RESOURCES=resources):
+        supabase = FakeSupabaseManager(profile)
+        manager = CalendarManager(supabase)
+    
+    if "google" in providers:
+        manager.google_calendar = FakeGoogleCalendar(profile)
+        manager.calendar_settings["google"]["enabled"] = True
+    
+    if "outlook" in providers:
+        manager.outlook_client = FakeGraphClient(profile)
+        manager.calendar_settings["outlook"]["enabled"] = True
+    
+    if "ical" in providers:
+        manager.ical_feed = FakeICalFeed(profile)
+        manager.ical_index = ICalEventIndex(future_days=profile.days + 7)
+        manager.calendar_settings["ical"]["enabled"] = True
+    
+    return manager, supabase
@@ -0,0 +1,98 @@
+"""
+Teste de estresse das reservas temporárias de horários (SlotHoldManager).
+
+Vários processos, cada um com várias threads, disputam os mesmos horários
+no mesmo arquivo SQLite: reservam, parte desiste, parte abandona a reserva
+até ela expirar e o restante confirma, com cancelamentos que devolvem os
+horários à disputa. No final verifica que nenhum horário ficou agendado duas
+vezes e mostra os contadores de disputa e a vazão.
+
+Uso:
+    python benchmarks/stress_slot_holds.py [processos] [threads] [tentativas]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+import threading
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from slot_holds import SlotHoldManager
+
+DATE = "2030-01-07"
+TIMES = ["09:00", "09:30", "10:00", "10:30", "11:00", "11:30"]
+
+def _worker(path: str, process_index: int, threads: int, attempts: int, results: Queue):
+    holds = SlotHoldManager(path, ttl_seconds=0.01)
+    
+    def run(thread_index: int):
+        rng = random.Random(process_index * 1000 + thread_index)
+        holder = f"patient-{process_index}-{thread_index}"
+        for attempt in range(attempts):
+            hold_id = holds.hold(DATE, rng.choice(TIMES), holder)
+            if not hold_id:
+                continue
+            choice = rng.random()
+            # Parte dos pacientes desiste e parte abandona a conversa até a reserva expirar
+            if choice < 0.2:
+                holds.release(hold_id)
+            elif choice < 0.4:
+                continue
+            elif holds.confirm(hold_id):
+                appointment_id = f"{holder}-{attempt}"
+                holds.attach_appointment(hold_id, appointment_id)
+                # Metade dos agendamentos é cancelada depois
+                if rng.random() < 0.5:
+                    holds.release_appointment(appointment_id)
+    
+    workers = [threading.Thread(target=run, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    
+    results.put(holds.get_metrics())
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    attempts = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "holds.db")
+        SlotHoldManager(path)
+        
+        results = Queue()
+        started = time.perf_counter()
+        workers = [Process(target=_worker, args=(path, index, threads, attempts, results)) for index in range(processes)]
+        for process in workers:
+            process.start()
+        metrics = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - started
+        
+        conn = sqlite3.connect(path)
+        booked = conn.execute(
+            "SELECT time, COUNT(*) FROM slot_holds WHERE date = ? AND status = 'booked' GROUP BY time",
+            (DATE,)
+        ).fetchall()
+        conn.close()
+    
+    total = {key: sum(metric[key] for metric in metrics) for key in metrics[0] if key != "contention_rate"}
+    
+    assert all(count == 1 for _, count in booked), "Horário agendado mais de uma vez"
+    
+    print(f"{processes} processos x {threads} threads x {attempts} tentativas em {elapsed:.2f}s")
+    print(f"Pedidos por segundo: {total['requested'] / elapsed:.0f}")
+    for key, value in total.items():
+        print(f"{key:>15}: {value}")
+    print(f"{'contention_rate':>15}: {total['contended'] / total['requested']:.2%}")
+    print(f"Horários agendados: {len(booked)} de {len(TIMES)}, nenhum em duplicidade")
+
+if __name__ == "__main__":
+    main()
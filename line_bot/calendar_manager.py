@@ -1,26 +1,50 @@
 import os
 import logging
 import json
-from typing import Dict, List, Optional, Any
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
-import requests
+
+from availability_engine import AvailabilityEngine
+from availability_index import AvailabilityIndex
+from clinic_schedule import ClinicSchedule, format_minutes
+from calendar_outbox import CalendarOutbox
+from calendar_sync import GoogleCalendarSyncer, OutlookCalendarSyncer, format_google_event, format_outlook_event
+from event_store import EventStore
+from event_time import CLINIC_TIMEZONE, clinic_isoformat, clinic_midnight, clinic_now, event_minutes, normalize_event, to_clinic_minutes, utc_isoformat
+from ical_feed import ICalEventIndex, ICalFeedCache
+from outlook_graph_client import OutlookGraphClient
+from report_rollups import ReportRollupStore, open_report_rollups
+from slot_holds import SlotHoldManager
+from store_paths import resolve_store_path
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Status de agendamento que mantêm um evento nos calendários externos
+CALENDAR_EVENT_STATUSES = ("confirmed", "rescheduled")
+
+# Máximo de requisições por lote aceito pela API do Google Calendar
+GOOGLE_BATCH_LIMIT = 50
+
 class CalendarManager:
     """
     Gerenciador de integração com calendários para o chatbot LINE.
     Suporta Google Calendar, Microsoft Outlook e Apple Calendar (iCal).
     """
     
-    def __init__(self, supabase_manager):
+    def __init__(self, supabase_manager, report_rollups: Optional[ReportRollupStore] = None):
         """
         Inicializa o gerenciador de calendário.
         
         Args:
             supabase_manager: Instância do gerenciador do Supabase.
+            report_rollups: Contagens diárias dos relatórios (opcional, padrão:
+                open_report_rollups). Passe o mesmo armazenamento ao ReportingManager.
         """
         self.supabase_manager = supabase_manager
         
@@ -39,12 +63,128 @@ class CalendarManager:
             },
             "ical": {
                 "enabled": os.getenv("ICAL_CALENDAR_ENABLED", "false").lower() == "true",
-                "url": os.getenv("ICAL_CALENDAR_URL", "")
+                "url": os.getenv("ICAL_CALENDAR_URL", ""),
+                "cache_ttl": int(os.getenv("ICAL_CACHE_TTL", "300"))
             }
         }
         
+        # Horário de funcionamento, feriados e exceções por data (CLINIC_SCHEDULE_FILE)
+        self.schedule = ClinicSchedule.from_env()
+        self.business_hours = self.schedule.weekly_hours
+        
+        # Prazo máximo de resposta de cada provedor, em segundos
+        self.provider_timeout = float(os.getenv("CALENDAR_PROVIDER_TIMEOUT", "5"))
+        
+        # Pool compartilhado para consultar os provedores em paralelo
+        self._provider_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="calendar-provider")
+        
+        # Cache de pacientes usado para montar títulos de eventos
+        self.patient_cache_ttl = int(os.getenv("PATIENT_CACHE_TTL", "600"))
+        self._patient_cache: Dict[Any, Tuple[float, Optional[Dict[str, Any]]]] = {}
+        self._patient_cache_lock = threading.Lock()
+        
+        # Armazenamento local de eventos (EVENT_STORE_PATH), mantido por uma thread
+        # em segundo plano e usado para responder às consultas de disponibilidade.
+        # CALENDAR_SYNC_MODE define como os provedores o atualizam: full substitui
+        # a janela inteira a cada sincronização, incremental recebe só as alterações
+        # (syncToken/deltaLink) e live desativa o armazenamento, consultando os
+        # provedores a cada pedido
+        self.sync_mode = os.getenv("CALENDAR_SYNC_MODE", "full").lower()
+        self.sync_interval = float(os.getenv("CALENDAR_SYNC_INTERVAL", "30"))
+        self.store_horizon_days = int(os.getenv("EVENT_STORE_HORIZON_DAYS", "60"))
+        self.store_max_age = float(os.getenv("EVENT_STORE_MAX_AGE", "300"))
+        self.event_store = EventStore(resolve_store_path("EVENT_STORE_PATH"))
+        self._sync_thread: Optional[threading.Thread] = None
+        self._sync_stop = threading.Event()
+        self.google_syncer: Optional[GoogleCalendarSyncer] = None
+        self.outlook_syncer: Optional[OutlookCalendarSyncer] = None
+        
+        # Reservas temporárias entre a escolha do horário e a confirmação, em um
+        # arquivo compartilhado para que todos os processos disputem os mesmos horários
+        self.slot_holds = SlotHoldManager(
+            resolve_store_path("SLOT_HOLD_PATH", "EVENT_STORE_PATH"),
+            ttl_seconds=int(os.getenv("SLOT_HOLD_TTL", "300"))
+        )
+        
+        # Fila persistente de gravações nos calendários externos, entregue por workers
+        self.calendar_outbox = CalendarOutbox(
+            resolve_store_path("CALENDAR_OUTBOX_PATH", "EVENT_STORE_PATH"),
+            max_attempts=int(os.getenv("CALENDAR_OUTBOX_MAX_ATTEMPTS", "8"))
+        )
+        if self.calendar_outbox.path == ":memory:":
+            logger.warning("Fila de calendários em memória: gravações pendentes serão perdidas ao reiniciar.")
+        self.outbox_workers = int(os.getenv("CALENDAR_OUTBOX_WORKERS", "1"))
+        self.outbox_batch_size = int(os.getenv("CALENDAR_OUTBOX_BATCH_SIZE", str(GOOGLE_BATCH_LIMIT)))
+        self.outbox_poll_interval = float(os.getenv("CALENDAR_OUTBOX_POLL_INTERVAL", "30"))
+        self.outbox_purge_interval = float(os.getenv("CALENDAR_OUTBOX_PURGE_INTERVAL", "3600"))
+        self.outbox_retention = float(os.getenv("CALENDAR_OUTBOX_RETENTION", str(7 * 24 * 3600)))
+        self._outbox_purged_at: Optional[float] = None
+        self._outbox_purge_lock = threading.Lock()
+        self._outbox_threads: List[threading.Thread] = []
+        self._outbox_wakeup = threading.Event()
+        self._outbox_stop = threading.Event()
+        
+        # Contagens diárias dos relatórios, atualizadas a cada agendamento gravado
+        self.report_rollups = report_rollups or open_report_rollups()
+        
+        # Recursos atendidos em paralelo (cadeiras ou dentistas)
+        self.resources = self._load_resources()
+        
+        # Motor vetorizado de busca de slots
+        self.availability_engine = AvailabilityEngine(
+            self.business_hours,
+            resources={resource_id: resource["hours"] for resource_id, resource in self.resources.items()},
+            schedule=self.schedule
+        )
+        
         # Inicializar clientes de calendário
         self._init_calendar_clients()
+        
+        # Índice compartilhado de horários livres
+        self.availability_index = AvailabilityIndex(self)
+        
+        if self.sync_mode != "live":
+            self.start_background_sync()
+        
+        if self._calendar_write_providers() and self.outbox_workers > 0:
+            self.start_outbox_workers()
+    
+    def _load_resources(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Carrega os recursos da clínica de CLINIC_RESOURCES (JSON) ou CLINIC_RESOURCES_FILE.
+        
+        Cada recurso tem id, name (opcional), hours (opcional, no formato de
+        business_hours com dias da semana "0" a "6"; padrão: business_hours) e
+        calendars (opcional, fontes cujos eventos ocupam somente esse recurso).
+        
+        Returns:
+            Dicionário de recursos por ID; sem configuração, um único recurso "clinic".
+        """
+        try:
+            raw = os.getenv("CLINIC_RESOURCES", "")
+            resources_file = os.getenv("CLINIC_RESOURCES_FILE", "")
+            
+            if not raw and resources_file and os.path.exists(resources_file):
+                with open(resources_file, "r", encoding="utf-8") as f:
+                    raw = f.read()
+            
+            if raw:
+                resources = {}
+                for resource in json.loads(raw):
+                    hours = resource.get("hours")
+                    resources[str(resource["id"])] = {
+                        "name": resource.get("name", str(resource["id"])),
+                        "hours": {int(weekday): day for weekday, day in hours.items()} if hours else None,
+                        "calendars": resource.get("calendars", [])
+                    }
+                
+                if resources:
+                    logger.info(f"Recursos da clínica carregados: {', '.join(resources)}")
+                    return resources
+        except Exception as e:
+            logger.error(f"Erro ao carregar recursos da clínica: {str(e)}")
+        
+        return {"clinic": {"name": "clinic", "hours": None, "calendars": []}}
     
     def _init_calendar_clients(self):
         """
@@ -101,6 +241,13 @@ class CalendarManager:
             # Construir serviço
             self.google_calendar = build("calendar", "v3", credentials=credentials)
             
+            if self.sync_mode == "incremental":
+                self.google_syncer = GoogleCalendarSyncer(
+                    self.google_calendar,
+                    self.calendar_settings["google"]["calendar_id"],
+                    self.event_store
+                )
+            
             logger.info("Cliente do Google Calendar inicializado com sucesso.")
         except ImportError:
             logger.error("Bibliotecas do Google Calendar não instaladas. Execute: pip install google-api-python-client google-auth-httplib2 google-auth-oauthlib")
@@ -135,6 +282,16 @@ class CalendarManager:
             # Escopo para calendário
             self.outlook_scopes = ["https://graph.microsoft.com/Calendars.ReadWrite"]
             
+            # Token em cache e sessão HTTP compartilhada para todas as chamadas ao Graph
+            self.outlook_client = OutlookGraphClient(self.outlook_app, self.outlook_scopes)
+            
+            if self.sync_mode == "incremental":
+                self.outlook_syncer = OutlookCalendarSyncer(
+                    self.outlook_client.get_json,
+                    self.event_store,
+                    base_url=self.outlook_client.base_url
+                )
+            
             logger.info("Cliente do Microsoft Outlook inicializado com sucesso.")
         except ImportError:
             logger.error("Biblioteca MSAL não instalada. Execute: pip install msal")
@@ -157,12 +314,18 @@ class CalendarManager:
                 self.calendar_settings["ical"]["enabled"] = False
                 return
             
-            # Testar acesso ao calendário
-            response = requests.get(url)
-            response.raise_for_status()
+            horizon_days = int(os.getenv("ICAL_INDEX_HORIZON_DAYS", "180"))
             
-            # Verificar se é um calendário iCal válido
-            icalendar.Calendar.from_ical(response.text)
+            # Testar acesso ao calendário; a primeira carga já fica no cache
+            self.ical_feed = ICalFeedCache(
+                url,
+                ttl_seconds=self.calendar_settings["ical"]["cache_ttl"],
+                future_days=horizon_days
+            )
+            self.ical_feed.refresh()
+            
+            # Índice de ocorrências, reconstruído a cada nova versão do feed
+            self.ical_index = ICalEventIndex(future_days=horizon_days)
             
             logger.info("Cliente do Apple Calendar (iCal) inicializado com sucesso.")
         except ImportError:
@@ -188,24 +351,121 @@ class CalendarManager:
         if not end_date:
             end_date = start_date
         
+        # Obter eventos existentes
+        existing_events = self.get_events(start_date, end_date)
+        
+        return self._find_available_slots(start_date, end_date, existing_events, duration_minutes)
+    
+    def get_available_slots_with_status(self, start_date: str, end_date: str = None, duration_minutes: int = 30, with_resources: bool = False) -> Dict[str, Any]:
+        """
+        Obtém slots disponíveis e indica quais fontes de eventos não responderam.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD (opcional, padrão: start_date).
+            duration_minutes: Duração da consulta em minutos (padrão: 30).
+            with_resources: Se True, cada slot traz a lista resources com os
+                recursos livres (padrão: False).
+                
+        Returns:
+            Dicionário com slots, stale_sources e partial.
+        """
+        # Se end_date não for fornecido, usar start_date
+        if not end_date:
+            end_date = start_date
+        
+        # Obter eventos existentes
+        events_result = self.get_events_with_status(start_date, end_date)
+        
+        return {
+            "slots": self._find_available_slots(start_date, end_date, events_result["events"], duration_minutes, with_resources),
+            "stale_sources": events_result["stale_sources"],
+            "partial": events_result["partial"]
+        }
+    
+    def iter_free_slots(self, after: datetime, duration_minutes: int = 30, resource: Optional[str] = None, holder: Optional[str] = None, max_days: int = 60) -> Iterator[Dict[str, Any]]:
+        """
+        Percorre os slots livres a partir de um horário, em ordem, um dia por vez.
+        Os eventos de cada dia só são buscados quando o chamador pede slots
+        desse dia, então parar cedo (por exemplo, com itertools.islice) evita
+        consultar o restante do período.
+        
+        Args:
+            after: Horário local a partir do qual os slots são procurados.
+            duration_minutes: Duração da consulta em minutos (padrão: 30).
+            resource: Recurso que precisa estar livre (opcional, padrão: qualquer um).
+            holder: ID do usuário no LINE cujas reservas não bloqueiam slots (opcional).
+            max_days: Número máximo de dias percorridos (padrão: 60).
+            
+        Yields:
+            Slots no formato {date: YYYY-MM-DD, time: HH:MM, resources: [...]}.
+        """
+        after_label = after.strftime("%Y-%m-%d %H:%M")
+        
+        for offset in range(max_days):
+            day = after.date() + timedelta(days=offset)
+            
+            # Dias fechados não geram consulta aos calendários
+            if not self.schedule.is_open(day):
+                continue
+            
+            date_str = day.isoformat()
+            events = self.get_events(date_str, date_str)
+            held = set(self.slot_holds.held_slots(date_str, holder))
+            
+            for slot in self._find_available_slots(date_str, date_str, events, duration_minutes, with_resources=True):
+                if f"{slot['date']} {slot['time']}" < after_label:
+                    continue
+                
+                # Recursos livres que ninguém reservou
+                free_resources = [resource_id for resource_id in slot["resources"] if (resource_id, slot["time"]) not in held]
+                if resource is not None:
+                    free_resources = [resource_id for resource_id in free_resources if resource_id == resource]
+                
+                if free_resources:
+                    yield {**slot, "resources": free_resources}
+    
+    def _find_available_slots(self, start_date: str, end_date: str, existing_events: List[Dict[str, Any]], duration_minutes: int, with_resources: bool = False) -> List[Dict[str, Any]]:
+        """
+        Busca os slots livres de um período dados os eventos existentes.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD.
+            existing_events: Lista de eventos existentes.
+            duration_minutes: Duração da consulta em minutos.
+            with_resources: Se True, cada slot traz a lista resources (padrão: False).
+            
+        Returns:
+            Lista de slots disponíveis no formato {date: YYYY-MM-DD, time: HH:MM}.
+        """
         # Converter strings para objetos datetime
         start_datetime = datetime.strptime(start_date, "%Y-%m-%d")
         end_datetime = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)  # Incluir o dia final completo
         
-        # Obter eventos existentes
-        existing_events = self.get_events(start_date, end_date)
-        
-        # Gerar todos os slots possíveis
-        all_slots = self._generate_all_slots(start_datetime, end_datetime, duration_minutes)
+        # Separar eventos da clínica inteira e de cada recurso
+        shared_events, resource_events = self._assign_resources(existing_events)
         
-        # Filtrar slots ocupados
-        available_slots = self._filter_available_slots(all_slots, existing_events, duration_minutes)
+        # Converter eventos em intervalos ocupados
+        busy_starts, busy_ends = self._build_busy_intervals(shared_events)
+        busy_by_resource = {
+            resource_id: self._build_busy_intervals(events)
+            for resource_id, events in resource_events.items() if events
+        }
         
-        return available_slots
+        # Buscar slots livres com o motor vetorizado
+        days = (end_datetime - start_datetime).days
+        return self.availability_engine.find_slots(
+            start_datetime.date(), days, busy_starts, busy_ends, duration_minutes,
+            busy_by_resource=busy_by_resource,
+            with_resources=with_resources
+        )
     
     def _generate_all_slots(self, start_datetime: datetime, end_datetime: datetime, duration_minutes: int) -> List[Dict[str, str]]:
         """
         Gera todos os slots possíveis dentro do horário de funcionamento.
+        Implementação de referência, usada apenas por testes e benchmarks para
+        validar o AvailabilityEngine; a busca de slots usa _find_available_slots.
         
         Args:
             start_datetime: Data e hora inicial.
@@ -215,57 +475,14 @@ class CalendarManager:
         Returns:
             Lista de slots no formato {date: YYYY-MM-DD, time: HH:MM}.
         """
-        # Horário de funcionamento: 9:00 - 18:00, exceto almoço (12:00 - 13:00)
-        business_hours = {
-            0: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Segunda
-            1: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Terça
-            2: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Quarta
-            3: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Quinta
-            4: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Sexta
-            5: None,  # Sábado - fechado
-            6: None   # Domingo - fechado
-        }
-        
         all_slots = []
         current_date = start_datetime.replace(hour=0, minute=0, second=0, microsecond=0)
         
         while current_date < end_datetime:
-            # Verificar se é dia útil
-            weekday = current_date.weekday()
-            if weekday in business_hours and business_hours[weekday]:
-                hours = business_hours[weekday]
-                
-                # Horário de início
-                start_time = datetime.strptime(hours["start"], "%H:%M").time()
-                current_slot = datetime.combine(current_date.date(), start_time)
-                
-                # Horário de término
-                end_time = datetime.strptime(hours["end"], "%H:%M").time()
-                end_slot = datetime.combine(current_date.date(), end_time)
-                
-                # Horário de almoço
-                lunch_start = datetime.strptime(hours["lunch_start"], "%H:%M").time()
-                lunch_start_dt = datetime.combine(current_date.date(), lunch_start)
-                
-                lunch_end = datetime.strptime(hours["lunch_end"], "%H:%M").time()
-                lunch_end_dt = datetime.combine(current_date.date(), lunch_end)
-                
-                # Gerar slots
-                while current_slot < end_slot:
-                    # Verificar se está no horário de almoço
-                    if current_slot >= lunch_start_dt and current_slot < lunch_end_dt:
-                        current_slot = lunch_end_dt
-                        continue
-                    
-                    # Adicionar slot
-                    slot_info = {
-                        "date": current_slot.strftime("%Y-%m-%d"),
-                        "time": current_slot.strftime("%H:%M")
-                    }
-                    all_slots.append(slot_info)
-                    
-                    # Avançar para o próximo slot
-                    current_slot += timedelta(minutes=duration_minutes)
+            # Inícios de slot da data, já compilados pelo calendário da clínica
+            date_label = current_date.strftime("%Y-%m-%d")
+            for start in self.schedule.slot_starts(current_date.date(), duration_minutes):
+                all_slots.append({"date": date_label, "time": format_minutes(start)})
             
             # Avançar para o próximo dia
             current_date += timedelta(days=1)
@@ -275,6 +492,8 @@ class CalendarManager:
     def _filter_available_slots(self, all_slots: List[Dict[str, str]], existing_events: List[Dict[str, Any]], duration_minutes: int) -> List[Dict[str, str]]:
         """
         Filtra slots disponíveis removendo os que conflitam com eventos existentes.
+        Implementação de referência, usada apenas por testes e benchmarks para
+        validar o AvailabilityEngine; a busca de slots usa _find_available_slots.
         
         Args:
             all_slots: Lista de todos os slots possíveis.
@@ -284,38 +503,130 @@ class CalendarManager:
         Returns:
             Lista de slots disponíveis.
         """
+        # Converter os eventos uma única vez em intervalos ordenados e disjuntos
+        busy_starts, busy_ends = self._build_busy_intervals(existing_events)
+        
         available_slots = []
         
         for slot in all_slots:
-            slot_date = slot["date"]
-            slot_time = slot["time"]
-            
-            # Converter para datetime
-            slot_datetime = datetime.strptime(f"{slot_date} {slot_time}", "%Y-%m-%d %H:%M")
-            slot_end_datetime = slot_datetime + timedelta(minutes=duration_minutes)
-            
-            # Verificar conflitos
-            conflict = False
-            for event in existing_events:
-                event_start = datetime.fromisoformat(event["start"].replace("Z", "+00:00"))
-                event_end = datetime.fromisoformat(event["end"].replace("Z", "+00:00"))
-                
-                # Converter para timezone local se necessário
-                if event_start.tzinfo:
-                    event_start = event_start.astimezone(None).replace(tzinfo=None)
-                if event_end.tzinfo:
-                    event_end = event_end.astimezone(None).replace(tzinfo=None)
-                
-                # Verificar sobreposição
-                if (slot_datetime < event_end and slot_end_datetime > event_start):
-                    conflict = True
-                    break
+            slot_start = to_clinic_minutes(datetime.fromisoformat(f"{slot['date']}T{slot['time']}"))
+            
+            # Último intervalo que começa antes do fim do slot
+            index = bisect_left(busy_starts, slot_start + duration_minutes)
             
-            if not conflict:
+            # Como os intervalos são disjuntos, basta verificar o fim desse intervalo
+            if index == 0 or busy_ends[index - 1] <= slot_start:
                 available_slots.append(slot)
         
         return available_slots
     
+    def _event_bounds(self, event: Dict[str, Any]) -> Tuple[int, int]:
+        """
+        Obtém início e fim de um evento em minutos no horário da clínica.
+        Os eventos chegam normalizados dos provedores; os demais são
+        convertidos uma única vez.
+        
+        Args:
+            event: Evento no formato interno.
+            
+        Returns:
+            Tupla (início, fim) em minutos desde a época.
+        """
+        return event_minutes(event)
+    
+    def _assign_resources(self, events: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+        """
+        Distribui os eventos entre os recursos da clínica.
+        
+        Eventos com resource conhecido ocupam esse recurso; eventos de uma fonte
+        listada em calendars ocupam os recursos correspondentes. Agendamentos do
+        banco sem recurso são atribuídos, em ordem de início, ao primeiro recurso
+        livre naquele horário. O restante ocupa a clínica inteira.
+        
+        Args:
+            events: Lista de eventos.
+            
+        Returns:
+            Tupla (eventos da clínica inteira, eventos por recurso).
+        """
+        resource_events = {resource_id: [] for resource_id in self.resources}
+        shared_events = []
+        unassigned = []
+        
+        source_resources = {}
+        for resource_id, resource in self.resources.items():
+            for source in resource["calendars"]:
+                source_resources.setdefault(source, []).append(resource_id)
+        
+        for event in events:
+            resource_id = event.get("resource")
+            
+            if resource_id in resource_events:
+                resource_events[resource_id].append(event)
+            elif event.get("source") == "database":
+                unassigned.append(event)
+            elif event.get("source") in source_resources:
+                for resource_id in source_resources[event["source"]]:
+                    resource_events[resource_id].append(event)
+            else:
+                shared_events.append(event)
+        
+        if not unassigned:
+            return shared_events, resource_events
+        
+        # Atribuição gulosa dos agendamentos sem recurso
+        occupied = {
+            resource_id: [self._event_bounds(event) for event in assigned]
+            for resource_id, assigned in resource_events.items()
+        }
+        
+        for bounds, event in sorted(((self._event_bounds(event), event) for event in unassigned), key=lambda item: item[0]):
+            event_start, event_end = bounds
+            
+            for resource_id, intervals in occupied.items():
+                if all(event_end <= other_start or event_start >= other_end for other_start, other_end in intervals):
+                    intervals.append(bounds)
+                    resource_events[resource_id].append(event)
+                    break
+            else:
+                # Nenhum recurso livre: o horário fica ocupado para todos
+                shared_events.append(event)
+        
+        return shared_events, resource_events
+    
+    def _build_busy_intervals(self, existing_events: List[Dict[str, Any]]) -> Tuple[List[int], List[int]]:
+        """
+        Converte eventos em intervalos ocupados ordenados e sem sobreposição.
+        
+        Args:
+            existing_events: Lista de eventos existentes.
+            
+        Returns:
+            Tupla (inícios, fins) com os intervalos ocupados em minutos no horário da clínica.
+        """
+        intervals = []
+        
+        for event in existing_events:
+            event_start, event_end = self._event_bounds(event)
+            
+            if event_end >= event_start:
+                intervals.append((event_start, event_end))
+        
+        intervals.sort()
+        
+        # Unir intervalos sobrepostos ou adjacentes
+        busy_starts = []
+        busy_ends = []
+        for event_start, event_end in intervals:
+            if busy_ends and event_start <= busy_ends[-1]:
+                if event_end > busy_ends[-1]:
+                    busy_ends[-1] = event_end
+            else:
+                busy_starts.append(event_start)
+                busy_ends.append(event_end)
+        
+        return busy_starts, busy_ends
+    
     def get_events(self, start_date: str, end_date: str = None) -> List[Dict[str, Any]]:
         """
         Obtém eventos de calendário para o período especificado.
@@ -327,48 +638,184 @@ class CalendarManager:
         Returns:
             Lista de eventos.
         """
+        return self.get_events_with_status(start_date, end_date)["events"]
+    
+    def get_events_with_status(self, start_date: str, end_date: str = None) -> Dict[str, Any]:
+        """
+        Obtém eventos de todas as fontes em paralelo, com prazo por provedor.
+        Fontes que falham ou não respondem a tempo são listadas em stale_sources.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD (opcional, padrão: start_date).
+            
+        Returns:
+            Dicionário com events, stale_sources e partial.
+        """
         # Se end_date não for fornecido, usar start_date
         if not end_date:
             end_date = start_date
         
-        # Converter para formato ISO
-        start_datetime = datetime.strptime(start_date, "%Y-%m-%d").isoformat() + "Z"
-        end_datetime = (datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).isoformat() + "Z"
+        # Converter os dias da clínica para horários UTC
+        start_datetime = utc_isoformat(clinic_midnight(datetime.strptime(start_date, "%Y-%m-%d").date()))
+        end_datetime = utc_isoformat(clinic_midnight(datetime.strptime(end_date, "%Y-%m-%d").date() + timedelta(days=1)))
         
-        all_events = []
+        # Responder do armazenamento local quando ele cobre o período
+        if self.sync_mode != "live":
+            stored = self._get_stored_events(start_datetime, end_datetime)
+            if stored is not None:
+                return stored
+        
+        # Disparar as consultas habilitadas ao mesmo tempo
+        futures = {}
         
-        # Obter eventos do Google Calendar
         if self.calendar_settings["google"]["enabled"]:
-            try:
-                google_events = self._get_google_calendar_events(start_datetime, end_datetime)
-                all_events.extend(google_events)
-            except Exception as e:
-                logger.error(f"Erro ao obter eventos do Google Calendar: {str(e)}")
+            futures["google"] = self._provider_executor.submit(self._get_google_calendar_events, start_datetime, end_datetime)
         
-        # Obter eventos do Microsoft Outlook
         if self.calendar_settings["outlook"]["enabled"]:
-            try:
-                outlook_events = self._get_outlook_calendar_events(start_datetime, end_datetime)
-                all_events.extend(outlook_events)
-            except Exception as e:
-                logger.error(f"Erro ao obter eventos do Microsoft Outlook: {str(e)}")
+            futures["outlook"] = self._provider_executor.submit(self._get_outlook_calendar_events, start_datetime, end_datetime)
         
-        # Obter eventos do Apple Calendar (iCal)
         if self.calendar_settings["ical"]["enabled"]:
+            futures["ical"] = self._provider_executor.submit(self._get_ical_calendar_events, start_datetime, end_datetime)
+        
+        futures["database"] = self._provider_executor.submit(self._get_db_appointments, start_date, end_date)
+        
+        # Aguardar até o prazo e combinar o que chegou
+        wait(futures.values(), timeout=self.provider_timeout)
+        
+        all_events = []
+        stale_sources = []
+        
+        for source, future in futures.items():
+            if not future.done():
+                logger.warning(f"Fonte de calendário '{source}' não respondeu em {self.provider_timeout}s.")
+                stale_sources.append(source)
+            elif future.exception() is not None:
+                stale_sources.append(source)
+            else:
+                all_events.extend(future.result())
+        
+        return {
+            "events": all_events,
+            "stale_sources": stale_sources,
+            "partial": bool(stale_sources)
+        }
+    
+    def _enabled_sources(self) -> List[str]:
+        """
+        Obtém as fontes de eventos ativas, incluindo o banco de dados.
+        
+        Returns:
+            Lista de fontes.
+        """
+        sources = [source for source in ("google", "outlook", "ical") if self.calendar_settings[source]["enabled"]]
+        sources.append("database")
+        return sources
+    
+    def _get_stored_events(self, start_datetime: str, end_datetime: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtém eventos do armazenamento local.
+        Fontes cuja última sincronização falhou ou é mais antiga que
+        store_max_age são listadas em stale_sources.
+        
+        Args:
+            start_datetime: Data e hora inicial no formato ISO.
+            end_datetime: Data e hora final no formato ISO.
+            
+        Returns:
+            Dicionário com events, stale_sources e partial, ou None se alguma
+            fonte ainda não tiver sincronizado o período.
+        """
+        start_dt = datetime.fromisoformat(start_datetime.replace("Z", "+00:00"))
+        end_dt = datetime.fromisoformat(end_datetime.replace("Z", "+00:00"))
+        start_ts = int(start_dt.timestamp())
+        end_ts = int(end_dt.timestamp())
+        
+        stale_sources = []
+        
+        for source in self._enabled_sources():
+            state = self.event_store.get_sync_state(source)
+            
+            if not state or state["window_start"] is None or not (state["window_start"] <= start_ts and end_ts <= state["window_end"]):
+                return None
+            
+            if not state["ok"] or time.time() - state["synced_at"] > self.store_max_age:
+                stale_sources.append(source)
+        
+        return {
+            "events": self.event_store.query(start_dt, end_dt),
+            "stale_sources": stale_sources,
+            "partial": bool(stale_sources)
+        }
+    
+    def sync_event_store(self):
+        """
+        Atualiza o armazenamento local com todas as fontes ativas.
+        No modo incremental, Google e Outlook recebem só as alterações; as
+        demais fontes têm a janela de store_horizon_days substituída.
+        """
+        today = clinic_now().date()
+        start_date = today.strftime("%Y-%m-%d")
+        end_date = (today + timedelta(days=self.store_horizon_days)).strftime("%Y-%m-%d")
+        window_start = clinic_midnight(today)
+        window_end = clinic_midnight(today + timedelta(days=self.store_horizon_days + 1))
+        
+        for source in self._enabled_sources():
             try:
-                ical_events = self._get_ical_calendar_events(start_datetime, end_datetime)
-                all_events.extend(ical_events)
+                syncer = {"google": self.google_syncer, "outlook": self.outlook_syncer}.get(source)
+                
+                if syncer is not None:
+                    syncer.sync()
+                    self.event_store.mark_synced(source, True, syncer.window_start, syncer.window_end)
+                    continue
+                
+                if source == "database":
+                    events = self._get_db_appointments(start_date, end_date)
+                elif source == "ical":
+                    events = self._get_ical_calendar_events(utc_isoformat(window_start), utc_isoformat(window_end))
+                else:
+                    # Provedor sem sincronizador: consulta completa da janela
+                    events = getattr(self, f"_get_{source}_calendar_events")(utc_isoformat(window_start), utc_isoformat(window_end))
+                
+                self.event_store.replace(source, events, window_start, window_end)
+                self.event_store.mark_synced(source, True, window_start, window_end)
             except Exception as e:
-                logger.error(f"Erro ao obter eventos do Apple Calendar (iCal): {str(e)}")
+                logger.error(f"Erro ao sincronizar a fonte '{source}' com o armazenamento local: {str(e)}")
+                self.event_store.mark_synced(source, False)
         
-        # Obter agendamentos do banco de dados
-        try:
-            db_events = self._get_db_appointments(start_date, end_date)
-            all_events.extend(db_events)
-        except Exception as e:
-            logger.error(f"Erro ao obter agendamentos do banco de dados: {str(e)}")
+        # Descartar reservas vencidas e de datas passadas
+        self.slot_holds.purge(start_date)
         
-        return all_events
+        # Só as datas com eventos alterados têm os bitmaps recalculados
+        for date_str in sorted(self.event_store.pop_changed_dates()):
+            self.availability_index.invalidate(date_str)
+    
+    def start_background_sync(self):
+        """
+        Inicia a thread que mantém o armazenamento local atualizado a cada sync_interval segundos.
+        """
+        if self._sync_thread is not None and self._sync_thread.is_alive():
+            return
+        
+        self._sync_stop.clear()
+        self._sync_thread = threading.Thread(target=self._background_sync_loop, name="calendar-sync", daemon=True)
+        self._sync_thread.start()
+    
+    def stop_background_sync(self):
+        """
+        Interrompe a thread de sincronização.
+        """
+        self._sync_stop.set()
+    
+    def _background_sync_loop(self):
+        while True:
+            try:
+                self.sync_event_store()
+            except Exception as e:
+                logger.error(f"Erro na sincronização em segundo plano: {str(e)}")
+            
+            if self._sync_stop.wait(self.sync_interval):
+                return
     
     def _get_google_calendar_events(self, start_datetime: str, end_datetime: str) -> List[Dict[str, Any]]:
         """
@@ -399,23 +846,10 @@ class CalendarManager:
             events = events_result.get("items", [])
             
             # Formatar eventos
-            formatted_events = []
-            for event in events:
-                start = event["start"].get("dateTime", event["start"].get("date"))
-                end = event["end"].get("dateTime", event["end"].get("date"))
-                
-                formatted_events.append({
-                    "id": event["id"],
-                    "title": event["summary"],
-                    "start": start,
-                    "end": end,
-                    "source": "google"
-                })
-            
-            return formatted_events
+            return [format_google_event(event) for event in events]
         except Exception as e:
             logger.error(f"Erro ao obter eventos do Google Calendar: {str(e)}")
-            return []
+            raise
     
     def _get_outlook_calendar_events(self, start_datetime: str, end_datetime: str) -> List[Dict[str, Any]]:
         """
@@ -432,45 +866,18 @@ class CalendarManager:
             return []
         
         try:
-            # Obter token de acesso
-            result = self.outlook_app.acquire_token_for_client(scopes=self.outlook_scopes)
-            
-            if "access_token" not in result:
-                logger.error(f"Erro ao obter token de acesso para Microsoft Outlook: {result.get('error')}")
-                return []
-            
-            # Configurar cabeçalhos
-            headers = {
-                "Authorization": f"Bearer {result['access_token']}",
-                "Content-Type": "application/json"
-            }
-            
             # Formatar datas para o formato esperado pela API
             start_param = start_datetime.replace("Z", "")
             end_param = end_datetime.replace("Z", "")
             
             # Obter eventos
-            url = f"https://graph.microsoft.com/v1.0/me/calendarView?startDateTime={start_param}&endDateTime={end_param}"
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            
-            events = response.json().get("value", [])
+            events = self.outlook_client.get_json(f"/me/calendarView?startDateTime={start_param}&endDateTime={end_param}").get("value", [])
             
             # Formatar eventos
-            formatted_events = []
-            for event in events:
-                formatted_events.append({
-                    "id": event["id"],
-                    "title": event["subject"],
-                    "start": event["start"]["dateTime"] + "Z",
-                    "end": event["end"]["dateTime"] + "Z",
-                    "source": "outlook"
-                })
-            
-            return formatted_events
+            return [format_outlook_event(event) for event in events]
         except Exception as e:
             logger.error(f"Erro ao obter eventos do Microsoft Outlook: {str(e)}")
-            return []
+            raise
     
     def _get_ical_calendar_events(self, start_datetime: str, end_datetime: str) -> List[Dict[str, Any]]:
         """
@@ -487,76 +894,33 @@ class CalendarManager:
             return []
         
         try:
-            import icalendar
-            from dateutil import rrule
-            
-            url = self.calendar_settings["ical"]["url"]
-            
-            # Obter calendário
-            response = requests.get(url)
-            response.raise_for_status()
-            
-            cal = icalendar.Calendar.from_ical(response.text)
-            
             # Converter strings ISO para objetos datetime
             start_dt = datetime.fromisoformat(start_datetime.replace("Z", "+00:00"))
             end_dt = datetime.fromisoformat(end_datetime.replace("Z", "+00:00"))
             
+            # Obter calendário do cache (revalidado em segundo plano), baixando
+            # o feed inteiro se o intervalo estiver fora da janela guardada
+            cal = self.ical_feed.get_calendar(start_dt, end_dt)
+            
+            # Expandir eventos recorrentes somente quando o feed muda
+            self.ical_index.ensure(cal, self.ical_feed.version)
+            
             # Formatar eventos
             formatted_events = []
             
-            for component in cal.walk():
-                if component.name == "VEVENT":
-                    event_start = component.get("dtstart").dt
-                    event_end = component.get("dtend").dt
-                    
-                    # Converter para datetime se for date
-                    if isinstance(event_start, datetime.date) and not isinstance(event_start, datetime.datetime):
-                        event_start = datetime.combine(event_start, datetime.min.time())
-                    if isinstance(event_end, datetime.date) and not isinstance(event_end, datetime.datetime):
-                        event_end = datetime.combine(event_end, datetime.min.time())
-                    
-                    # Adicionar timezone se não tiver
-                    if event_start.tzinfo is None:
-                        event_start = event_start.replace(tzinfo=start_dt.tzinfo)
-                    if event_end.tzinfo is None:
-                        event_end = event_end.replace(tzinfo=end_dt.tzinfo)
-                    
-                    # Verificar se o evento está no período solicitado
-                    if event_end >= start_dt and event_start <= end_dt:
-                        formatted_events.append({
-                            "id": str(component.get("uid")),
-                            "title": str(component.get("summary")),
-                            "start": event_start.isoformat(),
-                            "end": event_end.isoformat(),
-                            "source": "ical"
-                        })
-                    
-                    # Processar eventos recorrentes
-                    if "rrule" in component:
-                        rrule_str = component.get("rrule").to_ical().decode("utf-8")
-                        rule = rrule.rrulestr(rrule_str, dtstart=event_start)
-                        
-                        # Obter ocorrências no período
-                        for occurrence in rule.between(start_dt, end_dt, inc=True):
-                            # Calcular duração do evento original
-                            duration = event_end - event_start
-                            
-                            # Calcular fim da ocorrência
-                            occurrence_end = occurrence + duration
-                            
-                            formatted_events.append({
-                                "id": f"{str(component.get('uid'))}-{occurrence.isoformat()}",
-                                "title": str(component.get("summary")),
-                                "start": occurrence.isoformat(),
-                                "end": occurrence_end.isoformat(),
-                                "source": "ical"
-                            })
+            for event_start, event_end, event_id, title in self.ical_index.query(start_dt, end_dt):
+                formatted_events.append(normalize_event({
+                    "id": event_id,
+                    "title": title,
+                    "start": event_start.isoformat(),
+                    "end": event_end.isoformat(),
+                    "source": "ical"
+                }))
             
             return formatted_events
         except Exception as e:
             logger.error(f"Erro ao obter eventos do Apple Calendar (iCal): {str(e)}")
-            return []
+            raise
     
     def _get_db_appointments(self, start_date: str, end_date: str) -> List[Dict[str, Any]]:
         """
@@ -573,46 +937,200 @@ class CalendarManager:
             # Obter agendamentos do Supabase
             appointments = self.supabase_manager.get_appointments_by_date_range(start_date, end_date)
             
+            # Resolver todos os pacientes do período de uma vez
+            patients = self._get_patients_by_ids([appointment["patient_id"] for appointment in appointments])
+            
             # Formatar agendamentos como eventos
-            formatted_events = []
+            return [
+                self._format_db_appointment(appointment, patients.get(appointment["patient_id"]))
+                for appointment in appointments
+            ]
+        except Exception as e:
+            logger.error(f"Erro ao obter agendamentos do banco de dados: {str(e)}")
+            raise
+    
+    def _format_db_appointment(self, appointment: Dict[str, Any], patient: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Formata um agendamento do banco de dados como evento.
+        
+        Args:
+            appointment: Agendamento com appointment_date e appointment_time.
+            patient: Dados do paciente (opcional).
             
-            for appointment in appointments:
-                # Combinar data e hora
-                start_datetime = f"{appointment['appointment_date']}T{appointment['appointment_time']}:00"
-                
-                # Calcular hora de término (padrão: 30 minutos)
-                start_dt = datetime.fromisoformat(start_datetime)
-                end_dt = start_dt + timedelta(minutes=30)
-                
-                # Obter dados do paciente
-                patient = self.supabase_manager.get_patient_by_id(appointment["patient_id"])
-                patient_name = patient.get("name", "Unknown") if patient else "Unknown"
-                
-                formatted_events.append({
-                    "id": str(appointment["id"]),
-                    "title": f"Appointment: {patient_name}",
-                    "start": start_datetime + "Z",
-                    "end": end_dt.isoformat() + "Z",
-                    "source": "database",
-                    "status": appointment.get("status", "pending"),
-                    "patient_id": appointment["patient_id"],
-                    "reason": appointment.get("reason", "")
-                })
+        Returns:
+            Evento no formato interno.
+        """
+        # Combinar data e hora, que estão no horário da clínica
+        start_dt = datetime.fromisoformat(f"{appointment['appointment_date']}T{appointment['appointment_time']}:00")
+        
+        # Calcular hora de término (padrão: 30 minutos)
+        end_dt = start_dt + timedelta(minutes=30)
+        
+        patient_name = patient.get("name", "Unknown") if patient else "Unknown"
+        
+        return normalize_event({
+            "id": str(appointment["id"]),
+            "title": f"Appointment: {patient_name}",
+            "start": clinic_isoformat(start_dt),
+            "end": clinic_isoformat(end_dt),
+            "source": "database",
+            "status": appointment.get("status", "pending"),
+            "patient_id": appointment["patient_id"],
+            "reason": appointment.get("reason", ""),
+            "resource": appointment.get("resource_id")
+        })
+    
+    def register_appointment(self, appointment: Dict[str, Any]):
+        """
+        Grava um agendamento novo ou alterado no armazenamento local, sem
+        esperar a próxima sincronização, e invalida a disponibilidade da data.
+        Agendamentos cancelados são removidos.
+        
+        Args:
+            appointment: Agendamento com id, patient_id, appointment_date e appointment_time.
+        """
+        try:
+            patient = None
+            if appointment.get("status") == "cancelled":
+                self.event_store.delete("database", appointment["id"])
+            else:
+                patient = self._get_patients_by_ids([appointment["patient_id"]]).get(appointment["patient_id"])
+                self.event_store.upsert("database", self._format_db_appointment(appointment, patient))
             
-            return formatted_events
+            self.availability_index.invalidate(appointment.get("appointment_date"))
+            
+            # Manter as contagens diárias dos relatórios em dia
+            self.report_rollups.record_appointment(appointment, appointment.get("clinic_id"), (patient or {}).get("preferred_language"))
         except Exception as e:
-            logger.error(f"Erro ao obter agendamentos do banco de dados: {str(e)}")
-            return []
+            logger.error(f"Erro ao registrar agendamento no armazenamento local: {str(e)}")
+    
+    def _get_patients_by_ids(self, patient_ids: List[Any]) -> Dict[Any, Dict[str, Any]]:
+        """
+        Obtém vários pacientes, consultando o banco apenas para os que não estão em cache.
+        
+        Args:
+            patient_ids: IDs dos pacientes (podem se repetir).
+            
+        Returns:
+            Dicionário {patient_id: paciente} com os pacientes encontrados.
+        """
+        now = time.monotonic()
+        patients = {}
+        missing = []
+        
+        with self._patient_cache_lock:
+            for patient_id in dict.fromkeys(patient_ids):
+                cached = self._patient_cache.get(patient_id)
+                if cached and now - cached[0] < self.patient_cache_ttl:
+                    if cached[1]:
+                        patients[patient_id] = cached[1]
+                else:
+                    missing.append(patient_id)
+        
+        if not missing:
+            return patients
+        
+        # Uma única consulta em lote quando o gerenciador do Supabase oferece suporte
+        if hasattr(self.supabase_manager, "get_patients_by_ids"):
+            found = {patient["id"]: patient for patient in self.supabase_manager.get_patients_by_ids(missing) or []}
+        else:
+            found = {patient_id: self.supabase_manager.get_patient_by_id(patient_id) for patient_id in missing}
+        
+        with self._patient_cache_lock:
+            for patient_id in missing:
+                patient = found.get(patient_id)
+                # Pacientes inexistentes também ficam em cache para evitar novas consultas
+                self._patient_cache[patient_id] = (now, patient)
+                if patient:
+                    patients[patient_id] = patient
+        
+        return patients
+    
+    def invalidate_patient_cache(self, patient_id: Any = None):
+        """
+        Remove pacientes do cache após alterações cadastrais.
+        
+        Args:
+            patient_id: ID do paciente (opcional, padrão: todos os pacientes).
+        """
+        with self._patient_cache_lock:
+            if patient_id is None:
+                self._patient_cache.clear()
+            else:
+                self._patient_cache.pop(patient_id, None)
+    
+    def hold_slot(self, date_str: str, time_str: str, holder: str) -> Optional[str]:
+        """
+        Reserva um horário em um recurso livre por slot_holds.ttl_seconds.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD.
+            time_str: Horário no formato HH:MM.
+            holder: Identificador de quem reserva (por exemplo, o ID do LINE).
+            
+        Returns:
+            ID da reserva, ou None se nenhum recurso estiver livre e sem reserva.
+        """
+        try:
+            free_resources = set(self.availability_index.get_free_resources(date_str, time_str))
+            resource_ids = [resource_id for resource_id in self.resources if resource_id in free_resources]
+        except Exception as e:
+            logger.error(f"Erro ao verificar disponibilidade de {date_str} {time_str}: {str(e)}")
+            resource_ids = list(self.resources)
+        
+        # Reservar o primeiro recurso livre que ninguém reservou antes
+        for resource_id in resource_ids:
+            hold_id = self.slot_holds.hold(date_str, time_str, holder, resource_id)
+            if hold_id:
+                return hold_id
+        
+        return None
+    
+    def get_free_times(self, date_str: str, holder: Optional[str] = None) -> List[str]:
+        """
+        Obtém os horários de uma data em que algum recurso está livre e sem
+        reserva de outros pacientes.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD.
+            holder: Identificador cujas reservas continuam visíveis (opcional).
+            
+        Returns:
+            Lista de horários no formato HH:MM.
+        """
+        held_slots = self.slot_holds.held_slots(date_str, exclude_holder=holder)
+        return self.availability_index.get_free_times(date_str, exclude=held_slots)
+    
+    def get_availability_summary(self, start_date: str, days: int = 14, holder: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Obtém o número de horários livres de cada dia, no dia inteiro e por período.
+        As contagens saem dos bitmaps do índice de disponibilidade, calculados
+        para todo o intervalo em uma única passada do motor e invalidados a
+        cada agendamento.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            days: Número de dias (padrão: 14).
+            holder: Identificador cujas reservas continuam visíveis (opcional).
+            
+        Returns:
+            Lista com {date, free, morning, afternoon} para cada dia.
+        """
+        end_date = (datetime.strptime(start_date, "%Y-%m-%d") + timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        held_slots = self.slot_holds.held_slots_by_date(start_date, end_date, exclude_holder=holder)
+        return self.availability_index.get_summary(start_date, days, exclude=held_slots)
     
     def create_calendar_event(self, appointment_id: int) -> bool:
         """
-        Cria um evento de calendário para um agendamento.
+        Registra a criação do evento de calendário de um agendamento.
+        O evento é gravado nos calendários externos pelos workers da fila,
+        sem que quem confirma o agendamento espere pelos provedores.
         
         Args:
             appointment_id: ID do agendamento.
             
         Returns:
-            True se o evento foi criado com sucesso, False caso contrário.
+            True se a sincronização foi registrada, False caso contrário.
         """
         try:
             # Obter dados do agendamento
@@ -622,120 +1140,422 @@ class CalendarManager:
                 logger.error(f"Agendamento não encontrado: {appointment_id}")
                 return False
             
-            # Obter dados do paciente
-            patient = self.supabase_manager.get_patient_by_id(appointment["patient_id"])
+            # Manter o armazenamento local em dia com o agendamento
+            self.register_appointment(appointment)
             
-            if not patient:
-                logger.error(f"Paciente não encontrado: {appointment['patient_id']}")
+            # Apple Calendar (iCal) é somente leitura via URL
+            if not self.enqueue_calendar_sync(appointment_id):
+                logger.warning("Nenhum calendário configurado para criação de eventos.")
                 return False
             
-            # Combinar data e hora
-            start_datetime = f"{appointment['appointment_date']}T{appointment['appointment_time']}:00"
-            
-            # Calcular hora de término (padrão: 30 minutos)
-            start_dt = datetime.fromisoformat(start_datetime)
-            end_dt = start_dt + timedelta(minutes=30)
-            
-            # Criar evento no Google Calendar
-            if self.calendar_settings["google"]["enabled"]:
-                try:
-                    self._create_google_calendar_event(
-                        patient["name"],
-                        appointment.get("reason", ""),
-                        start_dt.isoformat() + "Z",
-                        end_dt.isoformat() + "Z"
-                    )
-                    logger.info(f"Evento criado no Google Calendar para o agendamento {appointment_id}")
-                    return True
-                except Exception as e:
-                    logger.error(f"Erro ao criar evento no Google Calendar: {str(e)}")
-            
-            # Criar evento no Microsoft Outlook
-            if self.calendar_settings["outlook"]["enabled"]:
-                try:
-                    self._create_outlook_calendar_event(
-                        patient["name"],
-                        appointment.get("reason", ""),
-                        start_dt.isoformat(),
-                        end_dt.isoformat()
-                    )
-                    logger.info(f"Evento criado no Microsoft Outlook para o agendamento {appointment_id}")
-                    return True
-                except Exception as e:
-                    logger.error(f"Erro ao criar evento no Microsoft Outlook: {str(e)}")
-            
-            # Apple Calendar (iCal) é somente leitura via URL
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao criar evento de calendário: {str(e)}")
+            return False
+    
+    def _calendar_write_providers(self) -> List[str]:
+        return [provider for provider in ("google", "outlook") if self.calendar_settings[provider]["enabled"]]
+    
+    def enqueue_calendar_sync(self, appointment_id: Any) -> bool:
+        """
+        Registra na fila que o evento de um agendamento deve refletir seu estado
+        atual em cada calendário externo ativo.
+        
+        Args:
+            appointment_id: ID do agendamento.
             
-            logger.warning("Nenhum calendário configurado para criação de eventos.")
+        Returns:
+            True se a sincronização foi registrada, False se não há calendário gravável.
+        """
+        providers = self._calendar_write_providers()
+        if not providers:
             return False
+        
+        try:
+            self.calendar_outbox.enqueue(appointment_id, providers)
         except Exception as e:
-            logger.error(f"Erro ao criar evento de calendário: {str(e)}")
+            logger.error(f"Erro ao registrar sincronização do agendamento {appointment_id}: {str(e)}")
             return False
+        
+        self._outbox_wakeup.set()
+        return True
     
-    def _create_google_calendar_event(self, summary: str, description: str, start_time: str, end_time: str) -> str:
+    def process_calendar_outbox(self, limit: Optional[int] = None) -> int:
         """
-        Cria um evento no Google Calendar.
+        Entrega um lote de tarefas vencidas da fila aos calendários externos.
         
         Args:
-            summary: Título do evento.
-            description: Descrição do evento.
-            start_time: Hora de início no formato ISO.
-            end_time: Hora de término no formato ISO.
+            limit: Tamanho máximo do lote (opcional, padrão: outbox_batch_size).
             
         Returns:
-            ID do evento criado.
+            Número de tarefas processadas.
         """
-        if not self.calendar_settings["google"]["enabled"]:
-            raise Exception("Google Calendar não está habilitado.")
+        jobs = self.calendar_outbox.claim(limit or self.outbox_batch_size)
+        if not jobs:
+            return 0
+        
+        # Agendamentos e pacientes do lote são buscados uma única vez
+        appointments = {}
+        for appointment_id in dict.fromkeys(job["appointment_id"] for job in jobs):
+            try:
+                appointments[appointment_id] = self.supabase_manager.get_appointment_by_id(appointment_id)
+            except Exception as e:
+                appointments[appointment_id] = e
+        
+        patients = self._get_patients_by_ids([
+            appointment["patient_id"] for appointment in appointments.values()
+            if isinstance(appointment, dict) and appointment.get("patient_id") is not None
+        ])
+        
+        for provider in dict.fromkeys(job["provider"] for job in jobs):
+            self._deliver_calendar_jobs(provider, [job for job in jobs if job["provider"] == provider], appointments, patients)
+        
+        return len(jobs)
+    
+    def _deliver_calendar_jobs(self, provider: str, jobs: List[Dict[str, Any]], appointments: Dict[str, Any], patients: Dict[Any, Dict[str, Any]]):
+        """
+        Entrega as tarefas de um provedor e registra o resultado de cada uma.
+        
+        Args:
+            provider: Provedor de calendário (google, outlook).
+            jobs: Tarefas reservadas da fila.
+            appointments: Agendamentos por ID (None se removido, ou a exceção da consulta).
+            patients: Pacientes por ID.
+        """
+        if provider == "google" and len(jobs) > 1:
+            self._deliver_google_batch(jobs, appointments, patients)
+            return
         
+        for job in jobs:
+            appointment = appointments.get(job["appointment_id"])
+            
+            try:
+                if isinstance(appointment, Exception):
+                    raise appointment
+                
+                patient = patients.get(appointment["patient_id"]) if appointment else None
+                external_id = self._sync_calendar_event(provider, job, appointment, patient)
+                self.calendar_outbox.complete(job["job_id"], job["appointment_id"], provider, external_id)
+            except Exception as e:
+                logger.error(f"Erro ao sincronizar agendamento {job['appointment_id']} com '{provider}': {str(e)}")
+                self.calendar_outbox.fail(job["job_id"], str(e))
+    
+    def _sync_calendar_event(self, provider: str, job: Dict[str, Any], appointment: Optional[Dict[str, Any]], patient: Optional[Dict[str, Any]]) -> Optional[str]:
+        """
+        Cria, atualiza ou remove o evento de um agendamento em um provedor.
+        
+        Args:
+            provider: Provedor de calendário (google, outlook).
+            job: Tarefa com idempotency_key e external_id.
+            appointment: Agendamento atual, ou None se removido.
+            patient: Paciente do agendamento (opcional).
+            
+        Returns:
+            ID do evento no provedor, ou None se o agendamento não tem mais evento.
+        """
+        external_id = job.get("external_id")
+        
+        # Agendamentos removidos, pendentes ou cancelados não têm evento
+        if not appointment or appointment.get("status") not in CALENDAR_EVENT_STATUSES:
+            if external_id:
+                getattr(self, f"_delete_{provider}_calendar_event")(external_id)
+            return None
+        
+        summary, description, start_time, end_time = self._calendar_event_fields(provider, appointment, patient)
+        
+        if external_id:
+            getattr(self, f"_update_{provider}_calendar_event")(external_id, summary, description, start_time, end_time)
+            return external_id
+        
+        event_id = getattr(self, f"_create_{provider}_calendar_event")(summary, description, start_time, end_time, job["idempotency_key"])
+        logger.info(f"Evento criado no calendário '{provider}' para o agendamento {appointment['id']}")
+        return event_id
+    
+    def _calendar_event_fields(self, provider: str, appointment: Dict[str, Any], patient: Optional[Dict[str, Any]]) -> Tuple[str, str, str, str]:
+        """
+        Monta título, descrição, início e fim do evento de um agendamento.
+        
+        Args:
+            provider: Provedor de calendário (google, outlook).
+            appointment: Agendamento com appointment_date e appointment_time.
+            patient: Paciente do agendamento (opcional).
+            
+        Returns:
+            Tupla (summary, description, start_time, end_time).
+        """
+        # Combinar data e hora (padrão: 30 minutos)
+        start_dt = datetime.fromisoformat(f"{appointment['appointment_date']}T{appointment['appointment_time']}:00")
+        end_dt = start_dt + timedelta(minutes=30)
+        
+        summary = patient["name"] if patient else f"Appointment {appointment['id']}"
+        description = appointment.get("reason", "")
+        
+        # Google aceita o offset; o Outlook espera o horário sem offset junto do timeZone
+        if provider == "google":
+            return summary, description, clinic_isoformat(start_dt), clinic_isoformat(end_dt)
+        
+        return summary, description, start_dt.isoformat(), end_dt.isoformat()
+    
+    def _deliver_google_batch(self, jobs: List[Dict[str, Any]], appointments: Dict[str, Any], patients: Dict[Any, Dict[str, Any]]):
+        """
+        Entrega as tarefas do Google Calendar em requisições em lote, com o
+        resultado de cada item registrado na tarefa correspondente.
+        
+        Args:
+            jobs: Tarefas reservadas da fila.
+            appointments: Agendamentos por ID (None se removido, ou a exceção da consulta).
+            patients: Pacientes por ID.
+        """
         calendar_id = self.calendar_settings["google"]["calendar_id"]
+        events = self.google_calendar.events()
+        jobs_by_id = {str(job["job_id"]): job for job in jobs}
+        requests = {}
+        operations = {}
+        
+        for request_id, job in jobs_by_id.items():
+            appointment = appointments.get(job["appointment_id"])
+            external_id = job.get("external_id")
+            
+            if isinstance(appointment, Exception):
+                self.calendar_outbox.fail(job["job_id"], str(appointment))
+                continue
+            
+            # Agendamentos removidos, pendentes ou cancelados não têm evento
+            if not appointment or appointment.get("status") not in CALENDAR_EVENT_STATUSES:
+                if external_id:
+                    requests[request_id] = events.delete(calendarId=calendar_id, eventId=external_id)
+                    operations[request_id] = ("delete", None, None)
+                else:
+                    self.calendar_outbox.complete(job["job_id"], job["appointment_id"], "google", None)
+                continue
+            
+            body = self._google_event_body(*self._calendar_event_fields("google", appointment, patients.get(appointment["patient_id"])))
+            
+            if external_id:
+                requests[request_id] = events.update(calendarId=calendar_id, eventId=external_id, body=body)
+                operations[request_id] = ("update", external_id, body)
+            else:
+                body["id"] = job["idempotency_key"]
+                requests[request_id] = events.insert(calendarId=calendar_id, body=body)
+                operations[request_id] = ("insert", job["idempotency_key"], body)
+        
+        results = self._execute_google_batch(requests)
+        
+        # Inserções já feitas por uma tentativa anterior viram atualizações
+        retries = {}
+        for request_id, (response, error) in results.items():
+            job = jobs_by_id[request_id]
+            operation, event_id, body = operations[request_id]
+            status = getattr(getattr(error, "resp", None), "status", None)
+            
+            if error is None:
+                self.calendar_outbox.complete(job["job_id"], job["appointment_id"], "google", event_id)
+            elif operation == "delete" and status in (404, 410):
+                self.calendar_outbox.complete(job["job_id"], job["appointment_id"], "google", None)
+            elif operation == "insert" and status == 409:
+                retries[request_id] = events.update(calendarId=calendar_id, eventId=event_id, body={**body, "status": "confirmed"})
+            else:
+                logger.error(f"Erro ao sincronizar agendamento {job['appointment_id']} com 'google': {str(error)}")
+                self.calendar_outbox.fail(job["job_id"], str(error))
+        
+        for request_id, (response, error) in self._execute_google_batch(retries).items():
+            job = jobs_by_id[request_id]
+            if error is None:
+                self.calendar_outbox.complete(job["job_id"], job["appointment_id"], "google", operations[request_id][1])
+            else:
+                self.calendar_outbox.fail(job["job_id"], str(error))
+    
+    def _execute_google_batch(self, requests: Dict[str, Any]) -> Dict[str, Tuple[Any, Optional[Exception]]]:
+        """
+        Executa requisições do Google Calendar em lotes de até GOOGLE_BATCH_LIMIT.
+        
+        Args:
+            requests: Requisições por ID.
+            
+        Returns:
+            Dicionário {ID: (resposta, exceção)}, com exceção None para itens bem-sucedidos.
+        """
+        results = {}
+        
+        def callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+        
+        items = list(requests.items())
+        for offset in range(0, len(items), GOOGLE_BATCH_LIMIT):
+            chunk = items[offset:offset + GOOGLE_BATCH_LIMIT]
+            batch = self.google_calendar.new_batch_http_request(callback=callback)
+            for request_id, request in chunk:
+                batch.add(request, request_id=request_id)
+            
+            try:
+                batch.execute()
+            except Exception as e:
+                # Falha do lote inteiro: os itens sem resposta herdam o erro
+                for request_id, _ in chunk:
+                    results.setdefault(request_id, (None, e))
+        
+        return results
+    
+    def resync_calendar_events(self, start_date: str, end_date: str) -> int:
+        """
+        Registra na fila a sincronização de todos os agendamentos de um período,
+        por exemplo após importações ou remarcações em massa. No Google Calendar
+        as tarefas são entregues em requisições em lote.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD.
+            
+        Returns:
+            Número de agendamentos registrados.
+        """
+        providers = self._calendar_write_providers()
+        if not providers:
+            return 0
+        
+        try:
+            appointments = self.supabase_manager.get_appointments_by_date_range(start_date, end_date)
+            self.calendar_outbox.enqueue_many([appointment["id"] for appointment in appointments], providers)
+        except Exception as e:
+            logger.error(f"Erro ao registrar sincronização em massa de {start_date} a {end_date}: {str(e)}")
+            return 0
+        
+        self._outbox_wakeup.set()
+        return len(appointments)
+    
+    def start_outbox_workers(self):
+        """
+        Inicia os workers que entregam a fila aos calendários externos.
+        """
+        self._outbox_threads = [thread for thread in self._outbox_threads if thread.is_alive()]
+        self._outbox_stop.clear()
         
-        event = {
+        for index in range(len(self._outbox_threads), self.outbox_workers):
+            thread = threading.Thread(target=self._outbox_worker_loop, name=f"calendar-outbox-{index}", daemon=True)
+            thread.start()
+            self._outbox_threads.append(thread)
+    
+    def stop_outbox_workers(self):
+        """
+        Interrompe os workers da fila.
+        """
+        self._outbox_stop.set()
+        self._outbox_wakeup.set()
+    
+    def _purge_outbox_if_due(self):
+        """
+        Remove as tarefas concluídas mais antigas que outbox_retention, no
+        máximo uma vez a cada outbox_purge_interval segundos entre todos os workers.
+        """
+        now = time.monotonic()
+        
+        with self._outbox_purge_lock:
+            if self._outbox_purged_at is not None and now - self._outbox_purged_at < self.outbox_purge_interval:
+                return
+            self._outbox_purged_at = now
+        
+        self.calendar_outbox.purge(self.outbox_retention)
+    
+    def _outbox_worker_loop(self):
+        while not self._outbox_stop.is_set():
+            try:
+                self._purge_outbox_if_due()
+                
+                if self.process_calendar_outbox():
+                    continue
+            except Exception as e:
+                logger.error(f"Erro ao processar a fila de calendários: {str(e)}")
+                self._outbox_stop.wait(self.outbox_poll_interval)
+                continue
+            
+            # Dormir até a próxima tarefa vencer ou um novo registro chegar
+            due_in = self.calendar_outbox.next_due_in()
+            self._outbox_wakeup.wait(self.outbox_poll_interval if due_in is None else min(due_in, self.outbox_poll_interval))
+            self._outbox_wakeup.clear()
+    
+    def _google_event_body(self, summary: str, description: str, start_time: str, end_time: str) -> Dict[str, Any]:
+        return {
             "summary": summary,
             "description": description,
             "start": {
                 "dateTime": start_time,
-                "timeZone": "Asia/Tokyo"
+                "timeZone": CLINIC_TIMEZONE
             },
             "end": {
                 "dateTime": end_time,
-                "timeZone": "Asia/Tokyo"
+                "timeZone": CLINIC_TIMEZONE
             }
         }
-        
-        event = self.google_calendar.events().insert(calendarId=calendar_id, body=event).execute()
-        return event["id"]
     
-    def _create_outlook_calendar_event(self, summary: str, description: str, start_time: str, end_time: str) -> str:
+    def _create_google_calendar_event(self, summary: str, description: str, start_time: str, end_time: str, idempotency_key: Optional[str] = None) -> str:
         """
-        Cria um evento no Microsoft Outlook Calendar.
+        Cria um evento no Google Calendar.
         
         Args:
             summary: Título do evento.
             description: Descrição do evento.
             start_time: Hora de início no formato ISO.
             end_time: Hora de término no formato ISO.
-            
+            idempotency_key: ID do evento escolhido pelo cliente (opcional). Uma
+                nova tentativa com a mesma chave não duplica o evento.
+                
         Returns:
             ID do evento criado.
         """
-        if not self.calendar_settings["outlook"]["enabled"]:
-            raise Exception("Microsoft Outlook não está habilitado.")
+        if not self.calendar_settings["google"]["enabled"]:
+            raise Exception("Google Calendar não está habilitado.")
         
-        # Obter token de acesso
-        result = self.outlook_app.acquire_token_for_client(scopes=self.outlook_scopes)
+        calendar_id = self.calendar_settings["google"]["calendar_id"]
         
-        if "access_token" not in result:
-            raise Exception(f"Erro ao obter token de acesso: {result.get('error')}")
+        event = self._google_event_body(summary, description, start_time, end_time)
+        if idempotency_key:
+            event["id"] = idempotency_key
         
-        # Configurar cabeçalhos
-        headers = {
-            "Authorization": f"Bearer {result['access_token']}",
-            "Content-Type": "application/json"
-        }
+        try:
+            event = self.google_calendar.events().insert(calendarId=calendar_id, body=event).execute()
+        except Exception as e:
+            # 409: o evento já foi criado por uma tentativa anterior (ou removido
+            # após um cancelamento); atualizá-lo o mantém ativo e em dia
+            if idempotency_key and getattr(getattr(e, "resp", None), "status", None) == 409:
+                event["status"] = "confirmed"
+                self.google_calendar.events().update(calendarId=calendar_id, eventId=idempotency_key, body=event).execute()
+                return idempotency_key
+            raise
         
-        # Criar evento
-        event = {
+        return event["id"]
+    
+    def _update_google_calendar_event(self, event_id: str, summary: str, description: str, start_time: str, end_time: str):
+        """
+        Atualiza um evento do Google Calendar.
+        
+        Args:
+            event_id: ID do evento.
+            summary: Título do evento.
+            description: Descrição do evento.
+            start_time: Hora de início no formato ISO.
+            end_time: Hora de término no formato ISO.
+        """
+        calendar_id = self.calendar_settings["google"]["calendar_id"]
+        body = self._google_event_body(summary, description, start_time, end_time)
+        self.google_calendar.events().update(calendarId=calendar_id, eventId=event_id, body=body).execute()
+    
+    def _delete_google_calendar_event(self, event_id: str):
+        """
+        Remove um evento do Google Calendar; eventos já removidos são ignorados.
+        
+        Args:
+            event_id: ID do evento.
+        """
+        calendar_id = self.calendar_settings["google"]["calendar_id"]
+        
+        try:
+            self.google_calendar.events().delete(calendarId=calendar_id, eventId=event_id).execute()
+        except Exception as e:
+            if getattr(getattr(e, "resp", None), "status", None) not in (404, 410):
+                raise
+    
+    def _outlook_event_body(self, summary: str, description: str, start_time: str, end_time: str) -> Dict[str, Any]:
+        return {
             "subject": summary,
             "body": {
                 "contentType": "text",
@@ -743,20 +1563,65 @@ class CalendarManager:
             },
             "start": {
                 "dateTime": start_time,
-                "timeZone": "Asia/Tokyo"
+                "timeZone": CLINIC_TIMEZONE
             },
             "end": {
                 "dateTime": end_time,
-                "timeZone": "Asia/Tokyo"
+                "timeZone": CLINIC_TIMEZONE
             }
         }
+    
+    def _create_outlook_calendar_event(self, summary: str, description: str, start_time: str, end_time: str, idempotency_key: Optional[str] = None) -> str:
+        """
+        Cria um evento no Microsoft Outlook Calendar.
+        
+        Args:
+            summary: Título do evento.
+            description: Descrição do evento.
+            start_time: Hora de início no formato ISO.
+            end_time: Hora de término no formato ISO.
+            idempotency_key: transactionId do evento (opcional). O Graph descarta
+                uma nova tentativa com o mesmo transactionId.
+                
+        Returns:
+            ID do evento criado.
+        """
+        if not self.calendar_settings["outlook"]["enabled"]:
+            raise Exception("Microsoft Outlook não está habilitado.")
+        
+        # Criar evento
+        event = self._outlook_event_body(summary, description, start_time, end_time)
+        if idempotency_key:
+            event["transactionId"] = idempotency_key
         
         # Enviar requisição
-        url = "https://graph.microsoft.com/v1.0/me/events"
-        response = requests.post(url, headers=headers, json=event)
-        response.raise_for_status()
+        return self.outlook_client.post_json("/me/events", event)["id"]
+    
+    def _update_outlook_calendar_event(self, event_id: str, summary: str, description: str, start_time: str, end_time: str):
+        """
+        Atualiza um evento do Microsoft Outlook Calendar.
+        
+        Args:
+            event_id: ID do evento.
+            summary: Título do evento.
+            description: Descrição do evento.
+            start_time: Hora de início no formato ISO.
+            end_time: Hora de término no formato ISO.
+        """
+        self.outlook_client.request("PATCH", f"/me/events/{event_id}", json=self._outlook_event_body(summary, description, start_time, end_time))
+    
+    def _delete_outlook_calendar_event(self, event_id: str):
+        """
+        Remove um evento do Microsoft Outlook Calendar; eventos já removidos são ignorados.
         
-        return response.json()["id"]
+        Args:
+            event_id: ID do evento.
+        """
+        try:
+            self.outlook_client.request("DELETE", f"/me/events/{event_id}")
+        except Exception as e:
+            if getattr(getattr(e, "response", None), "status_code", None) != 404:
+                raise
     
     def update_appointment_status(self, appointment_id: int, status: str) -> bool:
         """
@@ -777,9 +1642,28 @@ class CalendarManager:
                 logger.error(f"Erro ao atualizar status do agendamento {appointment_id}")
                 return False
             
-            # Se confirmado, criar evento no calendário
+            # Se confirmado, criar evento no calendário; demais mudanças são
+            # propagadas aos calendários externos pela fila
             if status == "confirmed":
                 self.create_calendar_event(appointment_id)
+            else:
+                self.enqueue_calendar_sync(appointment_id)
+            
+            # Agendamentos cancelados liberam o horário no armazenamento local e na reserva
+            if status == "cancelled":
+                self.event_store.delete("database", appointment_id)
+                self.slot_holds.release_appointment(appointment_id)
+            
+            # Mudanças de status podem ocupar ou liberar horários na data do agendamento
+            appointment = self.supabase_manager.get_appointment_by_id(appointment_id) or {}
+            appointment_date = appointment.get("appointment_date")
+            if appointment_date:
+                self.availability_index.invalidate(appointment_date)
+            else:
+                self.availability_index.invalidate()
+            
+            # Mover a contagem diária do agendamento para o novo status, na clínica do agendamento
+            self.report_rollups.update_appointment_status(appointment_id, status, appointment.get("clinic_id"))
             
             return True
         except Exception as e:
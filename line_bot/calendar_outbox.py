@@ -0,0 +1,311 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def idempotency_key(provider: str, appointment_id: Any) -> str:
+    """
+    Gera a chave de idempotência do evento de um agendamento em um provedor.
+    A chave usa só caracteres hexadecimais, aceitos também como ID de evento
+    pelo Google Calendar.
+    
+    Args:
+        provider: Provedor de calendário (google, outlook).
+        appointment_id: ID do agendamento.
+        
+    Returns:
+        Chave estável para o par provedor e agendamento.
+    """
+    return hashlib.sha1(f"{provider}:{appointment_id}".encode("utf-8")).hexdigest()
+
+class CalendarOutbox:
+    """
+    Fila persistente de sincronizações com calendários externos.
+    Cada tarefa pede que o evento de um agendamento em um provedor reflita o
+    estado atual do agendamento; tarefas pendentes para o mesmo par são
+    unificadas. Os workers reservam tarefas em lotes por um prazo (lease), e
+    falhas são repetidas com espera exponencial até max_attempts.
+    """
+    
+    def __init__(self, path: str = ":memory:", max_attempts: int = 8, base_delay: float = 5, max_delay: float = 600, lease_seconds: float = 120):
+        """
+        Inicializa a fila.
+        
+        Args:
+            path: Caminho do arquivo SQLite (padrão: banco em memória).
+            max_attempts: Tentativas antes de a tarefa ser marcada como failed (padrão: 8).
+            base_delay: Espera após a primeira falha em segundos, dobrada a cada nova falha (padrão: 5).
+            max_delay: Espera máxima entre tentativas em segundos (padrão: 600).
+            lease_seconds: Prazo para um worker concluir as tarefas reservadas (padrão: 120).
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        
+        with self._lock:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS calendar_outbox (
+                    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    appointment_id TEXT NOT NULL,
+                    provider TEXT NOT NULL,
+                    idempotency_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_until REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_calendar_outbox_due ON calendar_outbox (status, next_attempt_at);
+                CREATE INDEX IF NOT EXISTS idx_calendar_outbox_appointment ON calendar_outbox (appointment_id, provider, status);
+                CREATE TABLE IF NOT EXISTS calendar_links (
+                    appointment_id TEXT NOT NULL,
+                    provider TEXT NOT NULL,
+                    external_id TEXT NOT NULL,
+                    synced_at REAL NOT NULL,
+                    PRIMARY KEY (appointment_id, provider)
+                );
+            """)
+    
+    def enqueue(self, appointment_id: Any, providers: List[str]) -> int:
+        """
+        Registra a sincronização de um agendamento com os provedores.
+        Se já houver tarefa aguardando para o mesmo provedor, ela é antecipada
+        em vez de duplicada.
+        
+        Args:
+            appointment_id: ID do agendamento.
+            providers: Provedores de calendário a sincronizar.
+            
+        Returns:
+            Número de tarefas novas.
+        """
+        return self.enqueue_many([appointment_id], providers)
+    
+    def enqueue_many(self, appointment_ids: List[Any], providers: List[str]) -> int:
+        """
+        Registra, em uma única transação, a sincronização de vários agendamentos.
+        
+        Args:
+            appointment_ids: IDs dos agendamentos.
+            providers: Provedores de calendário a sincronizar.
+            
+        Returns:
+            Número de tarefas novas.
+        """
+        now = time.time()
+        created = 0
+        
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for appointment_id in appointment_ids:
+                    for provider in providers:
+                        cursor = self._conn.execute(
+                            "UPDATE calendar_outbox SET next_attempt_at = MIN(next_attempt_at, ?), updated_at = ? "
+                            "WHERE appointment_id = ? AND provider = ? AND status = 'pending'",
+                            (now, now, str(appointment_id), provider)
+                        )
+                        
+                        if cursor.rowcount == 0:
+                            self._conn.execute(
+                                "INSERT INTO calendar_outbox (appointment_id, provider, idempotency_key, status, next_attempt_at, created_at, updated_at) "
+                                "VALUES (?, ?, ?, 'pending', ?, ?, ?)",
+                                (str(appointment_id), provider, idempotency_key(provider, appointment_id), now, now, now)
+                            )
+                            created += 1
+                
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        
+        return created
+    
+    def claim(self, limit: int = 20, owner: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Reserva as tarefas vencidas mais antigas para um worker.
+        Tarefas cujo lease expirou (worker interrompido) voltam a ser reservadas.
+        
+        Args:
+            limit: Número máximo de tarefas (padrão: 20).
+            owner: Identificador do worker (opcional, padrão: gerado).
+            
+        Returns:
+            Lista de tarefas com job_id, appointment_id, provider,
+            idempotency_key, attempts e external_id (evento já criado, se houver).
+        """
+        now = time.time()
+        owner = owner or uuid.uuid4().hex
+        
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT job_id FROM calendar_outbox "
+                    "WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'running' AND lease_until <= ?) "
+                    "ORDER BY next_attempt_at LIMIT ?",
+                    (now, now, limit)
+                ).fetchall()
+                job_ids = [row["job_id"] for row in rows]
+                
+                self._conn.executemany(
+                    "UPDATE calendar_outbox SET status = 'running', lease_owner = ?, lease_until = ?, updated_at = ? WHERE job_id = ?",
+                    [(owner, now + self.lease_seconds, now, job_id) for job_id in job_ids]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            
+            if not job_ids:
+                return []
+            
+            placeholders = ", ".join("?" for _ in job_ids)
+            jobs = self._conn.execute(
+                f"SELECT o.job_id, o.appointment_id, o.provider, o.idempotency_key, o.attempts, l.external_id "
+                f"FROM calendar_outbox o LEFT JOIN calendar_links l ON l.appointment_id = o.appointment_id AND l.provider = o.provider "
+                f"WHERE o.job_id IN ({placeholders}) ORDER BY o.next_attempt_at",
+                job_ids
+            ).fetchall()
+        
+        return [dict(job) for job in jobs]
+    
+    def complete(self, job_id: int, appointment_id: Any, provider: str, external_id: Optional[str]):
+        """
+        Conclui uma tarefa e registra o evento externo do agendamento.
+        
+        Args:
+            job_id: ID da tarefa.
+            appointment_id: ID do agendamento.
+            provider: Provedor de calendário.
+            external_id: ID do evento no provedor, ou None se o evento foi removido.
+        """
+        now = time.time()
+        
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if external_id:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO calendar_links VALUES (?, ?, ?, ?)",
+                        (str(appointment_id), provider, external_id, now)
+                    )
+                else:
+                    self._conn.execute(
+                        "DELETE FROM calendar_links WHERE appointment_id = ? AND provider = ?",
+                        (str(appointment_id), provider)
+                    )
+                
+                self._conn.execute(
+                    "UPDATE calendar_outbox SET status = 'done', lease_owner = NULL, lease_until = NULL, last_error = NULL, updated_at = ? WHERE job_id = ?",
+                    (now, job_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+    
+    def fail(self, job_id: int, error: str):
+        """
+        Registra a falha de uma tarefa e agenda a próxima tentativa.
+        
+        Args:
+            job_id: ID da tarefa.
+            error: Mensagem de erro.
+        """
+        now = time.time()
+        
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM calendar_outbox WHERE job_id = ?", (job_id,)).fetchone()
+            if not row:
+                return
+            
+            attempts = row["attempts"] + 1
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+            
+            self._conn.execute(
+                "UPDATE calendar_outbox SET status = ?, attempts = ?, next_attempt_at = ?, lease_owner = NULL, lease_until = NULL, last_error = ?, updated_at = ? WHERE job_id = ?",
+                (status, attempts, now + delay, error[:1000], now, job_id)
+            )
+        
+        if status == "failed":
+            logger.error(f"Sincronização de calendário {job_id} desistida após {attempts} tentativas: {error}")
+    
+    def get_external_id(self, appointment_id: Any, provider: str) -> Optional[str]:
+        """
+        Obtém o ID do evento de um agendamento em um provedor.
+        
+        Args:
+            appointment_id: ID do agendamento.
+            provider: Provedor de calendário.
+            
+        Returns:
+            ID do evento, ou None se o agendamento não tiver evento no provedor.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT external_id FROM calendar_links WHERE appointment_id = ? AND provider = ?",
+                (str(appointment_id), provider)
+            ).fetchone()
+        
+        return row["external_id"] if row else None
+    
+    def next_due_in(self) -> Optional[float]:
+        """
+        Obtém o tempo até a próxima tarefa vencer.
+        
+        Returns:
+            Segundos até a próxima tarefa (0 se já houver tarefa vencida), ou None se a fila estiver vazia.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(CASE WHEN status = 'pending' THEN next_attempt_at ELSE lease_until END) FROM calendar_outbox "
+                "WHERE status IN ('pending', 'running')"
+            ).fetchone()
+        
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+    
+    def purge(self, older_than: float = 7 * 24 * 3600):
+        """
+        Remove tarefas concluídas antigas.
+        
+        Args:
+            older_than: Idade mínima em segundos das tarefas removidas (padrão: 7 dias).
+        """
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM calendar_outbox WHERE status = 'done' AND updated_at < ?",
+                (time.time() - older_than,)
+            )
+    
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Obtém o número de tarefas por status.
+        
+        Returns:
+            Dicionário {status: quantidade} com pending, running, done e failed.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS total FROM calendar_outbox GROUP BY status").fetchall()
+        
+        stats = {"pending": 0, "running": 0, "done": 0, "failed": 0}
+        stats.update({row["status"]: row["total"] for row in rows})
+        return stats
@@ -0,0 +1,344 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+from event_store import EventStore
+from event_time import normalize_event, zoned_isoformat
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def format_google_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converte um evento da API do Google Calendar para o formato interno.
+    
+    Args:
+        event: Evento retornado pela API.
+        
+    Returns:
+        Evento no formato {id, title, start, end, start_min, end_min, source}.
+    """
+    # dateTime traz o offset; eventos de dia inteiro (date) começam à meia-noite da clínica
+    start = event["start"].get("dateTime", event["start"].get("date"))
+    end = event["end"].get("dateTime", event["end"].get("date"))
+    
+    return normalize_event({
+        "id": event["id"],
+        "title": event.get("summary", ""),
+        "start": start,
+        "end": end,
+        "source": "google"
+    })
+
+def format_outlook_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converte um evento do Microsoft Graph para o formato interno.
+    
+    Args:
+        event: Evento retornado pela API (dateTime sem offset, com o timezone em timeZone).
+        
+    Returns:
+        Evento no formato {id, title, start, end, start_min, end_min, source}.
+    """
+    return normalize_event({
+        "id": event["id"],
+        "title": event.get("subject", ""),
+        "start": _outlook_datetime(event["start"]),
+        "end": _outlook_datetime(event["end"]),
+        "source": "outlook"
+    })
+
+def _outlook_datetime(value: Dict[str, str]) -> str:
+    """
+    Converte um dateTimeTimeZone do Microsoft Graph em horário ISO com offset.
+    
+    Args:
+        value: Dicionário com dateTime e timeZone (padrão da API: UTC).
+        
+    Returns:
+        Horário ISO com offset.
+    """
+    return zoned_isoformat(value["dateTime"], value.get("timeZone") or "UTC")
+
+class _CursorExpired(Exception):
+    """
+    O provedor descartou o cursor (HTTP 410) e exige uma sincronização completa.
+    """
+
+class _IncrementalSyncer(ABC):
+    """
+    Base dos sincronizadores incrementais.
+    Mantém a janela sincronizada e a rotação diária da janela; a frequência
+    das sincronizações é definida por quem chama sync (CalendarManager).
+    """
+    
+    source = ""
+    
+    def __init__(self, store: EventStore, past_days: int = 30, future_days: int = 180):
+        """
+        Inicializa o sincronizador.
+        
+        Args:
+            store: Armazenamento local de eventos.
+            past_days: Dias anteriores a hoje sincronizados (padrão: 30).
+            future_days: Dias posteriores a hoje sincronizados (padrão: 180).
+        """
+        self.store = store
+        self.past_days = past_days
+        self.future_days = future_days
+        
+        # Janela coberta pela sincronização completa atual
+        self.window_start: Optional[datetime] = None
+        self.window_end: Optional[datetime] = None
+        
+        # Eventos de uma sincronização completa em andamento, aplicados de uma vez ao final
+        self._full_sync_events: Optional[Dict[str, Dict[str, Any]]] = None
+        
+        self._lock = threading.Lock()
+    
+    def covers(self, start_dt: datetime, end_dt: datetime) -> bool:
+        """
+        Verifica se uma janela está dentro da área sincronizada.
+        
+        Args:
+            start_dt: Início da janela (com timezone).
+            end_dt: Fim da janela (com timezone).
+            
+        Returns:
+            True se o armazenamento local puder responder pela janela.
+        """
+        return self.window_start is not None and self.window_start <= start_dt and end_dt <= self.window_end
+    
+    def sync(self) -> int:
+        """
+        Sincroniza imediatamente.
+        
+        Returns:
+            Número de eventos alterados.
+        """
+        with self._lock:
+            return self._sync_locked()
+    
+    def _sync_locked(self) -> int:
+        midnight = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        # A janela avança uma vez por dia com uma nova sincronização completa
+        if self.window_start is not None and self.window_start < midnight - timedelta(days=self.past_days):
+            self.reset()
+        
+        try:
+            changed = self._pull_from(midnight)
+        except _CursorExpired:
+            logger.warning(f"Cursor de sincronização ({self.source}) expirado. Refazendo sincronização completa.")
+            self.reset()
+            changed = self._pull_from(midnight)
+        
+        if changed:
+            logger.info(f"Sincronização incremental ({self.source}): {changed} eventos alterados.")
+        
+        return changed
+    
+    def _pull_from(self, midnight: datetime) -> int:
+        if self._has_cursor():
+            return self._pull()
+        
+        # Sincronização completa: o armazenamento mantém os eventos anteriores até
+        # que todas as páginas cheguem e a janela seja substituída em uma transação
+        self.window_start = midnight - timedelta(days=self.past_days)
+        self.window_end = midnight + timedelta(days=self.future_days)
+        self._full_sync_events = {}
+        try:
+            changed = self._pull()
+            self.store.replace(self.source, list(self._full_sync_events.values()), self.window_start, self.window_end)
+        except Exception:
+            self.reset()
+            raise
+        finally:
+            self._full_sync_events = None
+        
+        return changed
+    
+    def _apply(self, event_id: str, event: Optional[Dict[str, Any]]):
+        """
+        Aplica um evento alterado, ou removido, ao armazenamento ou à sincronização completa em andamento.
+        
+        Args:
+            event_id: ID do evento no provedor.
+            event: Evento no formato interno, ou None se foi removido.
+        """
+        if self._full_sync_events is not None:
+            if event is None:
+                self._full_sync_events.pop(event_id, None)
+            else:
+                self._full_sync_events[event_id] = event
+        elif event is None:
+            self.store.delete(self.source, event_id)
+        else:
+            self.store.upsert(self.source, event)
+    
+    def reset(self):
+        """
+        Descarta o cursor para forçar uma nova sincronização completa.
+        """
+        self.window_start = None
+        self.window_end = None
+        self._clear_cursor()
+    
+    @abstractmethod
+    def _has_cursor(self) -> bool:
+        """
+        Verifica se há um cursor de sincronização incremental.
+        
+        Returns:
+            True se a próxima sincronização puder ser incremental.
+        """
+    
+    @abstractmethod
+    def _clear_cursor(self):
+        """
+        Descarta o cursor de sincronização incremental.
+        """
+    
+    @abstractmethod
+    def _pull(self) -> int:
+        """
+        Busca as alterações no provedor e as aplica com _apply.
+        Sem cursor, busca todos os eventos da janela atual.
+        
+        Returns:
+            Número de eventos alterados.
+            
+        Raises:
+            _CursorExpired: Se o provedor descartou o cursor (HTTP 410).
+        """
+
+class GoogleCalendarSyncer(_IncrementalSyncer):
+    """
+    Sincronizador incremental do Google Calendar baseado em syncToken.
+    """
+    
+    source = "google"
+    
+    def __init__(self, service, calendar_id: str, store: EventStore, **kwargs):
+        """
+        Inicializa o sincronizador do Google Calendar.
+        
+        Args:
+            service: Serviço da API do Google Calendar (googleapiclient).
+            calendar_id: ID do calendário.
+            store: Armazenamento local de eventos.
+            **kwargs: Opções de _IncrementalSyncer.
+        """
+        super().__init__(store, **kwargs)
+        self.service = service
+        self.calendar_id = calendar_id
+        self.sync_token: Optional[str] = None
+    
+    def _has_cursor(self) -> bool:
+        return self.sync_token is not None
+    
+    def _clear_cursor(self):
+        self.sync_token = None
+    
+    def _pull(self) -> int:
+        params = {
+            "calendarId": self.calendar_id,
+            "singleEvents": True,
+            "showDeleted": True
+        }
+        
+        # timeMin/timeMax só são permitidos sem syncToken
+        if self.sync_token:
+            params["syncToken"] = self.sync_token
+        else:
+            params["timeMin"] = self.window_start.isoformat().replace("+00:00", "Z")
+            params["timeMax"] = self.window_end.isoformat().replace("+00:00", "Z")
+        
+        changed = 0
+        page_token = None
+        
+        while True:
+            try:
+                result = self.service.events().list(pageToken=page_token, **params).execute()
+            except Exception as e:
+                # 410 Gone: o token expirou e é preciso sincronizar tudo de novo
+                if getattr(getattr(e, "resp", None), "status", None) == 410 and self.sync_token:
+                    raise _CursorExpired() from e
+                raise
+            
+            for event in result.get("items", []):
+                if event.get("status") == "cancelled":
+                    self._apply(event["id"], None)
+                else:
+                    self._apply(event["id"], format_google_event(event))
+                changed += 1
+            
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                self.sync_token = result.get("nextSyncToken")
+                return changed
+
+class OutlookCalendarSyncer(_IncrementalSyncer):
+    """
+    Sincronizador incremental do Microsoft Outlook baseado em calendarView/delta.
+    """
+    
+    source = "outlook"
+    
+    def __init__(self, get_json: Callable[[str], Dict[str, Any]], store: EventStore, base_url: str = "https://graph.microsoft.com/v1.0", **kwargs):
+        """
+        Inicializa o sincronizador do Microsoft Outlook.
+        
+        Args:
+            get_json: Função que faz um GET autenticado no Graph e devolve o JSON.
+            store: Armazenamento local de eventos.
+            base_url: URL base do Microsoft Graph.
+            **kwargs: Opções de _IncrementalSyncer.
+        """
+        super().__init__(store, **kwargs)
+        self.get_json = get_json
+        self.base_url = base_url
+        self.delta_link: Optional[str] = None
+    
+    def _has_cursor(self) -> bool:
+        return self.delta_link is not None
+    
+    def _clear_cursor(self):
+        self.delta_link = None
+    
+    def _pull(self) -> int:
+        if self.delta_link:
+            url = self.delta_link
+        else:
+            start_param = quote(self.window_start.strftime("%Y-%m-%dT%H:%M:%S"))
+            end_param = quote(self.window_end.strftime("%Y-%m-%dT%H:%M:%S"))
+            url = f"{self.base_url}/me/calendarView/delta?startDateTime={start_param}&endDateTime={end_param}"
+        
+        changed = 0
+        
+        while url:
+            try:
+                page = self.get_json(url)
+            except Exception as e:
+                # 410 Gone: o deltaLink expirou e é preciso sincronizar tudo de novo
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status == 410 and self.delta_link:
+                    raise _CursorExpired() from e
+                raise
+            
+            for event in page.get("value", []):
+                if "@removed" in event:
+                    self._apply(event["id"], None)
+                else:
+                    self._apply(event["id"], format_outlook_event(event))
+                changed += 1
+            
+            url = page.get("@odata.nextLink")
+            if not url:
+                self.delta_link = page.get("@odata.deltaLink")
+        
+        return changed
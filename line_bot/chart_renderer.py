@@ -0,0 +1,455 @@
+import os
+import io
+import json
+import base64
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# matplotlib e seaborn só são carregados no primeiro gráfico (ver _load_plotting)
+plt = None
+sns = None
+_style_ready = False
+
+# O pyplot guarda a figura atual em estado global; renderizações no mesmo processo são serializadas
+_render_lock = threading.Lock()
+
+def _load_plotting():
+    """
+    Importa matplotlib com o backend Agg, sem interface gráfica, e seaborn.
+    """
+    global plt, sns
+    if plt is not None:
+        return
+    
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as pyplot
+    import seaborn
+    
+    plt, sns = pyplot, seaborn
+
+def setup_plot_style():
+    """
+    Configura o estilo dos gráficos para relatórios (uma vez por processo).
+    """
+    global _style_ready
+    if _style_ready:
+        return
+    
+    _load_plotting()
+    
+    # Configurar estilo Seaborn
+    sns.set(style="whitegrid")
+    
+    # Configurar estilo Matplotlib
+    plt.rcParams['figure.figsize'] = (10, 6)
+    plt.rcParams['font.size'] = 12
+    plt.rcParams['axes.labelsize'] = 14
+    plt.rcParams['axes.titlesize'] = 16
+    plt.rcParams['xtick.labelsize'] = 12
+    plt.rcParams['ytick.labelsize'] = 12
+    plt.rcParams['legend.fontsize'] = 12
+    plt.rcParams['figure.titlesize'] = 18
+    
+    _style_ready = True
+
+def render_chart(kind: str, data: Dict[str, Any], title: str, xlabel: Optional[str] = None, ylabel: Optional[str] = None) -> bytes:
+    """
+    Desenha um gráfico e devolve o PNG.
+    
+    Args:
+        kind: Tipo do gráfico (bar, pie ou line).
+        data: Dicionário com dados para o gráfico.
+        title: Título do gráfico.
+        xlabel: Rótulo do eixo X (barras e linha).
+        ylabel: Rótulo do eixo Y (barras e linha).
+        
+    Returns:
+        Bytes da imagem PNG.
+    """
+    with _render_lock:
+        setup_plot_style()
+        
+        if kind == "bar":
+            plt.figure(figsize=(10, 6))
+            
+            # Criar gráfico
+            ax = sns.barplot(x=list(data.keys()), y=list(data.values()))
+            
+            # Configurar rótulos
+            plt.title(title)
+            plt.xlabel(xlabel)
+            plt.ylabel(ylabel)
+            plt.xticks(rotation=45)
+            
+            # Adicionar valores nas barras
+            for i, v in enumerate(data.values()):
+                ax.text(i, v + 0.1, str(v), ha='center')
+        elif kind == "pie":
+            plt.figure(figsize=(8, 8))
+            
+            # Criar gráfico
+            plt.pie(
+                list(data.values()),
+                labels=list(data.keys()),
+                autopct='%1.1f%%',
+                startangle=90,
+                shadow=True
+            )
+            
+            # Configurar rótulos
+            plt.title(title)
+            plt.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle
+        elif kind == "line":
+            plt.figure(figsize=(10, 6))
+            
+            # Ordenar dados
+            sorted_data = {k: data[k] for k in sorted(data.keys())}
+            
+            # Criar gráfico
+            plt.plot(list(sorted_data.keys()), list(sorted_data.values()), marker='o')
+            
+            # Configurar rótulos
+            plt.title(title)
+            plt.xlabel(xlabel)
+            plt.ylabel(ylabel)
+            plt.grid(True)
+        else:
+            raise ValueError(f"Tipo de gráfico desconhecido: {kind}")
+        
+        plt.tight_layout()
+        
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format='png')
+        plt.close()
+        
+        return buffer.getvalue()
+
+def chart_key(kind: str, data: Dict[str, Any], title: str, xlabel: Optional[str] = None, ylabel: Optional[str] = None) -> str:
+    """
+    Calcula a chave de um gráfico a partir do seu conteúdo.
+    A ordem dos dados faz parte da chave, pois define a ordem das barras.
+    
+    Returns:
+        Hash SHA-256 em hexadecimal.
+    """
+    content = json.dumps([kind, title, xlabel, ylabel, [[key, value] for key, value in data.items()]], default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+class ChartImage(str):
+    """
+    Gráfico no formato dos relatórios (data URI PNG em base64), que guarda
+    também os bytes PNG originais para as exportações.
+    """
+    
+    def __new__(cls, png: bytes):
+        image = super().__new__(cls, f"data:image/png;base64,{base64.b64encode(png).decode('utf-8')}")
+        image.png = png
+        return image
+    
+    def __getnewargs__(self):
+        return (self.png,)
+
+def chart_png(image: str) -> bytes:
+    """
+    Obtém os bytes PNG de um gráfico de relatório.
+    
+    Args:
+        image: ChartImage ou data URI base64.
+        
+    Returns:
+        Bytes da imagem PNG.
+    """
+    png = getattr(image, "png", None)
+    if png is not None:
+        return png
+    return base64.b64decode(image.split(',', 1)[1])
+
+class ChartCache:
+    """
+    Cache LRU de imagens de gráficos por chave de conteúdo, em memória e,
+    opcionalmente, em disco (compartilhado entre processos e reinícios).
+    No disco, a data de modificação marca o último uso de cada imagem e as
+    menos usadas são apagadas quando o diretório passa de max_disk_bytes.
+    """
+    
+    def __init__(self, max_items: int = 256, directory: Optional[str] = None, max_disk_bytes: int = 100 * 1024 * 1024):
+        """
+        Inicializa o cache.
+        
+        Args:
+            max_items: Número máximo de imagens em memória (padrão: 256).
+            directory: Diretório do cache em disco (opcional).
+            max_disk_bytes: Tamanho máximo das imagens em disco (padrão: 100 MB).
+        """
+        self.max_items = max_items
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Obtém uma imagem do cache.
+        
+        Args:
+            key: Chave do gráfico.
+            
+        Returns:
+            Bytes do PNG, ou None se não estiver em cache.
+        """
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+                return image
+        
+        if not self.directory:
+            return None
+        
+        path = os.path.join(self.directory, f"{key}.png")
+        try:
+            with open(path, "rb") as f:
+                image = f.read()
+            
+            # Marcar o uso para a limpeza por tamanho
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Erro ao ler gráfico do cache em disco: {str(e)}")
+            return None
+        
+        self._remember(key, image)
+        return image
+    
+    def put(self, key: str, image: bytes):
+        """
+        Armazena uma imagem no cache.
+        
+        Args:
+            key: Chave do gráfico.
+            image: Bytes do PNG.
+        """
+        self._remember(key, image)
+        
+        if not self.directory:
+            return
+        
+        # Gravar em arquivo temporário e renomear, para leitores nunca verem um PNG parcial
+        path = os.path.join(self.directory, f"{key}.png")
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(image)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.error(f"Erro ao gravar gráfico no cache em disco: {str(e)}")
+            return
+        
+        self._prune_disk()
+    
+    def _prune_disk(self):
+        """
+        Apaga as imagens em disco usadas há mais tempo até o diretório caber em max_disk_bytes.
+        """
+        try:
+            files = []
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".png"):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+            
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Já apagada por outro processo
+                    pass
+                total -= size
+        except Exception as e:
+            logger.error(f"Erro ao limpar o cache de gráficos em disco: {str(e)}")
+    
+    def _remember(self, key: str, image: bytes):
+        with self._lock:
+            self._items[key] = image
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+class ChartRenderer:
+    """
+    Renderiza gráficos em um pool de processos, fora da thread que atende a
+    requisição, com as imagens guardadas em ChartCache pela chave de conteúdo.
+    
+    Gráficos iguais pedidos ao mesmo tempo compartilham a mesma renderização.
+    Com max_workers=0, ou se o pool falhar, os gráficos são desenhados no
+    próprio processo.
+    """
+    
+    def __init__(self, max_workers: int = 2, cache: Optional[ChartCache] = None):
+        """
+        Inicializa o renderizador.
+        
+        Args:
+            max_workers: Número de processos de renderização (padrão: 2; 0 = no próprio processo).
+            cache: Cache de imagens (opcional, padrão: ChartCache em memória).
+        """
+        self.max_workers = max_workers
+        self.cache = cache or ChartCache()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+    
+    def submit(self, kind: str, data: Dict[str, Any], title: str, xlabel: Optional[str] = None, ylabel: Optional[str] = None) -> Future:
+        """
+        Pede a renderização de um gráfico sem esperar por ela.
+        
+        Args:
+            kind: Tipo do gráfico (bar, pie ou line).
+            data: Dicionário com dados para o gráfico.
+            title: Título do gráfico.
+            xlabel: Rótulo do eixo X (barras e linha).
+            ylabel: Rótulo do eixo Y (barras e linha).
+            
+        Returns:
+            Future com os bytes da imagem PNG.
+        """
+        key = chart_key(kind, data, title, xlabel, ylabel)
+        
+        image = self.cache.get(key)
+        if image is not None:
+            future = Future()
+            future.set_result(image)
+            return future
+        
+        args = (kind, dict(data), title, xlabel, ylabel)
+        
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                return pending
+            
+            future = Future()
+            self._pending[key] = future
+            pool = self._get_pool()
+        
+        if pool is None:
+            self._complete(key, future, args, None)
+            return future
+        
+        try:
+            pool.submit(render_chart, *args).add_done_callback(lambda done: self._finish(key, future, args, done))
+        except (BrokenProcessPool, RuntimeError) as e:
+            logger.error(f"Erro ao enviar gráfico ao pool de renderização: {str(e)}")
+            self._discard_pool(pool)
+            self._complete(key, future, args, None)
+        
+        return future
+    
+    def render(self, kind: str, data: Dict[str, Any], title: str, xlabel: Optional[str] = None, ylabel: Optional[str] = None) -> bytes:
+        """
+        Renderiza um gráfico e espera o resultado.
+        
+        Returns:
+            Bytes da imagem PNG.
+        """
+        return self.submit(kind, data, title, xlabel, ylabel).result()
+    
+    def shutdown(self):
+        """
+        Encerra o pool de processos.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+    
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers <= 0:
+            return None
+        if self._pool is None:
+            # spawn evita herdar as threads de sincronização e o estado do matplotlib do processo web
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=setup_plot_style
+            )
+        return self._pool
+    
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+    
+    def _finish(self, key: str, future: Future, args: tuple, done: Future):
+        """
+        Conclui um pedido com o resultado do pool. Roda na thread de gerenciamento
+        do pool; se o pool foi interrompido, o gráfico é desenhado em outra thread
+        do próprio processo para não bloqueá-la.
+        """
+        if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+            logger.error("Pool de renderização interrompido; desenhando gráfico no próprio processo")
+            with self._lock:
+                self._pool = None
+            threading.Thread(target=self._complete, args=(key, future, args, None), name="chart-fallback", daemon=True).start()
+            return
+        
+        self._complete(key, future, args, done)
+    
+    def _complete(self, key: str, future: Future, args: tuple, done: Optional[Future]):
+        """
+        Conclui um pedido com o resultado do pool, ou desenhando no próprio processo.
+        """
+        try:
+            image = done.result() if done is not None else render_chart(*args)
+            self.cache.put(key, image)
+            future.set_result(image)
+        except Exception as e:
+            logger.error(f"Erro ao renderizar gráfico: {str(e)}")
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+_shared_renderer: Optional[ChartRenderer] = None
+_shared_lock = threading.Lock()
+
+def get_chart_renderer() -> ChartRenderer:
+    """
+    Obtém o renderizador compartilhado pelo processo, configurado por
+    CHART_RENDER_WORKERS, CHART_CACHE_SIZE, CHART_CACHE_DIR e CHART_CACHE_DISK_MB.
+    
+    Returns:
+        Instância de ChartRenderer.
+    """
+    global _shared_renderer
+    with _shared_lock:
+        if _shared_renderer is None:
+            _shared_renderer = ChartRenderer(
+                max_workers=int(os.getenv("CHART_RENDER_WORKERS", "2")),
+                cache=ChartCache(
+                    int(os.getenv("CHART_CACHE_SIZE", "256")),
+                    os.getenv("CHART_CACHE_DIR"),
+                    int(float(os.getenv("CHART_CACHE_DISK_MB", "100")) * 1024 * 1024)
+                )
+            )
+        return _shared_renderer
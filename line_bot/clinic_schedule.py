@@ -0,0 +1,350 @@
+import os
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from datetime import date, timedelta
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Horário padrão: 9:00 - 18:00, exceto almoço (12:00 - 13:00), de segunda a sexta
+DEFAULT_WEEKLY_HOURS = {
+    0: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Segunda
+    1: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Terça
+    2: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Quarta
+    3: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Quinta
+    4: {"start": "09:00", "end": "18:00", "lunch_start": "12:00", "lunch_end": "13:00"},  # Sexta
+    5: None,  # Sábado - fechado
+    6: None   # Domingo - fechado
+}
+
+# Feriados com data especial nos anos olímpicos (2020 e 2021)
+_OLYMPIC_HOLIDAYS = {
+    2020: {"海の日": date(2020, 7, 23), "スポーツの日": date(2020, 7, 24), "山の日": date(2020, 8, 10)},
+    2021: {"海の日": date(2021, 7, 22), "スポーツの日": date(2021, 7, 23), "山の日": date(2021, 8, 8)}
+}
+
+def _to_minutes(time_str: str) -> int:
+    """
+    Converte um horário HH:MM em minutos desde a meia-noite.
+    
+    Args:
+        time_str: Horário no formato HH:MM.
+        
+    Returns:
+        Minutos desde a meia-noite.
+    """
+    hours, minutes = map(int, time_str.split(":"))
+    return hours * 60 + minutes
+
+def format_minutes(minutes: int) -> str:
+    """
+    Converte minutos desde a meia-noite em um horário HH:MM.
+    
+    Args:
+        minutes: Minutos desde a meia-noite.
+        
+    Returns:
+        Horário no formato HH:MM.
+    """
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def compile_day(hours: Optional[Dict[str, Any]]) -> Tuple[Tuple[int, int], ...]:
+    """
+    Converte o horário de um dia em segmentos abertos (início, fim) em minutos.
+    
+    Args:
+        hours: Horário do dia com start, end, lunch_start, lunch_end e breaks
+            (lista opcional de pares [início, fim]), ou None se fechado.
+            
+    Returns:
+        Tupla de segmentos abertos em ordem crescente.
+    """
+    if not hours:
+        return ()
+    
+    # Almoço e demais pausas recortam o expediente
+    breaks = [(_to_minutes(start), _to_minutes(end)) for start, end in hours.get("breaks", [])]
+    if hours.get("lunch_start") and hours.get("lunch_end"):
+        breaks.append((_to_minutes(hours["lunch_start"]), _to_minutes(hours["lunch_end"])))
+    
+    segments = []
+    current = _to_minutes(hours["start"])
+    end = _to_minutes(hours["end"])
+    
+    for break_start, break_end in sorted(breaks):
+        if break_start > current:
+            segments.append((current, min(break_start, end)))
+        current = max(current, break_end)
+    
+    if current < end:
+        segments.append((current, end))
+    
+    return tuple(segments)
+
+def segment_slot_starts(segments: Sequence[Tuple[int, int]], duration_minutes: int = 30) -> Tuple[int, ...]:
+    """
+    Obtém os inícios de slot de uma lista de segmentos abertos.
+    Os slots começam no início de cada segmento e avançam pela duração.
+    
+    Args:
+        segments: Segmentos abertos (início, fim) em minutos desde a meia-noite.
+        duration_minutes: Duração da consulta em minutos (padrão: 30).
+        
+    Returns:
+        Tupla de inícios em minutos desde a meia-noite.
+    """
+    return tuple(
+        start
+        for segment_start, segment_end in segments
+        for start in range(segment_start, segment_end - duration_minutes + 1, duration_minutes)
+    )
+
+def _nth_monday(year: int, month: int, nth: int) -> date:
+    first = date(year, month, 1)
+    return first + timedelta(days=(7 - first.weekday()) % 7 + 7 * (nth - 1))
+
+@lru_cache(maxsize=64)
+def japanese_holidays(year: int) -> Dict[date, str]:
+    """
+    Calcula os feriados nacionais do Japão de um ano (regras vigentes desde 2020),
+    incluindo feriados substitutos (振替休日) e dias entre feriados (国民の休日).
+    
+    Args:
+        year: Ano (1980 a 2099, pelo cálculo dos equinócios).
+        
+    Returns:
+        Dicionário {data: nome do feriado}.
+    """
+    # Equinócios pela aproximação astronômica usada pelo Observatório Nacional
+    offset = year - 1980
+    vernal_equinox = int(20.8431 + 0.242194 * offset - offset // 4)
+    autumnal_equinox = int(23.2488 + 0.242194 * offset - offset // 4)
+    
+    holidays = {
+        date(year, 1, 1): "元日",
+        _nth_monday(year, 1, 2): "成人の日",
+        date(year, 2, 11): "建国記念の日",
+        date(year, 2, 23): "天皇誕生日",
+        date(year, 3, vernal_equinox): "春分の日",
+        date(year, 4, 29): "昭和の日",
+        date(year, 5, 3): "憲法記念日",
+        date(year, 5, 4): "みどりの日",
+        date(year, 5, 5): "こどもの日",
+        _nth_monday(year, 9, 3): "敬老の日",
+        date(year, 9, autumnal_equinox): "秋分の日",
+        date(year, 11, 3): "文化の日",
+        date(year, 11, 23): "勤労感謝の日"
+    }
+    
+    moved = _OLYMPIC_HOLIDAYS.get(year, {})
+    holidays[moved.get("海の日", _nth_monday(year, 7, 3))] = "海の日"
+    holidays[moved.get("山の日", date(year, 8, 11))] = "山の日"
+    holidays[moved.get("スポーツの日", _nth_monday(year, 10, 2))] = "スポーツの日"
+    
+    # 国民の休日: dia útil entre dois feriados
+    for day in sorted(holidays):
+        between = day + timedelta(days=1)
+        if between not in holidays and between + timedelta(days=1) in holidays and between.weekday() != 6:
+            holidays[between] = "国民の休日"
+    
+    # 振替休日: feriado no domingo passa para o próximo dia que não é feriado
+    for day in sorted(holidays):
+        if day.weekday() == 6:
+            substitute = day + timedelta(days=1)
+            while substitute in holidays:
+                substitute += timedelta(days=1)
+            holidays[substitute] = "振替休日"
+    
+    return holidays
+
+class ClinicSchedule:
+    """
+    Calendário de funcionamento da clínica.
+    Compila uma vez os modelos por dia da semana em minutos, aplica exceções
+    por data e feriados, e mantém em cache os segmentos e inícios de slot de
+    cada data.
+    """
+    
+    def __init__(self, weekly_hours: Optional[Dict[int, Optional[Dict[str, Any]]]] = None, exceptions: Optional[Dict[str, Optional[Dict[str, Any]]]] = None, holidays: Optional[str] = "jp"):
+        """
+        Inicializa o calendário.
+        
+        Args:
+            weekly_hours: Horário por dia da semana (0 = segunda), no formato de
+                DEFAULT_WEEKLY_HOURS (padrão: DEFAULT_WEEKLY_HOURS).
+            exceptions: Horário especial por data (YYYY-MM-DD), ou None para
+                fechar a clínica na data (opcional).
+            holidays: Calendário de feriados em que a clínica fecha ("jp" ou None).
+        """
+        self.weekly_hours = {weekday: (weekly_hours or DEFAULT_WEEKLY_HOURS).get(weekday) for weekday in range(7)}
+        self.exceptions = {date.fromisoformat(day): hours for day, hours in (exceptions or {}).items()}
+        self.holidays = holidays
+        
+        # Modelos compilados uma única vez
+        self._weekly_segments = {weekday: compile_day(hours) for weekday, hours in self.weekly_hours.items()}
+        self._exception_segments = {day: compile_day(hours) for day, hours in self.exceptions.items()}
+        
+        # Caches por data
+        self.segments_for = lru_cache(maxsize=1024)(self._segments_for)
+        self.slot_starts = lru_cache(maxsize=1024)(self._slot_starts)
+    
+    @classmethod
+    def from_env(cls) -> "ClinicSchedule":
+        """
+        Carrega o calendário de CLINIC_SCHEDULE_FILE (JSON com weekly, exceptions
+        e holidays) e CLINIC_HOLIDAYS ("jp" ou "none").
+        
+        Returns:
+            Instância de ClinicSchedule; sem configuração, usa o horário padrão.
+        """
+        holidays = os.getenv("CLINIC_HOLIDAYS", "jp").lower()
+        
+        schedule_file = os.getenv("CLINIC_SCHEDULE_FILE", "")
+        if schedule_file:
+            try:
+                with open(schedule_file, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                
+                weekly_hours = None
+                if config.get("weekly"):
+                    weekly_hours = {int(weekday): hours for weekday, hours in config["weekly"].items()}
+                exceptions = config.get("exceptions")
+                file_holidays = str(config.get("holidays", holidays) or "none").lower()
+                
+                # Os horários são compilados aqui: erros de configuração também caem no padrão
+                schedule = cls(weekly_hours, exceptions, None if file_holidays == "none" else file_holidays)
+                
+                logger.info(f"Calendário da clínica carregado de {schedule_file}")
+                return schedule
+            except Exception as e:
+                logger.error(f"Erro ao carregar calendário da clínica, usando o horário padrão: {str(e)}")
+        
+        return cls(None, None, None if holidays == "none" else holidays)
+    
+    def holiday_name(self, day: date) -> Optional[str]:
+        """
+        Obtém o nome do feriado de uma data.
+        
+        Args:
+            day: Data.
+            
+        Returns:
+            Nome do feriado, ou None se não for feriado.
+        """
+        if self.holidays == "jp":
+            return japanese_holidays(day.year).get(day)
+        return None
+    
+    def has_override(self, day: date) -> bool:
+        """
+        Verifica se a data foge do modelo do dia da semana (exceção ou feriado).
+        
+        Args:
+            day: Data.
+            
+        Returns:
+            True se a data tiver horário próprio.
+        """
+        return day in self.exceptions or self.holiday_name(day) is not None
+    
+    def _segments_for(self, day: date) -> Tuple[Tuple[int, int], ...]:
+        """
+        Obtém os segmentos abertos de uma data, em minutos desde a meia-noite.
+        
+        Args:
+            day: Data.
+            
+        Returns:
+            Tupla de segmentos (início, fim); vazia se a clínica estiver fechada.
+        """
+        # Exceções por data têm prioridade sobre feriados
+        if day in self._exception_segments:
+            return self._exception_segments[day]
+        
+        if self.holiday_name(day) is not None:
+            return ()
+        
+        return self._weekly_segments[day.weekday()]
+    
+    def _slot_starts(self, day: date, duration_minutes: int = 30) -> Tuple[int, ...]:
+        """
+        Obtém os inícios de slot de uma data em que a consulta cabe inteira.
+        Os slots começam no início de cada segmento e avançam pela duração.
+        
+        Args:
+            day: Data.
+            duration_minutes: Duração da consulta em minutos (padrão: 30).
+            
+        Returns:
+            Tupla de inícios em minutos desde a meia-noite.
+        """
+        return segment_slot_starts(self.segments_for(day), duration_minutes)
+    
+    def is_open(self, day: date) -> bool:
+        """
+        Verifica se a clínica abre em uma data.
+        
+        Args:
+            day: Data.
+            
+        Returns:
+            True se houver algum horário de funcionamento.
+        """
+        return bool(self.segments_for(day))
+    
+    def is_bookable(self, day: date, time_str: str, duration_minutes: int = 30) -> bool:
+        """
+        Verifica se uma consulta pode começar em um horário de uma data.
+        
+        Args:
+            day: Data.
+            time_str: Horário no formato HH:MM.
+            duration_minutes: Duração da consulta em minutos (padrão: 30).
+            
+        Returns:
+            True se a consulta couber inteira em um segmento aberto.
+        """
+        start = _to_minutes(time_str)
+        return any(
+            segment_start <= start and start + duration_minutes <= segment_end
+            for segment_start, segment_end in self.segments_for(day)
+        )
+    
+    def is_within_weekly_hours(self, time_str: str, duration_minutes: int = 30) -> bool:
+        """
+        Verifica se um horário cabe no expediente de algum dia da semana.
+        Usado quando a data ainda não é conhecida.
+        
+        Args:
+            time_str: Horário no formato HH:MM.
+            duration_minutes: Duração da consulta em minutos (padrão: 30).
+            
+        Returns:
+            True se a consulta couber em algum segmento semanal.
+        """
+        start = _to_minutes(time_str)
+        return any(
+            segment_start <= start and start + duration_minutes <= segment_end
+            for segments in self._weekly_segments.values()
+            for segment_start, segment_end in segments
+        )
+    
+    def weekly_slot_starts(self, duration_minutes: int = 30) -> List[int]:
+        """
+        Obtém os inícios de slot de todos os dias da semana, sem repetição.
+        Usado quando a data ainda não é conhecida.
+        
+        Args:
+            duration_minutes: Duração da consulta em minutos (padrão: 30).
+            
+        Returns:
+            Lista ordenada de inícios em minutos desde a meia-noite.
+        """
+        return sorted({
+            start
+            for segments in self._weekly_segments.values()
+            for start in segment_slot_starts(segments, duration_minutes)
+        })
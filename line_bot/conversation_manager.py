@@ -3,6 +3,8 @@ import json
 import logging
 from typing import Dict, List, Optional, Any, Tuple
 
+from clinic_schedule import ClinicSchedule, format_minutes
+from event_time import clinic_now
 from translation_manager import TranslationManager
 
 # Configurar logging
@@ -15,7 +17,7 @@ class ConversationManager:
     Gerencia o fluxo de conversa, estados dos usuários e processamento de mensagens.
     """
     
-    def __init__(self, supabase_manager, line_manager, translation_manager: Optional[TranslationManager] = None):
+    def __init__(self, supabase_manager, line_manager, translation_manager: Optional[TranslationManager] = None, calendar_manager=None):
         """
         Inicializa o gerenciador de conversas.
         
@@ -23,10 +25,15 @@ class ConversationManager:
             supabase_manager: Instância do gerenciador do Supabase.
             line_manager: Instância do gerenciador do LINE.
             translation_manager: Instância do gerenciador de traduções.
+            calendar_manager: Instância do gerenciador de calendário (opcional).
         """
         self.supabase_manager = supabase_manager
         self.line_manager = line_manager
         self.translation_manager = translation_manager or TranslationManager()
+        self.calendar_manager = calendar_manager
+        
+        # Calendário da clínica, compartilhado com o gerenciador de calendário
+        self.schedule = calendar_manager.schedule if calendar_manager is not None else ClinicSchedule.from_env()
         
         # Estados dos usuários
         self.user_states = {}
@@ -293,15 +300,25 @@ class ConversationManager:
             elif value.startswith("time_"):
                 # Processar seleção de horário
                 selected_time = value.replace("time_", "")
+                return self._select_appointment_time(line_user_id, selected_time)
+            
+            elif value.startswith("slot_"):
+                # Processar seleção de um dos próximos horários disponíveis
+                selected_date, selected_time = value.replace("slot_", "").split("_")
                 self.update_user_state(line_user_id, {
                     "appointment_data": {
                         **user_state.get("appointment_data", {}),
-                        "time": selected_time
+                        "date": selected_date
                     },
-                    "appointment_step": "reason"
+                    "appointment_step": "time"
                 })
                 
-                return self._request_appointment_reason(line_user_id)
+                return self._select_appointment_time(line_user_id, selected_time)
+            
+            elif value == "change_date":
+                # Voltar à escolha da data
+                self.update_user_state(line_user_id, {"appointment_step": "date"})
+                return self._request_appointment_date(line_user_id)
         
         # Se não for uma ação conhecida, enviar menu principal
         return self._send_main_menu(line_user_id)
@@ -484,21 +501,12 @@ class ConversationManager:
         
         elif appointment_step == "time":
             # Processar horário da consulta
-            if not self._validate_time(message):
+            if not self._validate_time(message, user_state.get("appointment_data", {}).get("date")):
                 # Horário inválido, solicitar novamente
                 return self._request_appointment_time(line_user_id, True)
             
-            # Salvar horário da consulta
-            self.update_user_state(line_user_id, {
-                "appointment_data": {
-                    **user_state.get("appointment_data", {}),
-                    "time": message.strip()
-                },
-                "appointment_step": "reason"
-            })
-            
-            # Solicitar motivo
-            return self._request_appointment_reason(line_user_id)
+            # Reservar e salvar horário da consulta
+            return self._select_appointment_time(line_user_id, message.strip())
         
         elif appointment_step == "reason":
             # Processar motivo da consulta
@@ -530,7 +538,11 @@ class ConversationManager:
                 # Confirmado, salvar agendamento
                 return self._confirm_appointment(line_user_id)
             else:
-                # Não confirmado, cancelar agendamento
+                # Não confirmado, liberar o horário reservado e cancelar agendamento
+                hold_id = user_state.get("appointment_data", {}).get("hold_id")
+                if self.calendar_manager and hold_id:
+                    self.calendar_manager.slot_holds.release(hold_id)
+                
                 self.update_user_state(line_user_id, {
                     "current_flow": None,
                     "appointment_step": None,
@@ -633,8 +645,8 @@ class ConversationManager:
         else:
             message = self.translation_manager.get_multilingual_response("date_prompt", language)
         
-        # Obter datas disponíveis (próximos 7 dias úteis)
-        available_dates = self._get_available_dates(7)
+        # Obter datas disponíveis (próximos 7 dias úteis com horários livres)
+        available_dates = self._get_available_dates(7, holder=line_user_id)
         
         # Criar botões para datas disponíveis
         actions = []
@@ -646,6 +658,14 @@ class ConversationManager:
                 "displayText": date_display
             })
         
+        # Sem datas livres, o LINE recusa um template sem botões: enviar só o texto
+        if not actions:
+            message = self.translation_manager.translate_text(
+                "There are no available dates in the coming days. Please enter a date in the format YYYY-MM-DD (e.g., 2025-05-01).",
+                "en", language
+            )
+            return [{"type": "text", "text": message}]
+        
         # Criar template de botões
         template = {
             "type": "buttons",
@@ -659,13 +679,56 @@ class ConversationManager:
             "template": template
         }]
     
-    def _request_appointment_time(self, line_user_id: str, is_retry: bool = False) -> List[Dict]:
+    def _select_appointment_time(self, line_user_id: str, selected_time: str) -> List[Dict]:
+        """
+        Reserva o horário escolhido e avança para o motivo da consulta.
+        
+        Args:
+            line_user_id: ID do usuário no LINE.
+            selected_time: Horário escolhido no formato HH:MM.
+            
+        Returns:
+            Lista de mensagens a serem enviadas.
+        """
+        user_state = self.get_user_state(line_user_id)
+        appointment_data = user_state.get("appointment_data", {})
+        hold_id = appointment_data.get("hold_id")
+        
+        if self.calendar_manager:
+            # Trocar de horário libera a reserva anterior
+            if hold_id:
+                self.calendar_manager.slot_holds.release(hold_id)
+            
+            hold_id = self.calendar_manager.hold_slot(appointment_data.get("date"), selected_time, line_user_id)
+            
+            if not hold_id:
+                # Outro paciente reservou o horário primeiro
+                self.update_user_state(line_user_id, {
+                    "appointment_data": {**appointment_data, "hold_id": None}
+                })
+                return self._request_appointment_time(line_user_id, slot_taken=True)
+        
+        # Salvar horário da consulta
+        self.update_user_state(line_user_id, {
+            "appointment_data": {
+                **appointment_data,
+                "time": selected_time,
+                "hold_id": hold_id
+            },
+            "appointment_step": "reason"
+        })
+        
+        # Solicitar motivo
+        return self._request_appointment_reason(line_user_id)
+    
+    def _request_appointment_time(self, line_user_id: str, is_retry: bool = False, slot_taken: bool = False) -> List[Dict]:
         """
         Solicita o horário da consulta.
         
         Args:
             line_user_id: ID do usuário no LINE.
             is_retry: Se é uma nova tentativa após erro.
+            slot_taken: Se o horário escolhido acabou de ser reservado por outro paciente.
             
         Returns:
             Lista de mensagens a serem enviadas.
@@ -674,7 +737,12 @@ class ConversationManager:
         language = user_state.get("language", "ja")
         
         # Obter mensagem de solicitação de horário
-        if is_retry:
+        if slot_taken:
+            message = self.translation_manager.translate_text(
+                "Sorry, this time was just reserved by another patient. Please choose another time.",
+                "en", language
+            )
+        elif is_retry:
             message = self.translation_manager.translate_text(
                 "Please enter a valid time in the format HH:MM (e.g., 14:30).",
                 "en", language
@@ -682,8 +750,9 @@ class ConversationManager:
         else:
             message = self.translation_manager.get_multilingual_response("time_prompt", language)
         
-        # Obter horários disponíveis
-        available_times = self._get_available_times()
+        # Obter horários disponíveis para a data escolhida
+        selected_date = user_state.get("appointment_data", {}).get("date")
+        available_times = self._get_available_times(selected_date, line_user_id)
         
         # Criar botões para horários disponíveis
         actions = []
@@ -695,6 +764,39 @@ class ConversationManager:
                 "displayText": time_str
             })
         
+        # Data lotada: oferecer os próximos horários livres em outras datas
+        if not actions and selected_date:
+            next_slots = self._get_next_available_slots(selected_date, line_user_id)
+            if next_slots:
+                message = self.translation_manager.translate_text(
+                    "There are no available times on this date. Here are the next available times.",
+                    "en", language
+                )
+            
+            for slot in next_slots:
+                label = f"{slot['date'][5:].replace('-', '/')} {slot['time']}"
+                actions.append({
+                    "type": "postback",
+                    "label": label,
+                    "data": f"appointment=slot_{slot['date']}_{slot['time']}",
+                    "displayText": label
+                })
+        
+        # Nenhum horário livre: o LINE recusa um template sem botões, então
+        # oferecer a escolha de outra data
+        if not actions:
+            message = self.translation_manager.translate_text(
+                "There are no available times on this date. Please choose another date.",
+                "en", language
+            )
+            label = self.translation_manager.translate_text("Choose another date", "en", language)
+            actions.append({
+                "type": "postback",
+                "label": label,
+                "data": "appointment=change_date",
+                "displayText": label
+            })
+        
         # Criar template de botões
         template = {
             "type": "buttons",
@@ -825,6 +927,16 @@ class ConversationManager:
                 *self._send_main_menu(line_user_id)
             ]
         
+        # Converter a reserva em agendamento; falha se outro paciente ocupou o horário
+        hold_id = appointment_data.get("hold_id")
+        if self.calendar_manager and hold_id and not self.calendar_manager.slot_holds.confirm(hold_id):
+            logger.warning(f"Reserva expirada e horário ocupado para o usuário {line_user_id}")
+            self.update_user_state(line_user_id, {
+                "appointment_data": {**appointment_data, "hold_id": None},
+                "appointment_step": "time"
+            })
+            return self._request_appointment_time(line_user_id, slot_taken=True)
+        
         # Salvar agendamento no banco de dados
         appointment_id = self.supabase_manager.create_appointment(
             patient_id=patient.get("id"),
@@ -835,6 +947,10 @@ class ConversationManager:
         
         if not appointment_id:
             logger.error(f"Erro ao criar agendamento para o usuário {line_user_id}")
+            # Devolver o horário reservado
+            if self.calendar_manager and hold_id:
+                self.calendar_manager.slot_holds.release(hold_id)
+            
             # Enviar mensagem de erro
             error_message = self.translation_manager.translate_text(
                 "An error occurred while scheduling your appointment. Please try again.",
@@ -846,6 +962,24 @@ class ConversationManager:
                 *self._send_main_menu(line_user_id)
             ]
         
+        # O horário reservado deixa de estar disponível
+        if self.calendar_manager:
+            if hold_id:
+                self.calendar_manager.slot_holds.attach_appointment(hold_id, appointment_id)
+            
+            self.calendar_manager.register_appointment({
+                "id": appointment_id,
+                "patient_id": patient.get("id"),
+                "appointment_date": appointment_data.get("date"),
+                "appointment_time": appointment_data.get("time"),
+                "reason": appointment_data.get("reason"),
+                "status": "pending",
+                "resource_id": self.calendar_manager.slot_holds.get_resource(hold_id) if hold_id else None
+            })
+            
+            # Agendamentos pendentes não vão aos calendários externos; a confirmação
+            # (update_appointment_status) enfileira a criação do evento
+        
         # Limpar estado do usuário
         self.update_user_state(line_user_id, {
             "current_flow": None,
@@ -1099,7 +1233,7 @@ class ConversationManager:
         # Verificar se é uma data válida
         try:
             date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-            today = datetime.now()
+            today = clinic_now()
             
             # Verificar se a data é futura
             if date_obj.date() < today.date():
@@ -1109,17 +1243,20 @@ class ConversationManager:
         except ValueError:
             return False
     
-    def _validate_time(self, time_str: str) -> bool:
+    def _validate_time(self, time_str: str, date_str: Optional[str] = None) -> bool:
         """
         Valida uma string de horário.
         
         Args:
             time_str: String de horário no formato HH:MM.
-            
+            date_str: Data da consulta no formato YYYY-MM-DD (opcional). Sem data,
+                o horário é comparado ao expediente semanal.
+                
         Returns:
             True se o horário for válido, False caso contrário.
         """
         import re
+        from datetime import datetime
         
         # Verificar formato
         if not re.match(r"^\d{1,2}:\d{2}$", time_str):
@@ -1132,20 +1269,48 @@ class ConversationManager:
             if hours < 0 or hours > 23 or minutes < 0 or minutes > 59:
                 return False
             
-            # Verificar se está dentro do horário de funcionamento (9:00 - 18:00)
-            if hours < 9 or (hours == 18 and minutes > 0) or hours > 18:
-                return False
+            # Verificar se está dentro do horário de funcionamento
+            if date_str:
+                return self.schedule.is_bookable(datetime.strptime(date_str, "%Y-%m-%d").date(), time_str)
             
-            return True
+            return self.schedule.is_within_weekly_hours(time_str)
         except ValueError:
             return False
     
-    def _get_available_dates(self, num_days: int = 7) -> List[Tuple[str, str]]:
+    def _get_next_available_slots(self, date_str: str, holder: Optional[str] = None, count: int = 4) -> List[Dict[str, Any]]:
+        """
+        Obtém os próximos slots livres a partir de uma data.
+        
+        Args:
+            date_str: Data inicial no formato YYYY-MM-DD.
+            holder: ID do usuário no LINE cujas reservas continuam visíveis (opcional).
+            count: Número de slots (padrão: 4, limite de botões).
+            
+        Returns:
+            Lista de slots no formato {date: YYYY-MM-DD, time: HH:MM, resources: [...]}.
+        """
+        from datetime import datetime
+        from itertools import islice
+        
+        if not self.calendar_manager:
+            return []
+        
+        try:
+            after = max(datetime.strptime(date_str, "%Y-%m-%d"), clinic_now())
+            return list(islice(self.calendar_manager.iter_free_slots(after, holder=holder), count))
+        except Exception as e:
+            logger.error(f"Erro ao buscar próximos horários disponíveis a partir de {date_str}: {str(e)}")
+            return []
+    
+    def _get_available_dates(self, num_days: int = 7, holder: Optional[str] = None, horizon_days: int = 30) -> List[Tuple[str, str]]:
         """
         Obtém datas disponíveis para agendamento.
+        Com calendário, só entram os dias que ainda têm horários livres.
         
         Args:
             num_days: Número de dias úteis a serem retornados.
+            holder: ID do usuário no LINE cujas reservas continuam visíveis (opcional).
+            horizon_days: Número máximo de dias à frente percorridos (padrão: 30).
             
         Returns:
             Lista de tuplas (data_str, data_display) com datas disponíveis.
@@ -1160,18 +1325,35 @@ class ConversationManager:
             pass
         
         # Data atual
-        current_date = datetime.now()
+        current_date = clinic_now()
+        
+        # Horários livres por dia, calculados para todo o horizonte de uma vez
+        free_by_date = None
+        if self.calendar_manager:
+            try:
+                start_date = (current_date + timedelta(days=1)).strftime("%Y-%m-%d")
+                summary = self.calendar_manager.get_availability_summary(start_date, horizon_days, holder=holder)
+                free_by_date = {day["date"]: day["free"] for day in summary}
+            except Exception as e:
+                logger.error(f"Erro ao obter resumo de disponibilidade: {str(e)}")
         
         # Lista de datas disponíveis
         available_dates = []
         
         # Adicionar próximos dias úteis
         days_added = 0
-        while days_added < num_days:
+        for _ in range(horizon_days):
+            if days_added >= num_days:
+                break
+            
             current_date += timedelta(days=1)
             
-            # Pular finais de semana (0 = segunda, 6 = domingo)
-            if current_date.weekday() >= 5:
+            # Pular dias em que a clínica não abre (fins de semana, feriados e exceções)
+            if not self.schedule.is_open(current_date.date()):
+                continue
+            
+            # Pular dias sem nenhum horário livre
+            if free_by_date is not None and not free_by_date.get(current_date.strftime("%Y-%m-%d")):
                 continue
             
             # Formatar data
@@ -1190,23 +1372,38 @@ class ConversationManager:
         
         return available_dates
     
-    def _get_available_times(self) -> List[str]:
+    def _get_available_times(self, date_str: Optional[str] = None, holder: Optional[str] = None) -> List[str]:
         """
         Obtém horários disponíveis para agendamento.
         
+        Args:
+            date_str: Data no formato YYYY-MM-DD (opcional).
+            holder: ID do usuário no LINE cujas reservas continuam visíveis (opcional).
+            
         Returns:
             Lista de strings com horários disponíveis.
         """
-        # Horários de funcionamento: 9:00 - 18:00, intervalos de 30 minutos
-        available_times = []
-        
-        for hour in range(9, 18):
-            for minute in [0, 30]:
-                # Pular 12:00 e 12:30 (horário de almoço)
-                if hour == 12:
-                    continue
+        from datetime import datetime
+        
+        # Consultar o índice de disponibilidade quando houver calendário e data
+        if self.calendar_manager and date_str:
+            try:
+                available_times = self.calendar_manager.get_free_times(date_str, holder)
+                
+                # Descartar horários que já passaram no dia de hoje
+                now = clinic_now()
+                if date_str == now.strftime("%Y-%m-%d"):
+                    current_time = now.strftime("%H:%M")
+                    available_times = [time_str for time_str in available_times if time_str > current_time]
                 
-                time_str = f"{hour:02d}:{minute:02d}"
-                available_times.append(time_str)
+                return available_times
+            except Exception as e:
+                logger.error(f"Erro ao consultar horários disponíveis para {date_str}: {str(e)}")
+        
+        # Horários de funcionamento do calendário da clínica, intervalos de 30 minutos
+        if date_str:
+            starts = self.schedule.slot_starts(datetime.strptime(date_str, "%Y-%m-%d").date(), 30)
+        else:
+            starts = self.schedule.weekly_slot_starts(30)
         
-        return available_times
+        return [format_minutes(start) for start in starts]
@@ -0,0 +1,312 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+from datetime import datetime, timedelta
+
+from event_time import CLINIC_TZ, parse_datetime
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_RESOURCE = "clinic"
+
+def _to_timestamp(value: str) -> int:
+    """
+    Converte um horário ISO (com ou sem timezone, ou só a data) em segundos desde a época (UTC).
+    
+    Args:
+        value: Horário no formato ISO. Horários sem timezone são tratados como horário da clínica.
+        
+    Returns:
+        Timestamp em segundos.
+    """
+    return int(parse_datetime(value).timestamp())
+
+def _clinic_dates(start_ts: int, end_ts: int) -> List[str]:
+    """
+    Obtém as datas da clínica ocupadas por um evento.
+    
+    Args:
+        start_ts: Início em segundos desde a época.
+        end_ts: Fim em segundos desde a época.
+        
+    Returns:
+        Datas no formato YYYY-MM-DD, do início ao último instante do evento.
+    """
+    day = datetime.fromtimestamp(start_ts, CLINIC_TZ).date()
+    last_day = datetime.fromtimestamp(max(start_ts, end_ts - 1), CLINIC_TZ).date()
+    
+    dates = []
+    while day <= last_day:
+        dates.append(day.isoformat())
+        day += timedelta(days=1)
+    
+    return dates
+
+class EventStore:
+    """
+    Armazenamento local de eventos em SQLite.
+    Os sincronizadores de calendário e o registro de agendamentos gravam aqui,
+    e as consultas de disponibilidade são respondidas por uma busca por
+    intervalo no índice (start_ts, end_ts), ou (resource, start_ts, end_ts)
+    quando a consulta é de um recurso.
+    """
+    
+    def __init__(self, path: str = ":memory:"):
+        """
+        Inicializa o armazenamento.
+        
+        Args:
+            path: Caminho do arquivo SQLite (padrão: banco em memória).
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        
+        # Datas da clínica com eventos alterados desde a última consulta
+        self._changed_dates: Set[str] = set()
+        
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS events (
+                    source TEXT NOT NULL,
+                    event_id TEXT NOT NULL,
+                    resource TEXT NOT NULL,
+                    start_ts INTEGER NOT NULL,
+                    end_ts INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (source, event_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_events_range ON events (resource, start_ts, end_ts);
+                CREATE INDEX IF NOT EXISTS idx_events_start ON events (start_ts, end_ts);
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    source TEXT PRIMARY KEY,
+                    synced_at REAL NOT NULL,
+                    ok INTEGER NOT NULL,
+                    window_start INTEGER,
+                    window_end INTEGER
+                );
+            """)
+            
+            # Maior duração armazenada, usada para limitar a busca pelo início
+            row = self._conn.execute("SELECT MAX(end_ts - start_ts) FROM events").fetchone()
+            self._max_duration = row[0] or 0
+    
+    def _row(self, source: str, event: Dict[str, Any]) -> tuple:
+        """
+        Monta a linha de um evento.
+        O recurso vem do campo resource do evento (o resource_id do agendamento);
+        eventos sem recurso ocupam a clínica inteira (DEFAULT_RESOURCE).
+        
+        Args:
+            source: Fonte do evento.
+            event: Evento no formato interno.
+            
+        Returns:
+            Tupla com os valores da tabela events.
+        """
+        start_ts = _to_timestamp(event["start"])
+        end_ts = _to_timestamp(event["end"])
+        self._max_duration = max(self._max_duration, end_ts - start_ts)
+        resource = event.get("resource") or DEFAULT_RESOURCE
+        return (source, str(event["id"]), resource, start_ts, end_ts, json.dumps(event, ensure_ascii=False))
+    
+    def upsert(self, source: str, event: Dict[str, Any]):
+        """
+        Insere ou atualiza um evento.
+        
+        Args:
+            source: Fonte do evento (google, outlook, ical, database).
+            event: Evento no formato interno, com resource opcional.
+        """
+        row = self._row(source, event)
+        
+        with self._lock, self._conn:
+            old = self._conn.execute(
+                "SELECT start_ts, end_ts, payload FROM events WHERE source = ? AND event_id = ?",
+                (source, row[1])
+            ).fetchone()
+            
+            # Evento sem alterações: nada a gravar
+            if old is not None and old["payload"] == row[5]:
+                return
+            
+            self._conn.execute("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)", row)
+            if old is not None:
+                self._mark_changed(old["start_ts"], old["end_ts"])
+            self._mark_changed(row[3], row[4])
+    
+    def delete(self, source: str, event_id: str):
+        """
+        Remove um evento, se existir.
+        
+        Args:
+            source: Fonte do evento.
+            event_id: ID do evento na fonte.
+        """
+        with self._lock, self._conn:
+            old = self._conn.execute(
+                "SELECT start_ts, end_ts FROM events WHERE source = ? AND event_id = ?",
+                (source, str(event_id))
+            ).fetchone()
+            
+            if old is not None:
+                self._conn.execute("DELETE FROM events WHERE source = ? AND event_id = ?", (source, str(event_id)))
+                self._mark_changed(old["start_ts"], old["end_ts"])
+    
+    def clear(self, source: str):
+        """
+        Remove todos os eventos de uma fonte.
+        
+        Args:
+            source: Fonte dos eventos.
+        """
+        with self._lock, self._conn:
+            for old in self._conn.execute("SELECT start_ts, end_ts FROM events WHERE source = ?", (source,)).fetchall():
+                self._mark_changed(old["start_ts"], old["end_ts"])
+            self._conn.execute("DELETE FROM events WHERE source = ?", (source,))
+    
+    def replace(self, source: str, events: List[Dict[str, Any]], window_start: datetime, window_end: datetime):
+        """
+        Substitui, em uma transação, os eventos de uma fonte dentro de uma janela.
+        
+        Args:
+            source: Fonte dos eventos.
+            events: Eventos atuais da fonte na janela.
+            window_start: Início da janela (com timezone).
+            window_end: Fim da janela (com timezone).
+        """
+        window_start_ts = int(window_start.timestamp())
+        window_end_ts = int(window_end.timestamp())
+        
+        with self._lock, self._conn:
+            rows = [self._row(source, event) for event in events]
+            
+            # Comparar com os eventos atuais para marcar só as datas alteradas
+            old_rows = {
+                old["event_id"]: old
+                for old in self._conn.execute("SELECT event_id, start_ts, end_ts, payload FROM events WHERE source = ?", (source,))
+            }
+            new_payloads = {row[1]: row[5] for row in rows}
+            
+            for event_id, old in old_rows.items():
+                in_window = old["start_ts"] < window_end_ts and old["end_ts"] >= window_start_ts
+                if (in_window or event_id in new_payloads) and new_payloads.get(event_id) != old["payload"]:
+                    self._mark_changed(old["start_ts"], old["end_ts"])
+            
+            for row in rows:
+                old = old_rows.get(row[1])
+                if old is None or old["payload"] != row[5]:
+                    self._mark_changed(row[3], row[4])
+            
+            self._conn.execute(
+                "DELETE FROM events WHERE source = ? AND start_ts < ? AND end_ts >= ?",
+                (source, window_end_ts, window_start_ts)
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)", rows)
+    
+    def _mark_changed(self, start_ts: int, end_ts: int):
+        """
+        Registra as datas da clínica de um evento alterado. Chamado com o lock adquirido.
+        
+        Args:
+            start_ts: Início em segundos desde a época.
+            end_ts: Fim em segundos desde a época.
+        """
+        self._changed_dates.update(_clinic_dates(start_ts, end_ts))
+    
+    def pop_changed_dates(self) -> Set[str]:
+        """
+        Obtém e esquece as datas da clínica cujos eventos mudaram desde a última chamada.
+        
+        Returns:
+            Conjunto de datas no formato YYYY-MM-DD.
+        """
+        with self._lock:
+            changed_dates = self._changed_dates
+            self._changed_dates = set()
+        
+        return changed_dates
+    
+    def query(self, start_dt: datetime, end_dt: datetime, resource: Optional[str] = None, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Obtém os eventos que se sobrepõem a uma janela.
+        
+        Args:
+            start_dt: Início da janela (com timezone).
+            end_dt: Fim da janela (com timezone).
+            resource: Recurso consultado (opcional, padrão: todos).
+            source: Fonte dos eventos (opcional, padrão: todas).
+            
+        Returns:
+            Lista de eventos no formato interno, ordenada pelo início.
+        """
+        start_ts = int(start_dt.timestamp())
+        end_ts = int(end_dt.timestamp())
+        
+        # O limite inferior do início mantém a busca restrita ao índice
+        sql = "SELECT payload FROM events WHERE start_ts >= ? AND start_ts < ? AND end_ts >= ?"
+        params = [start_ts - self._max_duration, end_ts, start_ts]
+        
+        if resource is not None:
+            sql += " AND resource = ?"
+            params.append(resource)
+        
+        if source is not None:
+            sql += " AND source = ?"
+            params.append(source)
+        
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY start_ts", params).fetchall()
+        
+        return [json.loads(row["payload"]) for row in rows]
+    
+    def mark_synced(self, source: str, ok: bool, window_start: Optional[datetime] = None, window_end: Optional[datetime] = None):
+        """
+        Registra o resultado da última sincronização de uma fonte.
+        Em caso de falha, a janela sincronizada anteriormente é mantida.
+        
+        Args:
+            source: Fonte sincronizada.
+            ok: True se a sincronização foi bem-sucedida.
+            window_start: Início da janela sincronizada (opcional).
+            window_end: Fim da janela sincronizada (opcional).
+        """
+        window = (
+            int(window_start.timestamp()) if window_start else None,
+            int(window_end.timestamp()) if window_end else None
+        )
+        
+        with self._lock, self._conn:
+            if ok:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sync_state VALUES (?, ?, 1, ?, ?)",
+                    (source, time.time(), *window)
+                )
+            else:
+                self._conn.execute(
+                    "INSERT INTO sync_state VALUES (?, ?, 0, NULL, NULL) ON CONFLICT(source) DO UPDATE SET ok = 0",
+                    (source, time.time())
+                )
+    
+    def get_sync_state(self, source: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtém o estado da última sincronização de uma fonte.
+        
+        Args:
+            source: Fonte sincronizada.
+            
+        Returns:
+            Dicionário com synced_at, ok, window_start e window_end, ou None.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM sync_state WHERE source = ?", (source,)).fetchone()
+        
+        return dict(row) if row else None
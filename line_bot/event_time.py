@@ -0,0 +1,172 @@
+import os
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Tuple, Union
+
+import pytz
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Timezone da clínica: todos os horários de eventos são normalizados para ele
+CLINIC_TIMEZONE = os.getenv("CLINIC_TIMEZONE", "Asia/Tokyo")
+CLINIC_TZ = pytz.timezone(CLINIC_TIMEZONE)
+
+_EPOCH = datetime(1970, 1, 1)
+_MINUTE = timedelta(minutes=1)
+
+def _parse_iso(value: str) -> datetime:
+    # O Graph envia sete casas decimais nos segundos
+    if "." in value:
+        head, _, tail = value.partition(".")
+        digits = len(tail) - len(tail.lstrip("0123456789"))
+        value = f"{head}.{tail[:min(digits, 6)]}{tail[digits:]}"
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def parse_datetime(value: Union[str, datetime, date]) -> datetime:
+    """
+    Converte um horário para datetime com o timezone da clínica.
+    Horários sem timezone e datas sem horário são tratados como horário da clínica.
+    
+    Args:
+        value: Horário ISO (com Z, offset, sem timezone ou só a data), datetime ou date.
+        
+    Returns:
+        Datetime com timezone, no timezone da clínica.
+    """
+    if isinstance(value, str):
+        value = _parse_iso(value)
+    elif not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    
+    if value.tzinfo is None:
+        return CLINIC_TZ.localize(value)
+    return value.astimezone(CLINIC_TZ)
+
+def to_clinic_minutes(value: Union[str, datetime, date]) -> int:
+    """
+    Converte um horário em minutos desde 1970-01-01 00:00 no horário da clínica.
+    Com esses inteiros, dia e minuto do dia saem de uma divisão por 1440.
+    
+    Args:
+        value: Horário ISO, datetime (sem timezone = horário da clínica) ou date.
+        
+    Returns:
+        Minutos desde a época, no horário da clínica.
+    """
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return (value - _EPOCH) // _MINUTE
+    if not isinstance(value, (str, datetime)):
+        return (value - _EPOCH.date()).days * 1440
+    return (parse_datetime(value).replace(tzinfo=None) - _EPOCH) // _MINUTE
+
+def from_clinic_minutes(minutes: int) -> datetime:
+    """
+    Converte minutos desde a época no horário da clínica em datetime sem timezone.
+    
+    Args:
+        minutes: Minutos desde a época, no horário da clínica.
+        
+    Returns:
+        Datetime no horário da clínica, sem timezone.
+    """
+    return _EPOCH + timedelta(minutes=minutes)
+
+def clinic_isoformat(value: datetime) -> str:
+    """
+    Formata um horário da clínica em ISO com o offset do timezone da clínica.
+    
+    Args:
+        value: Datetime sem timezone (horário da clínica) ou com timezone.
+        
+    Returns:
+        Horário ISO com offset, por exemplo 2025-05-01T10:00:00+09:00.
+    """
+    return parse_datetime(value).isoformat()
+
+def utc_isoformat(value: datetime) -> str:
+    """
+    Formata um horário da clínica em ISO UTC com sufixo Z, como pedem as APIs de calendário.
+    
+    Args:
+        value: Datetime sem timezone (horário da clínica) ou com timezone.
+        
+    Returns:
+        Horário ISO em UTC, por exemplo 2025-05-01T01:00:00Z.
+    """
+    return parse_datetime(value).astimezone(timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+def zoned_isoformat(value: str, zone: str) -> str:
+    """
+    Formata um horário sem offset acompanhado do nome do seu timezone em ISO com offset.
+    
+    Args:
+        value: Horário ISO sem offset.
+        zone: Nome IANA do timezone ou UTC. Nomes desconhecidos (por exemplo,
+            nomes do Windows) são tratados como o timezone da clínica.
+            
+    Returns:
+        Horário ISO com offset.
+    """
+    naive = _parse_iso(value).replace(tzinfo=None)
+    
+    if zone.upper() == "UTC":
+        return naive.replace(tzinfo=timezone.utc).isoformat()
+    
+    try:
+        return pytz.timezone(zone).localize(naive).isoformat()
+    except pytz.UnknownTimeZoneError:
+        logger.warning(f"Timezone desconhecido '{zone}', usando {CLINIC_TIMEZONE}")
+        return CLINIC_TZ.localize(naive).isoformat()
+
+def clinic_now() -> datetime:
+    """
+    Obtém o horário atual da clínica, sem timezone, independente do timezone do servidor.
+    
+    Returns:
+        Datetime no horário da clínica, sem timezone.
+    """
+    return datetime.now(CLINIC_TZ).replace(tzinfo=None)
+
+def clinic_midnight(day: date) -> datetime:
+    """
+    Obtém a meia-noite de uma data no timezone da clínica.
+    
+    Args:
+        day: Data.
+        
+    Returns:
+        Datetime com timezone.
+    """
+    return CLINIC_TZ.localize(datetime.combine(day, datetime.min.time()))
+
+def normalize_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normaliza um evento na saída do provedor: start_min e end_min recebem o
+    início e o fim em minutos no horário da clínica, calculados uma única vez.
+    
+    Args:
+        event: Evento no formato interno, com start e end.
+        
+    Returns:
+        O próprio evento, com start_min e end_min.
+    """
+    event["start_min"] = to_clinic_minutes(event["start"])
+    event["end_min"] = to_clinic_minutes(event["end"])
+    return event
+
+def event_minutes(event: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Obtém início e fim de um evento em minutos no horário da clínica.
+    Eventos ainda não normalizados são convertidos na hora.
+    
+    Args:
+        event: Evento no formato interno.
+        
+    Returns:
+        Tupla (start_min, end_min).
+    """
+    if "start_min" not in event:
+        normalize_event(event)
+    return event["start_min"], event["end_min"]
@@ -0,0 +1,634 @@
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import date, datetime, timedelta, timezone
+
+import requests
+
+from event_time import parse_datetime
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+class ICalFeedCache:
+    """
+    Cache do calendário iCal publicado por URL.
+    Mantém o calendário já interpretado, revalida o feed com requisições
+    condicionais (ETag/Last-Modified) e atualiza em segundo plano quando expira.
+    """
+    
+    def __init__(self, url: str, ttl_seconds: int = 300, session: Optional[requests.Session] = None, timeout: float = 10, streaming_threshold: int = 1024 * 1024, past_days: int = 30, future_days: int = 180):
+        """
+        Inicializa o cache do feed iCal.
+        
+        Args:
+            url: URL do calendário iCal.
+            ttl_seconds: Tempo em segundos até revalidar o feed (padrão: 300).
+            session: Sessão HTTP a ser usada (opcional).
+            timeout: Tempo limite de cada download em segundos (padrão: 10).
+            streaming_threshold: Tamanho em bytes a partir do qual o feed é lido
+                em blocos, guardando só os eventos da janela (padrão: 1 MB).
+            past_days: Dias anteriores a hoje mantidos no modo em blocos (padrão: 30).
+            future_days: Dias posteriores a hoje mantidos no modo em blocos (padrão: 180).
+        """
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.streaming_threshold = streaming_threshold
+        self.past_days = past_days
+        self.future_days = future_days
+        
+        # Estado do feed
+        self.calendar = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.fetched_at: Optional[float] = None
+        
+        # Janela (início, fim) guardada no modo em blocos; None se o feed está completo
+        self.window: Optional[Tuple[datetime, datetime]] = None
+        
+        # Incrementada sempre que o conteúdo do feed muda
+        self.version = 0
+        
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+    
+    def _download_window(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+        """
+        Calcula a janela a guardar no modo em blocos: [hoje - past_days,
+        hoje + future_days], ampliada para incluir o intervalo pedido.
+        
+        Args:
+            start: Início do intervalo pedido (opcional, com timezone).
+            end: Fim do intervalo pedido (opcional, com timezone).
+            
+        Returns:
+            Tupla (início, fim) com timezone.
+        """
+        midnight = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        window_start = midnight - timedelta(days=self.past_days)
+        window_end = midnight + timedelta(days=self.future_days)
+        
+        if start is not None:
+            window_start = min(window_start, start)
+        if end is not None:
+            window_end = max(window_end, end)
+        
+        return window_start, window_end
+    
+    def covers(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> bool:
+        """
+        Verifica se o calendário guardado contém todos os eventos de um intervalo.
+        
+        Args:
+            start: Início do intervalo (opcional, com timezone).
+            end: Fim do intervalo (opcional, com timezone).
+            
+        Returns:
+            True se o feed está completo ou se a janela guardada cobre o intervalo
+            pedido e a janela padrão de hoje.
+        """
+        if self.window is None:
+            return True
+        
+        window_start, window_end = self._download_window(start, end)
+        return self.window[0] <= window_start and window_end <= self.window[1]
+    
+    def refresh(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> bool:
+        """
+        Revalida o feed com uma requisição condicional.
+        Se o calendário guardado foi filtrado por uma janela que não cobre o
+        intervalo pedido, baixa o feed inteiro de novo, ignorando ETag e
+        Last-Modified.
+        
+        Args:
+            start: Início do intervalo que o calendário precisa cobrir (opcional).
+            end: Fim do intervalo que o calendário precisa cobrir (opcional).
+            
+        Returns:
+            True se o conteúdo mudou e foi interpretado novamente, False se não mudou.
+        """
+        import icalendar
+        
+        window = self._download_window(start, end)
+        
+        headers = {}
+        if self.covers(start, end):
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        
+        response = self.session.get(self.url, headers=headers, timeout=self.timeout, stream=True)
+        
+        try:
+            # Conteúdo inalterado: manter o calendário já interpretado
+            if response.status_code == 304 and self.calendar is not None:
+                with self._lock:
+                    self.fetched_at = time.monotonic()
+                return False
+            
+            response.raise_for_status()
+            
+            # Feeds grandes (ou de tamanho desconhecido) são lidos em blocos
+            content_length = response.headers.get("Content-Length")
+            if content_length is None or int(content_length) > self.streaming_threshold:
+                calendar = self._parse_streaming(response, *window)
+            else:
+                calendar = icalendar.Calendar.from_ical(response.content)
+                window = None
+        finally:
+            response.close()
+        
+        with self._lock:
+            self.calendar = calendar
+            self.window = window
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            self.fetched_at = time.monotonic()
+            self.version += 1
+        
+        logger.info(f"Feed iCal atualizado (versão {self.version}).")
+        return True
+    
+    def _parse_streaming(self, response, window_start: datetime, window_end: datetime):
+        """
+        Interpreta o feed em blocos, mantendo apenas os eventos da janela
+        e as séries recorrentes.
+        
+        Args:
+            response: Resposta HTTP aberta com stream=True.
+            window_start: Início da janela (com timezone).
+            window_end: Fim da janela (com timezone).
+            
+        Returns:
+            Instância de icalendar.Calendar com os eventos selecionados.
+        """
+        import icalendar
+        
+        calendar = icalendar.Calendar()
+        for event in iter_vevents(response.iter_content(chunk_size=64 * 1024), window_start, window_end):
+            calendar.add_component(event)
+        
+        return calendar
+    
+    def get_calendar(self, start: Optional[datetime] = None, end: Optional[datetime] = None):
+        """
+        Obtém o calendário interpretado.
+        Apenas a primeira carga, ou um intervalo fora da janela guardada, aguarda
+        o download; depois disso, feeds expirados são revalidados em segundo
+        plano e a versão atual é devolvida na hora.
+        
+        Args:
+            start: Início do intervalo que o calendário precisa cobrir (opcional).
+            end: Fim do intervalo que o calendário precisa cobrir (opcional).
+            
+        Returns:
+            Instância de icalendar.Calendar.
+        """
+        if self.calendar is None or not self.covers(start, end):
+            self.refresh(start, end)
+        elif self.is_expired():
+            self.refresh_in_background()
+        
+        return self.calendar
+    
+    def is_expired(self) -> bool:
+        """
+        Verifica se o feed precisa ser revalidado.
+        
+        Returns:
+            True se o TTL expirou, False caso contrário.
+        """
+        return self.fetched_at is None or time.monotonic() - self.fetched_at >= self.ttl_seconds
+    
+    def refresh_in_background(self):
+        """
+        Dispara a revalidação do feed em uma thread, se ainda não houver uma em andamento.
+        """
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            
+            self._refresh_thread = threading.Thread(target=self._background_refresh, name="ical-feed-refresh", daemon=True)
+            self._refresh_thread.start()
+    
+    def _background_refresh(self):
+        """
+        Executa a revalidação em segundo plano, registrando erros sem propagá-los.
+        """
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Erro ao atualizar feed iCal em segundo plano: {str(e)}")
+            
+            # Continuar servindo a versão atual e tentar de novo após o TTL
+            with self._lock:
+                self.fetched_at = time.monotonic()
+
+def _to_datetime(value) -> datetime:
+    """
+    Normaliza um valor DTSTART/DTEND/EXDATE para datetime com timezone.
+    Datas sem horário passam a começar à meia-noite; horários sem timezone
+    (floating time) são tratados como horário da clínica.
+    
+    Args:
+        value: date ou datetime vindo do icalendar.
+        
+    Returns:
+        Datetime com timezone.
+    """
+    return parse_datetime(value)
+
+def _event_bounds(component) -> Tuple[datetime, datetime]:
+    """
+    Obtém início e fim de um VEVENT, usando DURATION quando não há DTEND.
+    
+    Args:
+        component: Componente VEVENT.
+        
+    Returns:
+        Tupla (início, fim) com timezone.
+    """
+    event_start = _to_datetime(component.get("dtstart").dt)
+    
+    if component.get("dtend") is not None:
+        event_end = _to_datetime(component.get("dtend").dt)
+    elif component.get("duration") is not None:
+        event_end = event_start + component.get("duration").dt
+    else:
+        event_end = event_start
+    
+    return event_start, event_end
+
+def _property_datetimes(component, name: str) -> List[datetime]:
+    """
+    Obtém todos os valores de uma propriedade de datas (EXDATE, RDATE).
+    
+    Args:
+        component: Componente VEVENT.
+        name: Nome da propriedade.
+        
+    Returns:
+        Lista de datetimes com timezone.
+    """
+    values = component.get(name)
+    if values is None:
+        return []
+    
+    if not isinstance(values, list):
+        values = [values]
+    
+    return [_to_datetime(item.dt) for value in values for item in value.dts]
+
+def _rrule_until(value) -> datetime:
+    """
+    Normaliza o UNTIL de uma RRULE para datetime com timezone.
+    UNTIL só com a data (eventos de dia inteiro) vale até o fim desse dia e
+    horários sem timezone são tratados como horário da clínica, como DTSTART.
+    
+    Args:
+        value: date ou datetime vindo do icalendar.
+        
+    Returns:
+        Datetime com timezone.
+    """
+    if not isinstance(value, datetime):
+        return _to_datetime(value + timedelta(days=1)) - timedelta(seconds=1)
+    
+    return _to_datetime(value)
+
+def _build_rrule(component, event_start: datetime):
+    """
+    Monta a regra de recorrência de um VEVENT.
+    O UNTIL é aplicado depois de normalizado, pois o dateutil exige que ele
+    tenha timezone sempre que DTSTART tiver.
+    
+    Args:
+        component: Componente VEVENT com RRULE.
+        event_start: Início do evento (com timezone).
+        
+    Returns:
+        Instância de dateutil.rrule.rrule.
+    """
+    import icalendar
+    from dateutil import rrule
+    
+    recur = component.get("rrule")
+    untils = recur.get("UNTIL")
+    
+    rule_str = icalendar.vRecur({key: value for key, value in recur.items() if key != "UNTIL"}).to_ical().decode("utf-8")
+    rule = rrule.rrulestr(rule_str, dtstart=event_start)
+    
+    if untils:
+        rule = rule.replace(until=_rrule_until(untils[0]))
+    
+    return rule
+
+def expand_ical_events(calendar, window_start: datetime, window_end: datetime) -> List[Tuple[datetime, datetime, str, str]]:
+    """
+    Expande os eventos de um calendário dentro de uma janela de tempo.
+    Eventos recorrentes respeitam RRULE, RDATE, EXDATE e instâncias
+    substituídas por RECURRENCE-ID.
+    
+    Args:
+        calendar: Instância de icalendar.Calendar.
+        window_start: Início da janela (com timezone).
+        window_end: Fim da janela (com timezone).
+        
+    Returns:
+        Lista de tuplas (início, fim, id, título).
+    """
+    from dateutil import rrule
+    
+    components = [component for component in calendar.walk() if component.name == "VEVENT"]
+    
+    # Instâncias substituídas são removidas da série original
+    overridden: Dict[str, List[datetime]] = {}
+    for component in components:
+        if component.get("recurrence-id") is not None:
+            uid = str(component.get("uid"))
+            overridden.setdefault(uid, []).append(_to_datetime(component.get("recurrence-id").dt))
+    
+    occurrences = []
+    
+    for component in components:
+        uid = str(component.get("uid"))
+        title = str(component.get("summary"))
+        
+        try:
+            event_start, event_end = _event_bounds(component)
+            duration = event_end - event_start
+            
+            if "rrule" not in component:
+                if event_end >= window_start and event_start <= window_end:
+                    occurrences.append((event_start, event_end, uid, title))
+                continue
+            
+            # Montar a série com regras, datas extras e exceções
+            ruleset = rrule.rruleset()
+            ruleset.rrule(_build_rrule(component, event_start))
+            
+            for rdate in _property_datetimes(component, "rdate"):
+                ruleset.rdate(rdate)
+            for exdate in _property_datetimes(component, "exdate") + overridden.get(uid, []):
+                ruleset.exdate(exdate)
+            
+            for occurrence in ruleset.between(window_start - duration, window_end, inc=True):
+                occurrences.append((occurrence, occurrence + duration, f"{uid}-{occurrence.isoformat()}", title))
+        except Exception as e:
+            logger.warning(f"Evento iCal ignorado ({uid}): {str(e)}")
+    
+    return occurrences
+
+def _raw_date(line: str) -> Optional[date]:
+    """
+    Extrai a data (YYYYMMDD) de uma linha DTSTART/DTEND sem interpretar o evento.
+    
+    Args:
+        line: Linha desdobrada do iCal.
+        
+    Returns:
+        Data da linha ou None se não for possível extraí-la.
+    """
+    try:
+        return datetime.strptime(line.rsplit(":", 1)[1][:8], "%Y%m%d").date()
+    except (IndexError, ValueError):
+        return None
+
+def _may_overlap(lines: List[str], window_start: datetime, window_end: datetime) -> bool:
+    """
+    Pré-filtro barato de um bloco VEVENT a partir das linhas DTSTART/DTEND/DURATION.
+    Eventos recorrentes ou com datas não reconhecidas sempre passam.
+    
+    Args:
+        lines: Linhas desdobradas do bloco VEVENT.
+        window_start: Início da janela (com timezone).
+        window_end: Fim da janela (com timezone).
+        
+    Returns:
+        False somente se o evento certamente está fora da janela.
+    """
+    import icalendar
+    
+    start_day = end_day = None
+    duration = None
+    
+    for line in lines:
+        name = line.split(":", 1)[0].split(";", 1)[0].upper()
+        if name in ("RRULE", "RDATE", "RECURRENCE-ID"):
+            return True
+        if name == "DTSTART":
+            start_day = _raw_date(line)
+        elif name == "DTEND":
+            end_day = _raw_date(line)
+        elif name == "DURATION":
+            try:
+                duration = icalendar.vDuration.from_ical(line.rsplit(":", 1)[1])
+            except (IndexError, ValueError):
+                return True
+    
+    if start_day is None:
+        return True
+    
+    # Sem DTEND, o fim vem de DURATION, arredondado para o dia seguinte
+    if end_day is None and duration is not None:
+        end_day = start_day + timedelta(days=duration.days + 1)
+    
+    # Um dia de folga cobre diferenças de timezone
+    slack = timedelta(days=1)
+    return (end_day or start_day) + slack >= window_start.date() and start_day - slack <= window_end.date()
+
+def iter_vevents(chunks: Iterable[bytes], window_start: datetime, window_end: datetime) -> Iterator[Any]:
+    """
+    Lê um feed iCal em blocos e produz somente os VEVENTs que podem se
+    sobrepor à janela, mantendo em memória apenas um evento por vez.
+    Eventos recorrentes são sempre produzidos, pois podem ter ocorrências na janela.
+    
+    Args:
+        chunks: Blocos de bytes do feed (por exemplo, response.iter_content()).
+        window_start: Início da janela (com timezone).
+        window_end: Fim da janela (com timezone).
+        
+    Returns:
+        Iterador de componentes icalendar.Event.
+    """
+    import icalendar
+    
+    def unfolded_lines():
+        # Junta linhas dobradas (RFC 5545, seção 3.1) que podem cruzar blocos
+        buffer = b""
+        previous = None
+        for chunk in chunks:
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for raw_line in complete:
+                raw_line = raw_line.rstrip(b"\r")
+                if raw_line[:1] in (b" ", b"\t") and previous is not None:
+                    previous += raw_line[1:]
+                    continue
+                if previous is not None:
+                    yield previous.decode("utf-8", errors="replace")
+                previous = raw_line
+        
+        raw_line = buffer.rstrip(b"\r")
+        if raw_line[:1] in (b" ", b"\t") and previous is not None:
+            previous += raw_line[1:]
+        elif raw_line:
+            if previous is not None:
+                yield previous.decode("utf-8", errors="replace")
+            previous = raw_line
+        
+        if previous is not None:
+            yield previous.decode("utf-8", errors="replace")
+    
+    event_lines: Optional[List[str]] = None
+    
+    for line in unfolded_lines():
+        if line == "BEGIN:VEVENT":
+            event_lines = [line]
+        elif event_lines is not None:
+            event_lines.append(line)
+            if line == "END:VEVENT":
+                if _may_overlap(event_lines, window_start, window_end):
+                    try:
+                        event = icalendar.Event.from_ical("\r\n".join(event_lines) + "\r\n")
+                    except Exception as e:
+                        logger.warning(f"Bloco VEVENT inválido ignorado: {str(e)}")
+                    else:
+                        if _component_may_overlap(event, window_start, window_end):
+                            yield event
+                event_lines = None
+
+def _component_may_overlap(component, window_start: datetime, window_end: datetime) -> bool:
+    """
+    Verifica, com as datas já interpretadas, se um VEVENT pode tocar a janela.
+    
+    Args:
+        component: Componente VEVENT.
+        window_start: Início da janela (com timezone).
+        window_end: Fim da janela (com timezone).
+        
+    Returns:
+        True se o evento for recorrente ou se sobrepuser à janela.
+    """
+    if "rrule" in component or "rdate" in component or component.get("recurrence-id") is not None:
+        return True
+    
+    if component.get("dtstart") is None:
+        return False
+    
+    event_start, event_end = _event_bounds(component)
+    return event_end >= window_start and event_start <= window_end
+
+class ICalEventIndex:
+    """
+    Índice de ocorrências de eventos iCal.
+    Expande os eventos (inclusive recorrentes) uma vez por versão do feed,
+    dentro de um horizonte móvel, e atende consultas por busca binária.
+    """
+    
+    def __init__(self, past_days: int = 30, future_days: int = 180):
+        """
+        Inicializa o índice de eventos.
+        
+        Args:
+            past_days: Dias anteriores a hoje mantidos no índice (padrão: 30).
+            future_days: Dias posteriores a hoje mantidos no índice (padrão: 180).
+        """
+        self.past_days = past_days
+        self.future_days = future_days
+        
+        # Versão do feed e horizonte usados na última expansão
+        self.version: Optional[int] = None
+        self.horizon_start: Optional[datetime] = None
+        self.horizon_end: Optional[datetime] = None
+        
+        # Ocorrências ordenadas por início
+        self._occurrences: List[Tuple[datetime, datetime, str, str]] = []
+        self._starts: List[datetime] = []
+        self._max_duration = timedelta(0)
+        
+        self._calendar = None
+        self._lock = threading.Lock()
+    
+    def ensure(self, calendar, version: int):
+        """
+        Reconstrói o índice se o feed mudou ou se o horizonte precisa avançar.
+        
+        Args:
+            calendar: Instância de icalendar.Calendar.
+            version: Versão do feed (ICalFeedCache.version).
+        """
+        now = datetime.now(timezone.utc)
+        
+        if version == self.version and self.horizon_start is not None and now - timedelta(days=self.past_days - 1) <= self.horizon_start:
+            return
+        
+        self.build(calendar, version, now)
+    
+    def build(self, calendar, version: int, now: Optional[datetime] = None):
+        """
+        Expande o calendário no horizonte e substitui o índice atual.
+        
+        Args:
+            calendar: Instância de icalendar.Calendar.
+            version: Versão do feed.
+            now: Instante de referência (padrão: agora).
+        """
+        now = now or datetime.now(timezone.utc)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        horizon_start = midnight - timedelta(days=self.past_days)
+        horizon_end = midnight + timedelta(days=self.future_days)
+        
+        occurrences = expand_ical_events(calendar, horizon_start, horizon_end)
+        occurrences.sort(key=lambda occurrence: occurrence[0])
+        
+        starts = [occurrence[0] for occurrence in occurrences]
+        
+        max_duration = max((end - start for start, end, _, _ in occurrences), default=timedelta(0))
+        
+        with self._lock:
+            self._occurrences = occurrences
+            self._starts = starts
+            self._max_duration = max_duration
+            self._calendar = calendar
+            self.version = version
+            self.horizon_start = horizon_start
+            self.horizon_end = horizon_end
+        
+        logger.info(f"Índice iCal reconstruído: {len(occurrences)} ocorrências (versão {version}).")
+    
+    def query(self, start_dt: datetime, end_dt: datetime) -> List[Tuple[datetime, datetime, str, str]]:
+        """
+        Obtém as ocorrências que se sobrepõem a uma janela de tempo.
+        Janelas fora do horizonte são expandidas sob demanda, sem cache.
+        
+        Args:
+            start_dt: Início da janela (com timezone).
+            end_dt: Fim da janela (com timezone).
+            
+        Returns:
+            Lista de tuplas (início, fim, id, título).
+        """
+        with self._lock:
+            occurrences = self._occurrences
+            starts = self._starts
+            max_duration = self._max_duration
+            calendar = self._calendar
+            inside_horizon = self.horizon_start is not None and self.horizon_start <= start_dt and end_dt <= self.horizon_end
+        
+        if not inside_horizon:
+            if calendar is None:
+                return []
+            return expand_ical_events(calendar, start_dt, end_dt)
+        
+        # Somente eventos que começam até max_duration antes da janela podem alcançá-la
+        lo = bisect_left(starts, start_dt - max_duration)
+        hi = bisect_right(starts, end_dt)
+        
+        return [occurrence for occurrence in occurrences[lo:hi] if occurrence[1] >= start_dt]
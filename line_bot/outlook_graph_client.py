@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+class OutlookGraphClient:
+    """
+    Cliente do Microsoft Graph com token de acesso em cache e sessão HTTP
+    compartilhada (keep-alive) para todas as chamadas de calendário.
+    """
+    
+    def __init__(self, app, scopes: List[str], base_url: str = "https://graph.microsoft.com/v1.0", refresh_margin: int = 300, pool_size: int = 8, timeout: float = 10):
+        """
+        Inicializa o cliente.
+        
+        Args:
+            app: Aplicativo MSAL (ConfidentialClientApplication).
+            scopes: Escopos solicitados no token.
+            base_url: URL base do Microsoft Graph.
+            refresh_margin: Antecedência, em segundos, com que o token é renovado
+                em segundo plano antes de expirar (padrão: 300).
+            pool_size: Número máximo de conexões mantidas abertas (padrão: 8).
+            timeout: Tempo limite de cada requisição em segundos (padrão: 10).
+        """
+        self.app = app
+        self.scopes = scopes
+        self.base_url = base_url
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        
+        # Token atual e instante (time.monotonic) em que expira
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self._refreshing = False
+        
+        # Sessão com pool de conexões reaproveitadas entre as chamadas
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+    
+    def get_token(self) -> str:
+        """
+        Obtém um token de acesso válido.
+        Dentro da margem de renovação o token atual é devolvido e a renovação
+        acontece em segundo plano; só bloqueia quando não há token válido.
+        
+        Returns:
+            Token de acesso.
+        """
+        now = time.monotonic()
+        token = self._token
+        
+        if token and now < self._expires_at - self.refresh_margin:
+            return token
+        
+        if token and now < self._expires_at:
+            self._refresh_in_background()
+            return token
+        
+        with self._token_lock:
+            # Outra thread pode ter renovado enquanto esperávamos
+            if self._token and time.monotonic() < self._expires_at:
+                return self._token
+            return self._acquire()
+    
+    def invalidate_token(self):
+        """
+        Descarta o token em cache (por exemplo, após uma resposta 401).
+        """
+        with self._token_lock:
+            self._token = None
+            self._expires_at = 0.0
+    
+    def _acquire(self) -> str:
+        """
+        Solicita um novo token ao MSAL. Deve ser chamado com _token_lock.
+        
+        Returns:
+            Token de acesso.
+        """
+        result = self.app.acquire_token_for_client(scopes=self.scopes)
+        
+        if "access_token" not in result:
+            raise Exception(f"Erro ao obter token de acesso para Microsoft Outlook: {result.get('error')}")
+        
+        self._token = result["access_token"]
+        self._expires_at = time.monotonic() + int(result.get("expires_in", 3600))
+        return self._token
+    
+    def _refresh_in_background(self):
+        """
+        Renova o token em uma thread separada, uma renovação por vez.
+        """
+        with self._token_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        
+        thread = threading.Thread(target=self._background_refresh, name="outlook-token-refresh", daemon=True)
+        thread.start()
+    
+    def _background_refresh(self):
+        try:
+            with self._token_lock:
+                self._acquire()
+        except Exception as e:
+            logger.error(f"Erro ao renovar token do Microsoft Outlook: {str(e)}")
+        finally:
+            self._refreshing = False
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Faz uma requisição autenticada ao Microsoft Graph.
+        
+        Args:
+            method: Método HTTP.
+            url: URL completa ou caminho relativo a base_url.
+            **kwargs: Argumentos repassados para requests.Session.request.
+            
+        Returns:
+            Resposta da requisição.
+        """
+        if not url.startswith("http"):
+            url = self.base_url + url
+        
+        kwargs.setdefault("timeout", self.timeout)
+        headers = kwargs.pop("headers", {})
+        
+        response = None
+        for attempt in range(2):
+            headers["Authorization"] = f"Bearer {self.get_token()}"
+            response = self.session.request(method, url, headers=headers, **kwargs)
+            
+            # Token revogado antes do prazo: renovar e tentar uma vez mais
+            if response.status_code == 401 and attempt == 0:
+                self.invalidate_token()
+                continue
+            break
+        
+        response.raise_for_status()
+        return response
+    
+    def get_json(self, url: str) -> Dict[str, Any]:
+        """
+        Faz um GET autenticado e devolve o corpo em JSON.
+        
+        Args:
+            url: URL completa ou caminho relativo a base_url.
+            
+        Returns:
+            Corpo da resposta em JSON.
+        """
+        return self.request("GET", url).json()
+    
+    def post_json(self, url: str, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        Faz um POST autenticado com corpo JSON e devolve a resposta em JSON.
+        
+        Args:
+            url: URL completa ou caminho relativo a base_url.
+            body: Corpo da requisição.
+            headers: Cabeçalhos adicionais (opcional).
+            
+        Returns:
+            Corpo da resposta em JSON.
+        """
+        return self.request("POST", url, json=body, headers=dict(headers or {})).json()
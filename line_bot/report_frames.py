@@ -0,0 +1,308 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def _to_int32(series: pd.Series) -> pd.Series:
+    """
+    Converte uma coluna de IDs para int32 quando todos os valores são inteiros.
+    
+    Args:
+        series: Coluna de IDs.
+        
+    Returns:
+        Coluna int32, ou a coluna original se houver IDs não numéricos.
+    """
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.isna().any():
+        return series
+    return numeric.astype("int32")
+
+def _to_naive_datetime(series: pd.Series) -> pd.Series:
+    """
+    Converte horários ISO, com ou sem timezone, para datetime64 sem timezone (UTC).
+    
+    Args:
+        series: Coluna de horários.
+        
+    Returns:
+        Coluna datetime64.
+    """
+    return pd.to_datetime(series, utc=True, format="ISO8601").dt.tz_localize(None)
+
+def appointment_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Monta o DataFrame tipado de agendamentos.
+    Data e hora são interpretadas uma única vez: date (datetime64 do dia),
+    start (datetime64 do início) e hour (int8); status é categórico e os IDs
+    são int32.
+    
+    Args:
+        rows: Agendamentos como retornados pelo Supabase.
+        
+    Returns:
+        DataFrame de agendamentos.
+    """
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return pd.DataFrame({
+            "id": pd.Series(dtype="int32"),
+            "patient_id": pd.Series(dtype="int32"),
+            "appointment_date": pd.Series(dtype=object),
+            "appointment_time": pd.Series(dtype=object),
+            "status": pd.Series(dtype="category"),
+            "date": pd.Series(dtype="datetime64[ns]"),
+            "start": pd.Series(dtype="datetime64[ns]"),
+            "hour": pd.Series(dtype="int8")
+        })
+    
+    df["id"] = _to_int32(df["id"])
+    df["patient_id"] = _to_int32(df["patient_id"])
+    df["status"] = df["status"].astype("category")
+    df["date"] = pd.to_datetime(df["appointment_date"], format="%Y-%m-%d")
+    df["start"] = df["date"] + pd.to_timedelta(df["appointment_time"].str.slice(0, 5) + ":00")
+    df["hour"] = df["start"].dt.hour.astype("int8")
+    
+    if "updated_at" in df.columns:
+        df["updated_at"] = _to_naive_datetime(df["updated_at"])
+    
+    return df
+
+def patient_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Monta o DataFrame tipado de pacientes, com preferred_language categórico,
+    created_at em datetime64 e IDs int32.
+    
+    Args:
+        rows: Pacientes como retornados pelo Supabase.
+        
+    Returns:
+        DataFrame de pacientes.
+    """
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return pd.DataFrame({
+            "id": pd.Series(dtype="int32"),
+            "name": pd.Series(dtype=object),
+            "preferred_language": pd.Series(dtype="category"),
+            "created_at": pd.Series(dtype="datetime64[ns]")
+        })
+    
+    df["id"] = _to_int32(df["id"])
+    if "preferred_language" in df.columns:
+        df["preferred_language"] = df["preferred_language"].astype("category")
+    
+    for column in ("created_at", "updated_at"):
+        if column in df.columns:
+            df[column] = _to_naive_datetime(df[column])
+    
+    return df
+
+def _watermark(frame: pd.DataFrame) -> Optional[str]:
+    """
+    Obtém o maior updated_at de um frame, no formato ISO em UTC.
+    
+    Args:
+        frame: Frame de agendamentos ou pacientes.
+        
+    Returns:
+        Horário ISO, ou None se o frame não tiver updated_at.
+    """
+    if "updated_at" in frame.columns and frame["updated_at"].notna().any():
+        return frame["updated_at"].max().isoformat() + "+00:00"
+    return None
+
+class ReportFrameCache:
+    """
+    Cache compartilhado dos agendamentos e pacientes usados pelos relatórios,
+    já convertidos em DataFrames tipados.
+    
+    Os agendamentos de cada clínica são carregados por período e o período
+    coberto cresce conforme os relatórios pedem datas novas. Depois de
+    refresh_interval, só as linhas alteradas desde o maior updated_at visto
+    são buscadas (get_appointments_updated_since/get_patients_updated_since
+    do gerenciador do Supabase); sem esses métodos ou sem updated_at, o
+    período coberto é recarregado. Linhas apagadas no banco não aparecem
+    na busca incremental, por isso o período coberto também é recarregado
+    por inteiro a cada full_reload_interval.
+    """
+    
+    def __init__(self, supabase_manager, refresh_interval: float = 60, full_reload_interval: float = 900):
+        """
+        Inicializa o cache.
+        
+        Args:
+            supabase_manager: Instância do gerenciador do Supabase.
+            refresh_interval: Segundos até verificar alterações no banco (padrão: 60).
+            full_reload_interval: Segundos até recarregar tudo, descartando linhas apagadas (padrão: 900).
+        """
+        self.supabase_manager = supabase_manager
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        
+        # Estado por clínica: frame, período coberto (None = todos), updated_at máximo,
+        # instante da atualização e instante da última carga completa
+        self._appointments: Dict[Any, Dict[str, Any]] = {}
+        self._patients: Dict[Any, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+    
+    def appointments(self, start_date: Optional[str] = None, end_date: Optional[str] = None, clinic_id: Optional[int] = None) -> pd.DataFrame:
+        """
+        Obtém os agendamentos de um período.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD (opcional, padrão: todos os agendamentos).
+            end_date: Data final no formato YYYY-MM-DD (opcional).
+            clinic_id: ID da clínica (opcional, para sistemas multi-clínica).
+            
+        Returns:
+            DataFrame tipado com os agendamentos do período.
+        """
+        with self._lock:
+            state = self._appointments.get(clinic_id)
+            
+            if state is not None and time.monotonic() - state["refreshed_at"] >= self.refresh_interval:
+                state = self._refresh_appointments(clinic_id, state)
+            
+            if start_date is None or end_date is None:
+                if state is None or state["start"] is not None:
+                    state = self._load_appointments(clinic_id, None, None, state)
+                df = state["frame"]
+            else:
+                if state is None or not self._covers(state, start_date, end_date):
+                    state = self._load_appointments(clinic_id, start_date, end_date, state)
+                df = state["frame"]
+                
+                # O banco já devolve só o período pedido; filtrar quando o cache cobre mais
+                if (state["start"], state["end"]) != (start_date, end_date):
+                    df = df[(df["date"] >= pd.Timestamp(start_date)) & (df["date"] <= pd.Timestamp(end_date))]
+        
+        return df.reset_index(drop=True)
+    
+    def patients(self, clinic_id: Optional[int] = None) -> pd.DataFrame:
+        """
+        Obtém todos os pacientes.
+        
+        Args:
+            clinic_id: ID da clínica (opcional, para sistemas multi-clínica).
+            
+        Returns:
+            DataFrame tipado com os pacientes.
+        """
+        with self._lock:
+            state = self._patients.get(clinic_id)
+            
+            if state is not None and time.monotonic() - state["refreshed_at"] >= self.refresh_interval:
+                fetch = getattr(self.supabase_manager, "get_patients_updated_since", None)
+                if fetch is not None and state["watermark"] is not None and not self._reload_due(state):
+                    state = self._merge(self._patients, clinic_id, state, patient_frame(fetch(state["watermark"], clinic_id) or []))
+                else:
+                    state = None
+            
+            if state is None:
+                frame = patient_frame(self.supabase_manager.get_all_patients(clinic_id) or [])
+                state = self._merge(self._patients, clinic_id, None, frame)
+            
+            return state["frame"]
+    
+    def invalidate(self, clinic_id: Optional[int] = None):
+        """
+        Descarta os dados em cache de uma clínica, ou de todas.
+        
+        Args:
+            clinic_id: ID da clínica (opcional, padrão: todas).
+        """
+        with self._lock:
+            if clinic_id is None:
+                self._appointments.clear()
+                self._patients.clear()
+            else:
+                self._appointments.pop(clinic_id, None)
+                self._patients.pop(clinic_id, None)
+    
+    def _reload_due(self, state: Dict[str, Any]) -> bool:
+        return time.monotonic() - state["loaded_at"] >= self.full_reload_interval
+    
+    def _covers(self, state: Dict[str, Any], start_date: str, end_date: str) -> bool:
+        if state["start"] is None:
+            return True
+        return state["start"] <= start_date and end_date <= state["end"]
+    
+    def _load_appointments(self, clinic_id: Any, start_date: Optional[str], end_date: Optional[str], state: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if start_date is None:
+            rows = self.supabase_manager.get_all_appointments(clinic_id)
+            return self._merge(self._appointments, clinic_id, None, appointment_frame(rows or []), None, None)
+        
+        rows = self.supabase_manager.get_appointments_by_date_range(start_date, end_date, clinic_id)
+        frame = appointment_frame(rows or [])
+        
+        # Períodos que se tocam viram um só; um período separado substitui o coberto
+        if state is not None and state["start"] is not None and start_date <= state["end"] and state["start"] <= end_date:
+            return self._merge(self._appointments, clinic_id, state, frame, min(start_date, state["start"]), max(end_date, state["end"]))
+        
+        return self._merge(self._appointments, clinic_id, None, frame, start_date, end_date)
+    
+    def _refresh_appointments(self, clinic_id: Any, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        fetch = getattr(self.supabase_manager, "get_appointments_updated_since", None)
+        
+        if fetch is None or state["watermark"] is None or self._reload_due(state):
+            # Sem alterações incrementais, ou hora de descartar linhas apagadas: recarregar o período coberto
+            del self._appointments[clinic_id]
+            if state["start"] is None:
+                return self._load_appointments(clinic_id, None, None, None)
+            return self._load_appointments(clinic_id, state["start"], state["end"], None)
+        
+        frame = appointment_frame(fetch(state["watermark"], clinic_id) or [])
+        fetched_watermark = _watermark(frame)
+        
+        # As alterações vêm de todas as datas: manter só as do período coberto e
+        # descartar do cache os agendamentos que saíram dele
+        if state["start"] is not None and not frame.empty:
+            in_range = (frame["date"] >= pd.Timestamp(state["start"])) & (frame["date"] <= pd.Timestamp(state["end"]))
+            previous = state["frame"]
+            state = {**state, "frame": previous[~previous["id"].isin(frame.loc[~in_range, "id"])].reset_index(drop=True)}
+            frame = frame[in_range].reset_index(drop=True)
+        
+        new_state = self._merge(self._appointments, clinic_id, state, frame, state["start"], state["end"])
+        
+        # Linhas fora do período também avançam o updated_at visto, para não serem buscadas de novo
+        if fetched_watermark is not None and (new_state["watermark"] is None or pd.Timestamp(new_state["watermark"]) < pd.Timestamp(fetched_watermark)):
+            new_state["watermark"] = fetched_watermark
+        
+        return new_state
+    
+    def _merge(self, states: Dict[Any, Dict[str, Any]], clinic_id: Any, state: Optional[Dict[str, Any]], frame: pd.DataFrame, start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Substitui no frame da clínica as linhas com os mesmos IDs e registra o novo estado.
+        """
+        if state is not None and not frame.empty:
+            previous = state["frame"]
+            combined = pd.concat([previous[~previous["id"].isin(frame["id"])], frame], ignore_index=True)
+            
+            # concat perde o tipo categórico quando as categorias diferem
+            for column in ("status", "preferred_language"):
+                if column in combined.columns:
+                    combined[column] = combined[column].astype("category")
+            frame = combined
+        elif state is not None:
+            frame = state["frame"]
+        
+        watermark = _watermark(frame)
+        
+        now = time.monotonic()
+        new_state = {
+            "frame": frame,
+            "start": start,
+            "end": end,
+            "watermark": watermark,
+            "refreshed_at": now,
+            "loaded_at": state["loaded_at"] if state is not None else now
+        }
+        states[clinic_id] = new_state
+        return new_state
@@ -0,0 +1,407 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+
+from event_time import parse_datetime
+from store_paths import resolve_store_path
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def _clinic_key(clinic_id: Any) -> str:
+    return "" if clinic_id is None else str(clinic_id)
+
+def _appointment_fact(appointment: Dict[str, Any], language: Optional[str] = None) -> Tuple[str, str, int, int, str]:
+    """
+    Extrai as dimensões de um agendamento.
+    
+    Args:
+        appointment: Agendamento com appointment_date, appointment_time e status.
+        language: Idioma do paciente (opcional, padrão: language do agendamento ou unknown).
+        
+    Returns:
+        Tupla (dia, status, hora, dia da semana, idioma).
+    """
+    day = appointment["appointment_date"]
+    hour = int(str(appointment.get("appointment_time") or "0")[:2])
+    weekday = datetime.strptime(day, "%Y-%m-%d").weekday()
+    return day, appointment.get("status") or "pending", hour, weekday, language or appointment.get("language") or "unknown"
+
+def _usage_fact(log: Dict[str, Any]) -> Tuple[str, str, int, int, str]:
+    """
+    Extrai as dimensões de um log de uso, com o horário convertido para o da clínica.
+    
+    Args:
+        log: Log com timestamp, interaction_type e language.
+        
+    Returns:
+        Tupla (dia, tipo de interação, hora, dia da semana, idioma).
+    """
+    timestamp = parse_datetime(log["timestamp"])
+    return timestamp.strftime("%Y-%m-%d"), log.get("interaction_type") or "unknown", timestamp.hour, timestamp.weekday(), log.get("language") or "unknown"
+
+def _days(start_date: str, end_date: str) -> List[str]:
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    return [(start + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range((end - start).days + 1)]
+
+class ReportRollupStore:
+    """
+    Contagens diárias pré-agregadas para os relatórios, em SQLite.
+    
+    Agendamentos são contados por (clínica, dia, status, hora, dia da semana,
+    idioma) e logs de uso por (clínica, dia, tipo, hora, dia da semana,
+    idioma). As contagens de agendamentos são atualizadas a cada agendamento
+    gravado; cada agendamento guarda suas dimensões para que mudanças de
+    status movam a contagem em vez de duplicá-la. Dias ainda não agregados,
+    ou agregados há mais tempo que o limite de quem consulta, são preenchidos
+    a partir das linhas brutas (replace_appointments, replace_usage); os logs
+    de uso só são contados assim.
+    """
+    
+    def __init__(self, path: str = ":memory:"):
+        """
+        Inicializa o armazenamento.
+        
+        Args:
+            path: Caminho do arquivo SQLite (padrão: banco em memória).
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS appointment_facts (
+                    clinic_id TEXT NOT NULL,
+                    appointment_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    hour INTEGER NOT NULL,
+                    weekday INTEGER NOT NULL,
+                    language TEXT NOT NULL,
+                    PRIMARY KEY (clinic_id, appointment_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_appointment_facts_day ON appointment_facts (clinic_id, day);
+                CREATE TABLE IF NOT EXISTS appointment_daily (
+                    clinic_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    hour INTEGER NOT NULL,
+                    weekday INTEGER NOT NULL,
+                    language TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (clinic_id, day, status, hour, weekday, language)
+                );
+                CREATE TABLE IF NOT EXISTS usage_daily (
+                    clinic_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    interaction_type TEXT NOT NULL,
+                    hour INTEGER NOT NULL,
+                    weekday INTEGER NOT NULL,
+                    language TEXT NOT NULL,
+                    interactions INTEGER NOT NULL,
+                    duration_sum REAL NOT NULL,
+                    duration_count INTEGER NOT NULL,
+                    PRIMARY KEY (clinic_id, day, interaction_type, hour, weekday, language)
+                );
+                CREATE TABLE IF NOT EXISTS usage_users (
+                    clinic_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    line_user_id TEXT NOT NULL,
+                    PRIMARY KEY (clinic_id, day, line_user_id)
+                );
+                CREATE TABLE IF NOT EXISTS rollup_days (
+                    kind TEXT NOT NULL,
+                    clinic_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    built_at REAL NOT NULL,
+                    PRIMARY KEY (kind, clinic_id, day)
+                );
+            """)
+    
+    def _add_appointment(self, clinic: str, fact: Tuple[str, str, int, int, str], delta: int):
+        self._conn.execute(
+            "INSERT INTO appointment_daily VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (clinic_id, day, status, hour, weekday, language) DO UPDATE SET count = count + excluded.count",
+            (clinic, *fact, delta)
+        )
+        if delta < 0:
+            self._conn.execute(
+                "DELETE FROM appointment_daily WHERE clinic_id = ? AND day = ? AND status = ? AND hour = ? AND weekday = ? AND language = ? AND count <= 0",
+                (clinic, *fact)
+            )
+    
+    def _get_fact(self, clinic: str, appointment_id: Any) -> Optional[Tuple[str, str, int, int, str]]:
+        row = self._conn.execute(
+            "SELECT day, status, hour, weekday, language FROM appointment_facts WHERE clinic_id = ? AND appointment_id = ?",
+            (clinic, str(appointment_id))
+        ).fetchone()
+        return tuple(row) if row else None
+    
+    def record_appointment(self, appointment: Dict[str, Any], clinic_id: Optional[Any] = None, language: Optional[str] = None):
+        """
+        Conta um agendamento novo ou alterado.
+        
+        Args:
+            appointment: Agendamento com id, appointment_date, appointment_time e status.
+            clinic_id: ID da clínica (opcional).
+            language: Idioma do paciente (opcional).
+        """
+        clinic = _clinic_key(clinic_id)
+        fact = _appointment_fact(appointment, language)
+        
+        with self._lock, self._conn:
+            previous = self._get_fact(clinic, appointment["id"])
+            
+            # Sem idioma informado, manter o já conhecido
+            if previous and not language and not appointment.get("language"):
+                fact = fact[:4] + previous[4:]
+            
+            if previous == fact:
+                return
+            if previous:
+                self._add_appointment(clinic, previous, -1)
+            
+            self._conn.execute(
+                "INSERT OR REPLACE INTO appointment_facts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (clinic, str(appointment["id"]), *fact)
+            )
+            self._add_appointment(clinic, fact, 1)
+    
+    def update_appointment_status(self, appointment_id: Any, status: str, clinic_id: Optional[Any] = None) -> bool:
+        """
+        Move a contagem de um agendamento para o novo status.
+        
+        Args:
+            appointment_id: ID do agendamento.
+            status: Novo status.
+            clinic_id: ID da clínica (opcional).
+            
+        Returns:
+            True se o agendamento era conhecido, False caso contrário.
+        """
+        clinic = _clinic_key(clinic_id)
+        
+        with self._lock, self._conn:
+            previous = self._get_fact(clinic, appointment_id)
+            if not previous:
+                return False
+            if previous[1] == status:
+                return True
+            
+            fact = (previous[0], status, *previous[2:])
+            self._add_appointment(clinic, previous, -1)
+            self._conn.execute(
+                "UPDATE appointment_facts SET status = ? WHERE clinic_id = ? AND appointment_id = ?",
+                (status, clinic, str(appointment_id))
+            )
+            self._add_appointment(clinic, fact, 1)
+        
+        return True
+    
+    def replace_appointments(self, clinic_id: Optional[Any], start_date: str, end_date: str, appointments: List[Dict[str, Any]], languages: Optional[Dict[Any, str]] = None):
+        """
+        Recalcula as contagens de agendamentos de um período a partir das linhas brutas.
+        
+        Args:
+            clinic_id: ID da clínica (opcional).
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD.
+            appointments: Todos os agendamentos do período.
+            languages: Idioma preferido por ID de paciente (opcional).
+        """
+        clinic = _clinic_key(clinic_id)
+        languages = languages or {}
+        now = time.time()
+        
+        facts = {}
+        for appointment in appointments:
+            if start_date <= appointment["appointment_date"] <= end_date:
+                facts[str(appointment["id"])] = _appointment_fact(appointment, languages.get(appointment.get("patient_id")))
+        
+        counts = {}
+        for fact in facts.values():
+            counts[fact] = counts.get(fact, 0) + 1
+        
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM appointment_facts WHERE clinic_id = ? AND day BETWEEN ? AND ?", (clinic, start_date, end_date))
+            self._conn.execute("DELETE FROM appointment_daily WHERE clinic_id = ? AND day BETWEEN ? AND ?", (clinic, start_date, end_date))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO appointment_facts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(clinic, appointment_id, *fact) for appointment_id, fact in facts.items()]
+            )
+            self._conn.executemany(
+                "INSERT INTO appointment_daily VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(clinic, *fact, count) for fact, count in counts.items()]
+            )
+            self._mark_built("appointments", clinic, start_date, end_date, now)
+    
+    def replace_usage(self, clinic_id: Optional[Any], start_date: str, end_date: str, logs: List[Dict[str, Any]]):
+        """
+        Recalcula as contagens de uso de um período a partir dos logs brutos.
+        
+        Args:
+            clinic_id: ID da clínica (opcional).
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD.
+            logs: Todos os logs de uso do período.
+        """
+        clinic = _clinic_key(clinic_id)
+        now = time.time()
+        
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM usage_daily WHERE clinic_id = ? AND day BETWEEN ? AND ?", (clinic, start_date, end_date))
+            self._conn.execute("DELETE FROM usage_users WHERE clinic_id = ? AND day BETWEEN ? AND ?", (clinic, start_date, end_date))
+            self._add_usage(clinic, logs, start_date, end_date)
+            self._mark_built("usage", clinic, start_date, end_date, now)
+    
+    def _add_usage(self, clinic: str, logs: List[Dict[str, Any]], start_date: Optional[str] = None, end_date: Optional[str] = None):
+        rows = {}
+        users = set()
+        
+        for log in logs:
+            fact = _usage_fact(log)
+            if start_date is not None and not start_date <= fact[0] <= end_date:
+                continue
+            
+            duration = log.get("conversation_duration")
+            interactions, duration_sum, duration_count = rows.get(fact, (0, 0.0, 0))
+            if duration is None:
+                rows[fact] = (interactions + 1, duration_sum, duration_count)
+            else:
+                rows[fact] = (interactions + 1, duration_sum + float(duration), duration_count + 1)
+            
+            if log.get("line_user_id"):
+                users.add((fact[0], str(log["line_user_id"])))
+        
+        self._conn.executemany(
+            "INSERT INTO usage_daily VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (clinic_id, day, interaction_type, hour, weekday, language) DO UPDATE SET "
+            "interactions = interactions + excluded.interactions, "
+            "duration_sum = duration_sum + excluded.duration_sum, "
+            "duration_count = duration_count + excluded.duration_count",
+            [(clinic, *fact, *values) for fact, values in rows.items()]
+        )
+        self._conn.executemany("INSERT OR IGNORE INTO usage_users VALUES (?, ?, ?)", [(clinic, *user) for user in users])
+    
+    def _mark_built(self, kind: str, clinic: str, start_date: str, end_date: str, built_at: float):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO rollup_days VALUES (?, ?, ?, ?)",
+            [(kind, clinic, day, built_at) for day in _days(start_date, end_date)]
+        )
+    
+    def missing_days(self, kind: str, clinic_id: Optional[Any], start_date: str, end_date: str, max_age: Optional[float] = None) -> List[str]:
+        """
+        Obtém os dias de um período ainda não agregados (ou agregados há mais de max_age).
+        
+        Args:
+            kind: appointments ou usage.
+            clinic_id: ID da clínica (opcional).
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD.
+            max_age: Idade máxima da agregação em segundos (opcional, padrão: sem limite).
+            
+        Returns:
+            Lista de dias no formato YYYY-MM-DD, em ordem.
+        """
+        oldest = time.time() - max_age if max_age is not None else 0
+        
+        with self._lock:
+            built = {
+                row["day"] for row in self._conn.execute(
+                    "SELECT day FROM rollup_days WHERE kind = ? AND clinic_id = ? AND day BETWEEN ? AND ? AND built_at >= ?",
+                    (kind, _clinic_key(clinic_id), start_date, end_date, oldest)
+                )
+            }
+        
+        return [day for day in _days(start_date, end_date) if day not in built]
+    
+    def appointment_totals(self, start_date: str, end_date: str, clinic_id: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        Soma as contagens diárias de agendamentos de um período.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD.
+            clinic_id: ID da clínica (opcional).
+            
+        Returns:
+            Dicionário com total e contagens by_status, by_weekday (0 = segunda),
+            by_hour, by_month (1 a 12) e by_language.
+        """
+        return self._totals("appointment_daily", "count", "status", start_date, end_date, clinic_id)
+    
+    def usage_totals(self, start_date: str, end_date: str, clinic_id: Optional[Any] = None) -> Dict[str, Any]:
+        """
+        Soma as contagens diárias de uso de um período.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD.
+            clinic_id: ID da clínica (opcional).
+            
+        Returns:
+            Dicionário com total, unique_users, avg_conversation_time e contagens
+            by_type, by_weekday, by_hour, by_month e by_language.
+        """
+        totals = self._totals("usage_daily", "interactions", "interaction_type", start_date, end_date, clinic_id)
+        totals["by_type"] = totals.pop("by_interaction_type")
+        params = (_clinic_key(clinic_id), start_date, end_date)
+        
+        with self._lock:
+            duration_sum, duration_count = self._conn.execute(
+                "SELECT COALESCE(SUM(duration_sum), 0), COALESCE(SUM(duration_count), 0) FROM usage_daily WHERE clinic_id = ? AND day BETWEEN ? AND ?",
+                params
+            ).fetchone()
+            totals["unique_users"] = self._conn.execute(
+                "SELECT COUNT(DISTINCT line_user_id) FROM usage_users WHERE clinic_id = ? AND day BETWEEN ? AND ?",
+                params
+            ).fetchone()[0]
+        
+        totals["avg_conversation_time"] = duration_sum / duration_count if duration_count else None
+        return totals
+    
+    def _totals(self, table: str, measure: str, category: str, start_date: str, end_date: str, clinic_id: Optional[Any]) -> Dict[str, Any]:
+        params = (_clinic_key(clinic_id), start_date, end_date)
+        where = "WHERE clinic_id = ? AND day BETWEEN ? AND ?"
+        dimensions = {
+            f"by_{category}": category,
+            "by_weekday": "weekday",
+            "by_hour": "hour",
+            "by_month": "CAST(substr(day, 6, 2) AS INTEGER)",
+            "by_language": "language"
+        }
+        
+        totals = {}
+        with self._lock:
+            totals["total"] = self._conn.execute(f"SELECT COALESCE(SUM({measure}), 0) FROM {table} {where}", params).fetchone()[0]
+            for name, expression in dimensions.items():
+                rows = self._conn.execute(
+                    f"SELECT {expression} AS key, SUM({measure}) AS total FROM {table} {where} GROUP BY key ORDER BY key",
+                    params
+                ).fetchall()
+                totals[name] = {row["key"]: row["total"] for row in rows}
+        
+        return totals
+
+def open_report_rollups() -> ReportRollupStore:
+    """
+    Abre as contagens diárias no arquivo compartilhado (REPORT_ROLLUP_PATH,
+    EVENT_STORE_PATH ou o arquivo padrão), o mesmo para o gerenciador de
+    calendário, que grava os agendamentos, e o de relatórios, que as lê.
+    
+    Returns:
+        Instância de ReportRollupStore.
+    """
+    store = ReportRollupStore(resolve_store_path("REPORT_ROLLUP_PATH", "EVENT_STORE_PATH"))
+    if store.path == ":memory:":
+        logger.warning("Contagens dos relatórios em memória: passe o mesmo ReportRollupStore aos gerenciadores de calendário e de relatórios.")
+    return store
@@ -1,52 +1,70 @@
 import os
 import logging
 import json
-from typing import Dict, List, Optional, Any, Tuple
+from typing import TYPE_CHECKING, BinaryIO, Dict, List, Optional, Any, Tuple, Union
 from datetime import datetime, timedelta
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import io
-import base64
+from concurrent.futures import Future
+
+from chart_renderer import ChartImage, ChartRenderer, chart_png, get_chart_renderer
+from report_rollups import ReportRollupStore, open_report_rollups
+
+# pandas, matplotlib e seaborn são importados só no primeiro relatório:
+# processos que apenas importam este módulo (como o webhook) não pagam por eles
+if TYPE_CHECKING:
+    import pandas as pd
+    from report_frames import ReportFrameCache
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_ORDER = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
 class ReportingManager:
     """
     Gerenciador de relatórios e estatísticas para o chatbot LINE.
     Gera relatórios sobre agendamentos, pacientes e uso do sistema.
     """
     
-    def __init__(self, supabase_manager):
+    def __init__(self, supabase_manager, rollups: Optional[ReportRollupStore] = None, chart_renderer: Optional[ChartRenderer] = None):
         """
         Inicializa o gerenciador de relatórios.
         
         Args:
             supabase_manager: Instância do gerenciador do Supabase.
+            rollups: Contagens diárias pré-agregadas (opcional, padrão: open_report_rollups).
+                Passe o report_rollups do CalendarManager, que grava os agendamentos.
+            chart_renderer: Renderizador de gráficos (opcional, padrão: o compartilhado pelo processo).
         """
         self.supabase_manager = supabase_manager
         
-        # Configurar estilo dos gráficos
-        self._setup_plot_style()
+        # Agendamentos e pacientes em DataFrames tipados, criados no primeiro uso (ver frames)
+        self._frames: Optional["ReportFrameCache"] = None
+        
+        # Contagens diárias de agendamentos (gravadas pelo CalendarManager) e de uso;
+        # dias sem contagem ou mais antigos que rollup_max_age são agregados das linhas brutas
+        self.rollups = rollups or open_report_rollups()
+        self.rollup_max_age = float(os.getenv("REPORT_ROLLUP_MAX_AGE", "3600"))
+        
+        # Gráficos renderizados em processos separados, em cache pelo conteúdo
+        self.chart_renderer = chart_renderer or get_chart_renderer()
     
-    def _setup_plot_style(self):
-        """
-        Configura o estilo dos gráficos para relatórios.
-        """
-        # Configurar estilo Seaborn
-        sns.set(style="whitegrid")
-        
-        # Configurar estilo Matplotlib
-        plt.rcParams['figure.figsize'] = (10, 6)
-        plt.rcParams['font.size'] = 12
-        plt.rcParams['axes.labelsize'] = 14
-        plt.rcParams['axes.titlesize'] = 16
-        plt.rcParams['xtick.labelsize'] = 12
-        plt.rcParams['ytick.labelsize'] = 12
-        plt.rcParams['legend.fontsize'] = 12
-        plt.rcParams['figure.titlesize'] = 18
+    @property
+    def frames(self) -> "ReportFrameCache":
+        """
+        Cache de DataFrames compartilhado pelos relatórios, criado no primeiro uso.
+        """
+        if self._frames is None:
+            from report_frames import ReportFrameCache
+            self._frames = ReportFrameCache(
+                self.supabase_manager,
+                refresh_interval=float(os.getenv("REPORT_CACHE_REFRESH", "60")),
+                full_reload_interval=float(os.getenv("REPORT_CACHE_FULL_RELOAD", "900"))
+            )
+        return self._frames
     
     def generate_appointment_report(self, start_date: str, end_date: str, clinic_id: Optional[int] = None) -> Dict[str, Any]:
         """
@@ -61,83 +79,73 @@ class ReportingManager:
             Dicionário com dados do relatório e gráficos codificados em base64.
         """
         try:
-            # Obter agendamentos do período
-            appointments = self.supabase_manager.get_appointments_by_date_range(start_date, end_date, clinic_id)
+            # Somar as contagens diárias do período
+            totals = self._appointment_totals(start_date, end_date, clinic_id)
             
-            if not appointments:
+            if not totals["total"]:
                 return {
                     "success": False,
                     "message": "Nenhum agendamento encontrado no período especificado.",
                     "data": None
                 }
             
-            # Converter para DataFrame
-            df = pd.DataFrame(appointments)
-            
-            # Adicionar colunas de data e hora formatadas
-            df['date'] = pd.to_datetime(df['appointment_date'])
-            df['time'] = pd.to_datetime(df['appointment_time'], format='%H:%M').dt.time
-            df['day_of_week'] = df['date'].dt.day_name()
-            df['month'] = df['date'].dt.month_name()
-            df['hour'] = pd.to_datetime(df['appointment_time'], format='%H:%M').dt.hour
-            
             # Estatísticas gerais
-            total_appointments = len(df)
-            confirmed_appointments = len(df[df['status'] == 'confirmed'])
-            cancelled_appointments = len(df[df['status'] == 'cancelled'])
-            pending_appointments = len(df[df['status'] == 'pending'])
+            total_appointments = totals["total"]
+            confirmed_appointments = totals["by_status"].get('confirmed', 0)
+            cancelled_appointments = totals["by_status"].get('cancelled', 0)
+            pending_appointments = totals["by_status"].get('pending', 0)
             
             confirmation_rate = (confirmed_appointments / total_appointments) * 100 if total_appointments > 0 else 0
             cancellation_rate = (cancelled_appointments / total_appointments) * 100 if total_appointments > 0 else 0
             
             # Agendamentos por dia da semana
-            day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-            appointments_by_day = df['day_of_week'].value_counts().reindex(day_order).fillna(0).to_dict()
+            appointments_by_day = {day: totals["by_weekday"].get(index, 0) for index, day in enumerate(DAY_ORDER)}
             
             # Agendamentos por hora do dia
-            appointments_by_hour = df['hour'].value_counts().sort_index().to_dict()
+            appointments_by_hour = totals["by_hour"]
             
             # Agendamentos por mês
-            month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                          'July', 'August', 'September', 'October', 'November', 'December']
-            appointments_by_month = df['month'].value_counts().reindex(month_order).fillna(0).to_dict()
+            appointments_by_month = {month: totals["by_month"].get(index + 1, 0) for index, month in enumerate(MONTH_ORDER)}
             
-            # Agendamentos por status
-            appointments_by_status = df['status'].value_counts().to_dict()
+            # Agendamentos por status (só os presentes no período)
+            appointments_by_status = totals["by_status"]
             
             # Gerar gráficos
             graphs = {}
             
             # Gráfico de agendamentos por dia da semana
             graphs['appointments_by_day'] = self._create_bar_chart(
-                appointments_by_day, 
-                'Agendamentos por Dia da Semana', 
-                'Dia da Semana', 
+                appointments_by_day,
+                'Agendamentos por Dia da Semana',
+                'Dia da Semana',
                 'Número de Agendamentos'
             )
             
             # Gráfico de agendamentos por hora
             graphs['appointments_by_hour'] = self._create_bar_chart(
-                appointments_by_hour, 
-                'Agendamentos por Hora do Dia', 
-                'Hora do Dia', 
+                appointments_by_hour,
+                'Agendamentos por Hora do Dia',
+                'Hora do Dia',
                 'Número de Agendamentos'
             )
             
             # Gráfico de agendamentos por status
             graphs['appointments_by_status'] = self._create_pie_chart(
-                appointments_by_status, 
+                appointments_by_status,
                 'Distribuição de Status de Agendamentos'
             )
             
             # Gráfico de agendamentos por mês
             graphs['appointments_by_month'] = self._create_bar_chart(
-                appointments_by_month, 
-                'Agendamentos por Mês', 
-                'Mês', 
+                appointments_by_month,
+                'Agendamentos por Mês',
+                'Mês',
                 'Número de Agendamentos'
             )
             
+            # Aguardar os gráficos, renderizados em paralelo
+            graphs = self._resolve_graphs(graphs)
+            
             # Compilar relatório
             report = {
                 "success": True,
@@ -183,23 +191,23 @@ class ReportingManager:
         Returns:
             Dicionário com dados do relatório e gráficos codificados em base64.
         """
+        import pandas as pd
+        
         try:
-            # Obter todos os pacientes
-            patients = self.supabase_manager.get_all_patients(clinic_id)
+            # Obter todos os pacientes, com created_at já convertido
+            df = self.frames.patients(clinic_id)
             
-            if not patients:
+            if df.empty:
                 return {
                     "success": False,
                     "message": "Nenhum paciente encontrado.",
                     "data": None
                 }
             
-            # Converter para DataFrame
-            df = pd.DataFrame(patients)
+            df = df.copy()
             
-            # Adicionar coluna de data de criação formatada
+            # Adicionar colunas de mês e ano de criação
             if 'created_at' in df.columns:
-                df['created_at'] = pd.to_datetime(df['created_at'])
                 df['month_created'] = df['created_at'].dt.month_name()
                 df['year_created'] = df['created_at'].dt.year
             
@@ -216,19 +224,18 @@ class ReportingManager:
             new_patients = len(df_filtered) if start_date and end_date else total_patients
             
             # Pacientes por idioma preferido
-            patients_by_language = df['preferred_language'].value_counts().to_dict()
+            patients_by_language = self._count_categories(df['preferred_language'])
             
             # Pacientes por mês de criação (se houver data de criação)
             patients_by_month = {}
             if 'month_created' in df.columns:
-                month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
+                month_order = ['January', 'February', 'March', 'April', 'May', 'June',
                               'July', 'August', 'September', 'October', 'November', 'December']
                 patients_by_month = df_filtered['month_created'].value_counts().reindex(month_order).fillna(0).to_dict()
             
             # Número médio de agendamentos por paciente
-            appointments = self.supabase_manager.get_all_appointments(clinic_id)
-            if appointments:
-                appointments_df = pd.DataFrame(appointments)
+            appointments_df = self.frames.appointments(clinic_id=clinic_id)
+            if not appointments_df.empty:
                 appointments_per_patient = appointments_df.groupby('patient_id').size()
                 avg_appointments_per_patient = appointments_per_patient.mean()
                 max_appointments_per_patient = appointments_per_patient.max()
@@ -241,19 +248,22 @@ class ReportingManager:
             
             # Gráfico de pacientes por idioma
             graphs['patients_by_language'] = self._create_pie_chart(
-                patients_by_language, 
+                patients_by_language,
                 'Distribuição de Pacientes por Idioma'
             )
             
             # Gráfico de novos pacientes por mês
             if patients_by_month:
                 graphs['patients_by_month'] = self._create_bar_chart(
-                    patients_by_month, 
-                    'Novos Pacientes por Mês', 
-                    'Mês', 
+                    patients_by_month,
+                    'Novos Pacientes por Mês',
+                    'Mês',
                     'Número de Pacientes'
                 )
             
+            # Aguardar os gráficos, renderizados em paralelo
+            graphs = self._resolve_graphs(graphs)
+            
             # Compilar relatório
             report = {
                 "success": True,
@@ -296,78 +306,69 @@ class ReportingManager:
             Dicionário com dados do relatório e gráficos codificados em base64.
         """
         try:
-            # Obter logs de uso do período
-            usage_logs = self.supabase_manager.get_usage_logs(start_date, end_date, clinic_id)
+            # Somar as contagens diárias do período
+            totals = self._usage_totals(start_date, end_date, clinic_id)
             
-            if not usage_logs:
+            if not totals["total"]:
                 return {
                     "success": False,
                     "message": "Nenhum log de uso encontrado no período especificado.",
                     "data": None
                 }
             
-            # Converter para DataFrame
-            df = pd.DataFrame(usage_logs)
-            
-            # Adicionar colunas de data e hora formatadas
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df['date'] = df['timestamp'].dt.date
-            df['hour'] = df['timestamp'].dt.hour
-            df['day_of_week'] = df['timestamp'].dt.day_name()
-            
             # Estatísticas gerais
-            total_interactions = len(df)
-            unique_users = df['line_user_id'].nunique()
+            total_interactions = totals["total"]
+            unique_users = totals["unique_users"]
             
             # Interações por tipo
-            interactions_by_type = df['interaction_type'].value_counts().to_dict()
+            interactions_by_type = totals["by_type"]
             
             # Interações por dia da semana
-            day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-            interactions_by_day = df['day_of_week'].value_counts().reindex(day_order).fillna(0).to_dict()
+            interactions_by_day = {day: totals["by_weekday"].get(index, 0) for index, day in enumerate(DAY_ORDER)}
             
             # Interações por hora do dia
-            interactions_by_hour = df['hour'].value_counts().sort_index().to_dict()
+            interactions_by_hour = totals["by_hour"]
             
             # Interações por idioma
-            interactions_by_language = df['language'].value_counts().to_dict()
+            interactions_by_language = totals["by_language"]
             
             # Tempo médio de conversa
-            avg_conversation_time = 0
-            if 'conversation_duration' in df.columns:
-                avg_conversation_time = df['conversation_duration'].mean()
+            avg_conversation_time = totals["avg_conversation_time"] or 0
             
             # Gerar gráficos
             graphs = {}
             
             # Gráfico de interações por tipo
             graphs['interactions_by_type'] = self._create_pie_chart(
-                interactions_by_type, 
+                interactions_by_type,
                 'Distribuição de Interações por Tipo'
             )
             
             # Gráfico de interações por dia da semana
             graphs['interactions_by_day'] = self._create_bar_chart(
-                interactions_by_day, 
-                'Interações por Dia da Semana', 
-                'Dia da Semana', 
+                interactions_by_day,
+                'Interações por Dia da Semana',
+                'Dia da Semana',
                 'Número de Interações'
             )
             
             # Gráfico de interações por hora
             graphs['interactions_by_hour'] = self._create_bar_chart(
-                interactions_by_hour, 
-                'Interações por Hora do Dia', 
-                'Hora do Dia', 
+                interactions_by_hour,
+                'Interações por Hora do Dia',
+                'Hora do Dia',
                 'Número de Interações'
             )
             
             # Gráfico de interações por idioma
             graphs['interactions_by_language'] = self._create_pie_chart(
-                interactions_by_language, 
+                interactions_by_language,
                 'Distribuição de Interações por Idioma'
             )
             
+            # Aguardar os gráficos, renderizados em paralelo
+            graphs = self._resolve_graphs(graphs)
+            
             # Compilar relatório
             report = {
                 "success": True,
@@ -410,6 +411,8 @@ class ReportingManager:
         Returns:
             Dicionário com dados do relatório e gráficos codificados em base64.
         """
+        import pandas as pd
+        
         try:
             # Obter logs de desempenho do período
             performance_logs = self.supabase_manager.get_performance_logs(start_date, end_date, clinic_id)
@@ -447,19 +450,22 @@ class ReportingManager:
             # Gráfico de tempo de resposta por hora
             if response_time_by_hour:
                 graphs['response_time_by_hour'] = self._create_line_chart(
-                    response_time_by_hour, 
-                    'Tempo Médio de Resposta por Hora', 
-                    'Hora do Dia', 
+                    response_time_by_hour,
+                    'Tempo Médio de Resposta por Hora',
+                    'Hora do Dia',
                     'Tempo de Resposta (ms)'
                 )
             
             # Gráfico de erros por tipo
             if errors_by_type:
                 graphs['errors_by_type'] = self._create_pie_chart(
-                    errors_by_type, 
+                    errors_by_type,
                     'Distribuição de Erros por Tipo'
                 )
             
+            # Aguardar os gráficos, renderizados em paralelo
+            graphs = self._resolve_graphs(graphs)
+            
             # Compilar relatório
             report = {
                 "success": True,
@@ -500,55 +506,51 @@ class ReportingManager:
         Returns:
             Dicionário com dados do resumo.
         """
+        import pandas as pd
+        
         try:
             # Calcular datas
             end_date = datetime.now().strftime("%Y-%m-%d")
             start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
             
-            # Obter dados de agendamentos
-            appointments = self.supabase_manager.get_appointments_by_date_range(start_date, end_date, clinic_id)
-            
-            # Obter dados de pacientes
-            patients = self.supabase_manager.get_all_patients(clinic_id)
+            # Obter agendamentos e pacientes em DataFrames tipados
+            df_appointments = self.frames.appointments(start_date, end_date, clinic_id)
+            df_patients = self.frames.patients(clinic_id)
             
             # Calcular estatísticas
-            total_appointments = len(appointments) if appointments else 0
-            total_patients = len(patients) if patients else 0
+            total_appointments = len(df_appointments)
+            total_patients = len(df_patients)
             
             # Agendamentos por status
-            appointments_by_status = {}
-            if appointments:
-                df_appointments = pd.DataFrame(appointments)
-                appointments_by_status = df_appointments['status'].value_counts().to_dict()
+            appointments_by_status = self._count_categories(df_appointments['status'])
             
             # Novos pacientes no período
             new_patients = 0
-            if patients and 'created_at' in patients[0]:
-                df_patients = pd.DataFrame(patients)
-                df_patients['created_at'] = pd.to_datetime(df_patients['created_at'])
-                new_patients = len(df_patients[df_patients['created_at'] >= pd.to_datetime(start_date)])
+            if 'created_at' in df_patients.columns:
+                new_patients = int((df_patients['created_at'] >= pd.Timestamp(start_date)).sum())
             
             # Próximos agendamentos
             upcoming_appointments = []
-            if appointments:
-                df_appointments = pd.DataFrame(appointments)
-                df_appointments['date'] = pd.to_datetime(df_appointments['appointment_date'])
-                df_appointments['time'] = df_appointments['appointment_time']
-                
+            if not df_appointments.empty:
                 # Filtrar agendamentos futuros e confirmados
-                today = datetime.now().date()
+                today = pd.Timestamp(datetime.now().date())
                 future_appointments = df_appointments[
-                    (df_appointments['date'].dt.date >= today) & 
+                    (df_appointments['date'] >= today) &
                     (df_appointments['status'] == 'confirmed')
                 ]
                 
                 # Ordenar por data e hora
-                future_appointments = future_appointments.sort_values(by=['date', 'time'])
+                future_appointments = future_appointments.sort_values(by='start')
+                
+                # Nomes dos pacientes a partir do cache de pacientes
+                names = df_patients.set_index('id')['name'] if 'name' in df_patients.columns else pd.Series(dtype=object)
                 
                 # Obter os próximos 5 agendamentos
                 for _, row in future_appointments.head(5).iterrows():
-                    patient = self.supabase_manager.get_patient_by_id(row['patient_id'])
-                    patient_name = patient.get('name', 'Unknown') if patient else 'Unknown'
+                    patient_name = names.get(row['patient_id'])
+                    if patient_name is None:
+                        patient = self.supabase_manager.get_patient_by_id(row['patient_id'])
+                        patient_name = patient.get('name', 'Unknown') if patient else 'Unknown'
                     
                     upcoming_appointments.append({
                         'id': row['id'],
@@ -586,15 +588,45 @@ class ReportingManager:
                 "data": None
             }
     
-    def export_report_to_pdf(self, report_type: str, report_data: Dict[str, Any], output_file: str) -> bool:
+    def export_report(self, report_type: str, report_data: Dict[str, Any], file_format: str) -> Optional[io.BytesIO]:
         """
-        Exporta um relatório para PDF.
+        Exporta um relatório para um buffer em memória, pronto para ser enviado
+        numa resposta HTTP (por exemplo, flask.send_file).
         
         Args:
             report_type: Tipo de relatório ('appointment', 'patient', 'usage', 'performance').
             report_data: Dados do relatório.
-            output_file: Caminho do arquivo de saída.
+            file_format: Formato do arquivo ('pdf' ou 'excel').
             
+        Returns:
+            Buffer posicionado no início com o documento, ou None em caso de erro.
+        """
+        exporters = {
+            'pdf': self.export_report_to_pdf,
+            'excel': self.export_report_to_excel
+        }
+        
+        if file_format not in exporters:
+            logger.error(f"Formato de exportação não suportado: {file_format}")
+            return None
+        
+        buffer = io.BytesIO()
+        if not exporters[file_format](report_type, report_data, buffer):
+            return None
+        
+        buffer.seek(0)
+        return buffer
+    
+    def export_report_to_pdf(self, report_type: str, report_data: Dict[str, Any], output_file: Union[str, BinaryIO]) -> bool:
+        """
+        Exporta um relatório para PDF.
+        
+        Args:
+            report_type: Tipo de relatório ('appointment', 'patient', 'usage', 'performance').
+            report_data: Dados do relatório.
+            output_file: Caminho do arquivo de saída ou stream binário gravável
+                (BytesIO, corpo de uma resposta HTTP).
+                
         Returns:
             True se a exportação foi bem-sucedida, False caso contrário.
         """
@@ -673,26 +705,15 @@ class ReportingManager:
                 elements.append(Paragraph("Gráficos", styles['Subtitle']))
                 
                 for graph_name, graph_data in report_data['graphs'].items():
-                    # Decodificar imagem base64
-                    image_data = base64.b64decode(graph_data.split(',')[1])
-                    
-                    # Salvar temporariamente
-                    temp_image_path = f"/tmp/{graph_name}.png"
-                    with open(temp_image_path, 'wb') as f:
-                        f.write(image_data)
-                    
-                    # Adicionar ao documento
-                    img = Image(temp_image_path, width=6*inch, height=4*inch)
+                    # Adicionar ao documento direto dos bytes PNG, sem arquivo temporário
+                    img = Image(io.BytesIO(chart_png(graph_data)), width=6*inch, height=4*inch)
                     elements.append(img)
                     elements.append(Spacer(1, 0.25 * inch))
-                    
-                    # Remover arquivo temporário
-                    os.remove(temp_image_path)
             
             # Construir documento
             doc.build(elements)
             
-            logger.info(f"Relatório exportado com sucesso para {output_file}")
+            logger.info(f"Relatório exportado com sucesso para {output_file if isinstance(output_file, str) else 'stream'}")
             return True
         except ImportError:
             logger.error("Biblioteca ReportLab não instalada. Execute: pip install reportlab")
@@ -701,26 +722,29 @@ class ReportingManager:
             logger.error(f"Erro ao exportar relatório para PDF: {str(e)}")
             return False
     
-    def export_report_to_excel(self, report_type: str, report_data: Dict[str, Any], output_file: str) -> bool:
+    def export_report_to_excel(self, report_type: str, report_data: Dict[str, Any], output_file: Union[str, BinaryIO]) -> bool:
         """
         Exporta um relatório para Excel.
         
         Args:
             report_type: Tipo de relatório ('appointment', 'patient', 'usage', 'performance').
             report_data: Dados do relatório.
-            output_file: Caminho do arquivo de saída.
-            
+            output_file: Caminho do arquivo de saída ou stream binário gravável
+                (BytesIO, corpo de uma resposta HTTP).
+                
         Returns:
             True se a exportação foi bem-sucedida, False caso contrário.
         """
+        import pandas as pd
+        
         try:
             # Verificar se o relatório foi gerado com sucesso
             if not report_data.get('success', False):
                 logger.error(f"Não é possível exportar relatório com erro: {report_data.get('message', 'Unknown error')}")
                 return False
             
-            # Criar arquivo Excel
-            with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+            # Criar arquivo Excel; in_memory evita os arquivos temporários do XlsxWriter
+            with pd.ExcelWriter(output_file, engine='xlsxwriter', engine_kwargs={'options': {'in_memory': True}}) as writer:
                 # Planilha de resumo
                 summary_df = pd.DataFrame({
                     'Métrica': list(report_data.get('summary', {}).keys()),
@@ -747,27 +771,16 @@ class ReportingManager:
                     
                     row = 0
                     for graph_name, graph_data in report_data['graphs'].items():
-                        # Decodificar imagem base64
-                        image_data = base64.b64decode(graph_data.split(',')[1])
-                        
-                        # Salvar temporariamente
-                        temp_image_path = f"/tmp/{graph_name}.png"
-                        with open(temp_image_path, 'wb') as f:
-                            f.write(image_data)
-                        
                         # Adicionar título
                         title = graph_name.replace('_', ' ').title()
                         worksheet.write(row, 0, title)
                         row += 1
                         
-                        # Inserir imagem
-                        worksheet.insert_image(row, 0, temp_image_path)
+                        # Inserir imagem direto dos bytes PNG, sem arquivo temporário
+                        worksheet.insert_image(row, 0, f"{graph_name}.png", {'image_data': io.BytesIO(chart_png(graph_data))})
                         row += 20  # Espaço para a imagem
-                        
-                        # Remover arquivo temporário
-                        os.remove(temp_image_path)
             
-            logger.info(f"Relatório exportado com sucesso para {output_file}")
+            logger.info(f"Relatório exportado com sucesso para {output_file if isinstance(output_file, str) else 'stream'}")
             return True
         except ImportError:
             logger.error("Biblioteca XlsxWriter não instalada. Execute: pip install xlsxwriter")
@@ -788,6 +801,8 @@ class ReportingManager:
         Returns:
             True se a exportação foi bem-sucedida, False caso contrário.
         """
+        import pandas as pd
+        
         try:
             # Verificar se o relatório foi gerado com sucesso
             if not report_data.get('success', False):
@@ -820,85 +835,91 @@ class ReportingManager:
             logger.error(f"Erro ao exportar relatório para CSV: {str(e)}")
             return False
     
-    def _create_bar_chart(self, data: Dict[str, Any], title: str, xlabel: str, ylabel: str) -> str:
+    def _count_categories(self, series: "pd.Series") -> Dict[str, int]:
         """
-        Cria um gráfico de barras.
+        Conta os valores de uma coluna categórica, sem as categorias ausentes.
         
         Args:
-            data: Dicionário com dados para o gráfico.
-            title: Título do gráfico.
-            xlabel: Rótulo do eixo X.
-            ylabel: Rótulo do eixo Y.
+            series: Coluna categórica.
             
         Returns:
-            String base64 da imagem do gráfico.
+            Dicionário {valor: quantidade}.
         """
-        plt.figure(figsize=(10, 6))
-        
-        # Criar gráfico
-        ax = sns.barplot(x=list(data.keys()), y=list(data.values()))
+        counts = series.value_counts()
+        return {key: int(value) for key, value in counts[counts > 0].items()}
+    
+    def _appointment_totals(self, start_date: str, end_date: str, clinic_id: Optional[int]) -> Dict[str, Any]:
+        """
+        Soma as contagens diárias de agendamentos, agregando antes os dias que faltam.
+        """
+        missing = self.rollups.missing_days("appointments", clinic_id, start_date, end_date, self.rollup_max_age)
+        if missing:
+            appointments = self.supabase_manager.get_appointments_by_date_range(missing[0], missing[-1], clinic_id) or []
+            self.rollups.replace_appointments(clinic_id, missing[0], missing[-1], appointments, self._patient_languages(appointments, clinic_id))
         
-        # Configurar rótulos
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.xticks(rotation=45)
+        return self.rollups.appointment_totals(start_date, end_date, clinic_id)
+    
+    def _usage_totals(self, start_date: str, end_date: str, clinic_id: Optional[int]) -> Dict[str, Any]:
+        """
+        Soma as contagens diárias de uso, agregando antes os dias que faltam.
+        """
+        missing = self.rollups.missing_days("usage", clinic_id, start_date, end_date, self.rollup_max_age)
+        if missing:
+            logs = self.supabase_manager.get_usage_logs(missing[0], missing[-1], clinic_id) or []
+            self.rollups.replace_usage(clinic_id, missing[0], missing[-1], logs)
         
-        # Adicionar valores nas barras
-        for i, v in enumerate(data.values()):
-            ax.text(i, v + 0.1, str(v), ha='center')
+        return self.rollups.usage_totals(start_date, end_date, clinic_id)
+    
+    def _patient_languages(self, appointments: List[Dict[str, Any]], clinic_id: Optional[int]) -> Dict[Any, str]:
+        """
+        Obtém o idioma preferido dos pacientes dos agendamentos, para as contagens por idioma.
+        """
+        import pandas as pd
         
-        plt.tight_layout()
+        if all(appointment.get("language") for appointment in appointments):
+            return {}
         
-        # Converter para base64
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        plt.close()
+        try:
+            patients = self.frames.patients(clinic_id)
+        except Exception as e:
+            logger.warning(f"Idiomas dos pacientes indisponíveis: {str(e)}")
+            return {}
         
-        return f"data:image/png;base64,{image_base64}"
+        if patients.empty or "preferred_language" not in patients.columns:
+            return {}
+        return {patient_id: str(language) for patient_id, language in zip(patients["id"].tolist(), patients["preferred_language"]) if pd.notna(language)}
     
-    def _create_pie_chart(self, data: Dict[str, Any], title: str) -> str:
+    def _create_bar_chart(self, data: Dict[str, Any], title: str, xlabel: str, ylabel: str) -> Future:
         """
-        Cria um gráfico de pizza.
+        Pede um gráfico de barras ao renderizador.
         
         Args:
             data: Dicionário com dados para o gráfico.
             title: Título do gráfico.
+            xlabel: Rótulo do eixo X.
+            ylabel: Rótulo do eixo Y.
             
         Returns:
-            String base64 da imagem do gráfico.
+            Future com os bytes PNG do gráfico (ver _resolve_graphs).
         """
-        plt.figure(figsize=(8, 8))
-        
-        # Criar gráfico
-        plt.pie(
-            list(data.values()),
-            labels=list(data.keys()),
-            autopct='%1.1f%%',
-            startangle=90,
-            shadow=True
-        )
-        
-        # Configurar rótulos
-        plt.title(title)
-        plt.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle
-        
-        plt.tight_layout()
-        
-        # Converter para base64
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        plt.close()
+        return self.chart_renderer.submit("bar", data, title, xlabel, ylabel)
+    
+    def _create_pie_chart(self, data: Dict[str, Any], title: str) -> Future:
+        """
+        Pede um gráfico de pizza ao renderizador.
         
-        return f"data:image/png;base64,{image_base64}"
+        Args:
+            data: Dicionário com dados para o gráfico.
+            title: Título do gráfico.
+            
+        Returns:
+            Future com os bytes PNG do gráfico (ver _resolve_graphs).
+        """
+        return self.chart_renderer.submit("pie", data, title)
     
-    def _create_line_chart(self, data: Dict[str, Any], title: str, xlabel: str, ylabel: str) -> str:
+    def _create_line_chart(self, data: Dict[str, Any], title: str, xlabel: str, ylabel: str) -> Future:
         """
-        Cria um gráfico de linha.
+        Pede um gráfico de linha ao renderizador.
         
         Args:
             data: Dicionário com dados para o gráfico.
@@ -907,32 +928,22 @@ class ReportingManager:
             ylabel: Rótulo do eixo Y.
             
         Returns:
-            String base64 da imagem do gráfico.
+            Future com os bytes PNG do gráfico (ver _resolve_graphs).
         """
-        plt.figure(figsize=(10, 6))
-        
-        # Ordenar dados
-        sorted_data = {k: data[k] for k in sorted(data.keys())}
-        
-        # Criar gráfico
-        plt.plot(list(sorted_data.keys()), list(sorted_data.values()), marker='o')
-        
-        # Configurar rótulos
-        plt.title(title)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.grid(True)
-        
-        plt.tight_layout()
-        
-        # Converter para base64
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        plt.close()
+        return self.chart_renderer.submit("line", data, title, xlabel, ylabel)
+    
+    def _resolve_graphs(self, graphs: Dict[str, Future]) -> Dict[str, str]:
+        """
+        Espera os gráficos pedidos e converte cada um em string base64.
         
-        return f"data:image/png;base64,{image_base64}"
+        Args:
+            graphs: Dicionário {nome: Future do gráfico}.
+            
+        Returns:
+            Dicionário {nome: imagem como data URI base64}; cada valor é um
+            ChartImage, que mantém os bytes PNG para as exportações.
+        """
+        return {name: ChartImage(future.result()) for name, future in graphs.items()}
     
     def _get_report_title(self, report_type: str) -> str:
         """
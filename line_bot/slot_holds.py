@@ -0,0 +1,265 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+class SlotHoldManager:
+    """
+    Reservas temporárias de horários.
+    Uma reserva é criada de forma atômica quando o paciente escolhe um horário
+    (restrição UNIQUE em resource, date, time), expira após ttl_seconds e é
+    convertida em agendamento na confirmação.
+    """
+    
+    def __init__(self, path: str = ":memory:", ttl_seconds: float = 300):
+        """
+        Inicializa o gerenciador de reservas.
+        
+        Args:
+            path: Caminho do arquivo SQLite (padrão: banco em memória).
+                Processos diferentes só disputam o mesmo horário com um arquivo compartilhado.
+            ttl_seconds: Validade de uma reserva não confirmada em segundos (padrão: 300).
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        
+        # Contadores de disputa por horários
+        self._metrics = {
+            "requested": 0,
+            "granted": 0,
+            "renewed": 0,
+            "contended": 0,
+            "confirmed": 0,
+            "confirm_failed": 0,
+            "released": 0
+        }
+        
+        with self._lock:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS slot_holds (
+                    hold_id TEXT PRIMARY KEY,
+                    resource TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    time TEXT NOT NULL,
+                    holder TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    expires_at REAL,
+                    appointment_id TEXT,
+                    UNIQUE (resource, date, time)
+                );
+                CREATE INDEX IF NOT EXISTS idx_slot_holds_appointment ON slot_holds (appointment_id);
+            """)
+    
+    def _count(self, metric: str):
+        self._metrics[metric] += 1
+    
+    def hold(self, date_str: str, time_str: str, holder: str, resource: str = "clinic") -> Optional[str]:
+        """
+        Reserva um horário para um paciente.
+        Se o mesmo paciente já tem a reserva, a validade é renovada.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD.
+            time_str: Horário no formato HH:MM.
+            holder: Identificador de quem reserva (por exemplo, o ID do LINE).
+            resource: Recurso reservado (padrão: clinic).
+            
+        Returns:
+            ID da reserva, ou None se o horário já estiver reservado ou agendado.
+        """
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        hold_id = uuid.uuid4().hex
+        
+        with self._lock:
+            self._count("requested")
+            try:
+                # BEGIN IMMEDIATE serializa a disputa também entre processos
+                self._conn.execute("BEGIN IMMEDIATE")
+                
+                # Reservas vencidas deixam de bloquear o horário
+                self._conn.execute(
+                    "DELETE FROM slot_holds WHERE resource = ? AND date = ? AND time = ? AND status = 'held' AND expires_at <= ?",
+                    (resource, date_str, time_str, now)
+                )
+                
+                try:
+                    self._conn.execute(
+                        "INSERT INTO slot_holds VALUES (?, ?, ?, ?, ?, 'held', ?, NULL)",
+                        (hold_id, resource, date_str, time_str, holder, expires_at)
+                    )
+                    self._conn.execute("COMMIT")
+                    self._count("granted")
+                    return hold_id
+                except sqlite3.IntegrityError:
+                    pass
+                
+                # Horário ocupado: renovar se a reserva for do próprio paciente
+                row = self._conn.execute(
+                    "SELECT hold_id, holder, status FROM slot_holds WHERE resource = ? AND date = ? AND time = ?",
+                    (resource, date_str, time_str)
+                ).fetchone()
+                
+                if row and row["holder"] == holder and row["status"] == "held":
+                    self._conn.execute("UPDATE slot_holds SET expires_at = ? WHERE hold_id = ?", (expires_at, row["hold_id"]))
+                    self._conn.execute("COMMIT")
+                    self._count("renewed")
+                    return row["hold_id"]
+                
+                self._conn.execute("COMMIT")
+                self._count("contended")
+                return None
+            except Exception as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                logger.error(f"Erro ao reservar horário {date_str} {time_str}: {str(e)}")
+                return None
+    
+    def confirm(self, hold_id: str) -> bool:
+        """
+        Converte uma reserva em agendamento.
+        Uma reserva vencida ainda pode ser confirmada se ninguém tiver ocupado o horário.
+        
+        Args:
+            hold_id: ID da reserva.
+            
+        Returns:
+            True se a reserva foi confirmada, False se ela não existe mais.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE slot_holds SET status = 'booked', expires_at = NULL WHERE hold_id = ? AND status = 'held'",
+                (hold_id,)
+            )
+            self._count("confirmed" if cursor.rowcount == 1 else "confirm_failed")
+            return cursor.rowcount == 1
+    
+    def attach_appointment(self, hold_id: str, appointment_id: Any):
+        """
+        Associa o agendamento criado a uma reserva confirmada.
+        
+        Args:
+            hold_id: ID da reserva.
+            appointment_id: ID do agendamento.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE slot_holds SET appointment_id = ? WHERE hold_id = ?", (str(appointment_id), hold_id))
+    
+    def release(self, hold_id: str):
+        """
+        Libera uma reserva (por exemplo, quando o paciente desiste ou troca de horário).
+        
+        Args:
+            hold_id: ID da reserva.
+        """
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM slot_holds WHERE hold_id = ?", (hold_id,))
+            if cursor.rowcount:
+                self._count("released")
+    
+    def release_appointment(self, appointment_id: Any):
+        """
+        Libera o horário de um agendamento cancelado.
+        
+        Args:
+            appointment_id: ID do agendamento.
+        """
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM slot_holds WHERE appointment_id = ?", (str(appointment_id),))
+            if cursor.rowcount:
+                self._count("released")
+    
+    def held_slots(self, date_str: str, exclude_holder: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Obtém os horários de uma data reservados ou agendados por outros pacientes.
+        
+        Args:
+            date_str: Data no formato YYYY-MM-DD.
+            exclude_holder: Paciente cujas reservas são ignoradas (opcional).
+            
+        Returns:
+            Lista de pares (recurso, HH:MM).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT resource, time FROM slot_holds WHERE date = ? AND holder != ? AND (status = 'booked' OR expires_at > ?)",
+                (date_str, exclude_holder or "", time.time())
+            ).fetchall()
+        
+        return [(row["resource"], row["time"]) for row in rows]
+    
+    def held_slots_by_date(self, start_date: str, end_date: str, exclude_holder: Optional[str] = None) -> Dict[str, List[Tuple[str, str]]]:
+        """
+        Obtém, em uma única consulta, os horários reservados ou agendados por
+        outros pacientes em um intervalo de datas.
+        
+        Args:
+            start_date: Data inicial no formato YYYY-MM-DD.
+            end_date: Data final no formato YYYY-MM-DD.
+            exclude_holder: Paciente cujas reservas são ignoradas (opcional).
+            
+        Returns:
+            Dicionário {data: [(recurso, HH:MM), ...]}.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, resource, time FROM slot_holds WHERE date BETWEEN ? AND ? AND holder != ? AND (status = 'booked' OR expires_at > ?)",
+                (start_date, end_date, exclude_holder or "", time.time())
+            ).fetchall()
+        
+        held = {}
+        for row in rows:
+            held.setdefault(row["date"], []).append((row["resource"], row["time"]))
+        return held
+    
+    def get_resource(self, hold_id: str) -> Optional[str]:
+        """
+        Obtém o recurso de uma reserva.
+        
+        Args:
+            hold_id: ID da reserva.
+            
+        Returns:
+            ID do recurso, ou None se a reserva não existir.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT resource FROM slot_holds WHERE hold_id = ?", (hold_id,)).fetchone()
+        
+        return row["resource"] if row else None
+    
+    def purge(self, before_date: str):
+        """
+        Remove reservas vencidas e registros de datas passadas.
+        
+        Args:
+            before_date: Data no formato YYYY-MM-DD; registros anteriores são removidos.
+        """
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM slot_holds WHERE date < ? OR (status = 'held' AND expires_at <= ?)",
+                (before_date, time.time())
+            )
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Obtém os contadores de disputa por horários.
+        
+        Returns:
+            Dicionário com os contadores e a taxa de disputa (contended / requested).
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        
+        metrics["contention_rate"] = metrics["contended"] / metrics["requested"] if metrics["requested"] else 0.0
+        return metrics
@@ -0,0 +1,34 @@
+import os
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Diretório padrão dos dados locais e arquivo SQLite compartilhado pelos armazenamentos
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_STORE_FILE = "line_bot.db"
+
+def resolve_store_path(*env_names: str) -> str:
+    """
+    Obtém o caminho do arquivo SQLite de um armazenamento local.
+    Usa a primeira variável de ambiente definida; sem nenhuma, todos os
+    armazenamentos compartilham DEFAULT_STORE_FILE em LINE_BOT_DATA_DIR
+    (padrão: line_bot/data), para que os dados sobrevivam a reinícios e
+    sejam vistos por todos os processos.
+    
+    Args:
+        *env_names: Variáveis de ambiente consultadas, em ordem de prioridade.
+        
+    Returns:
+        Caminho do arquivo SQLite, ou ":memory:" se configurado explicitamente.
+    """
+    for env_name in env_names:
+        path = os.getenv(env_name)
+        if path:
+            return path
+    
+    data_dir = os.getenv("LINE_BOT_DATA_DIR", DEFAULT_DATA_DIR)
+    os.makedirs(data_dir, exist_ok=True)
+    
+    return os.path.join(data_dir, DEFAULT_STORE_FILE)
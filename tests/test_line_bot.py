@@ -2,7 +2,9 @@ import unittest
 import os
 import sys
 import json
-from datetime import datetime, timedelta
+import subprocess
+import tempfile
+from datetime import date, datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock
 
 # Adicionar diretório pai ao path para importar módulos
@@ -12,6 +14,17 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from line_bot.translation_manager import TranslationManager
 from line_bot.conversation_manager import ConversationManager
 from line_bot.calendar_manager import CalendarManager
+from line_bot.availability_engine import AvailabilityEngine
+from line_bot.calendar_outbox import CalendarOutbox, idempotency_key
+from line_bot.chart_renderer import ChartCache, ChartRenderer, chart_png, render_chart
+from line_bot.calendar_sync import GoogleCalendarSyncer, OutlookCalendarSyncer, format_outlook_event
+from line_bot.clinic_schedule import ClinicSchedule, format_minutes
+from line_bot.event_store import EventStore
+from line_bot.event_time import to_clinic_minutes
+from line_bot.outlook_graph_client import OutlookGraphClient
+from line_bot.slot_holds import SlotHoldManager
+from line_bot.ical_feed import ICalEventIndex, ICalFeedCache, iter_vevents
+from line_bot.report_rollups import ReportRollupStore
 from line_bot.reporting_manager import ReportingManager
 from line_bot.line_manager import LineManager
 from line_bot.supabase_manager import SupabaseManager
@@ -172,26 +185,75 @@ class TestConversationManager(unittest.TestCase):
         # Testar data futura
         past_date = "2020-01-01"
         self.assertFalse(self.conversation_manager.validate_date_format(past_date))
+    
+    def test_get_available_times_uses_calendar(self):
+        """Testa que os horários oferecidos vêm do calendário."""
+        # Configurar horários livres no calendário
+        self.calendar_manager.get_free_times.return_value = ["10:00", "10:30"]
+        
+        # Testar horários de uma data futura
+        times = self.conversation_manager._get_available_times("2099-05-01", "user123")
+        
+        # Verificar se o calendário foi consultado
+        self.calendar_manager.get_free_times.assert_called_once_with("2099-05-01", "user123")
+        
+        # Verificar resultado
+        self.assertEqual(times, ["10:00", "10:30"])
+    
+    def test_request_time_without_slots_offers_another_date(self):
+        """Testa que uma data sem horários livres não gera um template sem botões."""
+        self.conversation_manager.get_user_state = MagicMock(return_value={"language": "en", "appointment_data": {"date": "2099-05-01"}})
+        self.conversation_manager._get_available_times = MagicMock(return_value=[])
+        self.conversation_manager._get_next_available_slots = MagicMock(return_value=[])
+        self.translation_manager.translate_text.side_effect = lambda text, source, target: text
+        
+        messages = self.conversation_manager._request_appointment_time("user123")
+        
+        # Verificar o botão para escolher outra data
+        actions = messages[0]["template"]["actions"]
+        self.assertEqual([action["data"] for action in actions], ["appointment=change_date"])
+    
+    def test_confirm_appointment_does_not_enqueue_pending_calendar_sync(self):
+        """Testa que um agendamento pendente é registrado sem job na fila de calendários."""
+        self.conversation_manager.get_user_state = MagicMock(return_value={
+            "language": "en",
+            "appointment_data": {"date": "2099-05-01", "time": "10:00", "reason": "Limpeza", "hold_id": "hold1"}
+        })
+        self.conversation_manager.update_user_state = MagicMock()
+        self.conversation_manager._send_main_menu = MagicMock(return_value=[])
+        self.conversation_manager._notify_clinic_about_appointment = MagicMock()
+        self.supabase_manager.get_patient_by_line_id.return_value = {"id": 1}
+        self.supabase_manager.create_appointment.return_value = 7
+        self.calendar_manager.slot_holds.confirm.return_value = True
+        
+        self.conversation_manager._confirm_appointment("user123")
+        
+        self.assertEqual(self.calendar_manager.register_appointment.call_args.args[0]["status"], "pending")
+        self.calendar_manager.enqueue_calendar_sync.assert_not_called()
 
 
 class TestCalendarManager(unittest.TestCase):
     """Testes para o gerenciador de calendário."""
     
+    # Armazenamentos em memória e consultas diretas aos provedores
+    ENV = {"EVENT_STORE_PATH": ":memory:", "CALENDAR_SYNC_MODE": "live"}
+    
     def setUp(self):
         """Configuração para cada teste."""
         # Mock para Supabase
         self.supabase_manager = MagicMock()
         
         # Inicializar gerenciador de calendário
-        self.calendar_manager = CalendarManager(self.supabase_manager)
+        with patch.dict(os.environ, self.ENV):
+            self.calendar_manager = CalendarManager(self.supabase_manager)
     
     def test_get_available_slots(self):
         """Testa a obtenção de slots disponíveis."""
         # Configurar mock para eventos existentes
         self.calendar_manager.get_events = MagicMock(return_value=[
             {
-                "start": "2025-05-01T10:00:00Z",
-                "end": "2025-05-01T10:30:00Z"
+                "start": "2025-05-01T10:00:00+09:00",
+                "end": "2025-05-01T10:30:00+09:00"
             }
         ])
         
@@ -221,6 +283,409 @@ class TestCalendarManager(unittest.TestCase):
         
         # Verificar resultado
         self.assertTrue(result)
+    
+    def test_filter_available_slots(self):
+        """Testa a remoção de slots que conflitam com eventos."""
+        all_slots = self.calendar_manager._generate_all_slots(datetime(2025, 5, 1), datetime(2025, 5, 2), 30)
+        events = [
+            {"start": "2025-05-01T10:15:00", "end": "2025-05-01T10:45:00"},
+            {"start": "2025-05-01T09:00:00", "end": "2025-05-01T09:30:00"}
+        ]
+        
+        # Testar filtro de slots
+        slots = self.calendar_manager._filter_available_slots(all_slots, events, 30)
+        times = [slot["time"] for slot in slots]
+        
+        # Verificar que os slots sobrepostos foram removidos e os vizinhos mantidos
+        self.assertNotIn("09:00", times)
+        self.assertNotIn("10:00", times)
+        self.assertNotIn("10:30", times)
+        self.assertIn("09:30", times)
+        self.assertIn("11:00", times)
+    
+    def test_find_slots_requires_full_duration(self):
+        """Testa que o motor só oferece slots em que a consulta cabe inteira."""
+        engine = self.calendar_manager.availability_engine
+        
+        # Consultas de 60 minutos em um dia com evento das 14:00 às 14:30
+        slots = engine.find_slots(
+            datetime(2025, 5, 1).date(), 1,
+            [to_clinic_minutes(datetime(2025, 5, 1, 14, 0))], [to_clinic_minutes(datetime(2025, 5, 1, 14, 30))],
+            duration_minutes=60
+        )
+        times = [slot["time"] for slot in slots]
+        
+        # Verificar grade de hora em hora, sem atravessar almoço ou evento
+        self.assertEqual(times, ["09:00", "10:00", "11:00", "13:00", "15:00", "16:00", "17:00"])
+    
+    def test_get_events_with_status_marks_slow_source(self):
+        """Testa que uma fonte lenta é ignorada e listada em stale_sources."""
+        import time
+        
+        # Configurar banco de dados mais lento que o prazo
+        self.calendar_manager.provider_timeout = 0.05
+        self.calendar_manager._get_db_appointments = MagicMock(side_effect=lambda *args: time.sleep(0.5) or [])
+        
+        # Testar obtenção de eventos
+        result = self.calendar_manager.get_events_with_status("2025-05-01")
+        
+        # Verificar resultado parcial
+        self.assertEqual(result["events"], [])
+        self.assertEqual(result["stale_sources"], ["database"])
+        self.assertTrue(result["partial"])
+    
+    def test_get_patients_by_ids_batches_and_caches(self):
+        """Testa que os pacientes são buscados em lote e reaproveitados."""
+        # Configurar busca em lote
+        self.supabase_manager.get_patients_by_ids.return_value = [
+            {"id": 1, "name": "Tanaka"},
+            {"id": 2, "name": "Silva"}
+        ]
+        
+        # Testar duas resoluções seguidas
+        patients = self.calendar_manager._get_patients_by_ids([1, 2, 1])
+        self.calendar_manager._get_patients_by_ids([2])
+        
+        # Verificar uma única consulta, sem IDs repetidos
+        self.supabase_manager.get_patients_by_ids.assert_called_once()
+        self.assertEqual(sorted(self.supabase_manager.get_patients_by_ids.call_args.args[0]), [1, 2])
+        self.supabase_manager.get_patient_by_id.assert_not_called()
+        self.assertEqual(patients[2]["name"], "Silva")
+    
+    def test_get_available_slots_multiple_resources(self):
+        """Testa que um horário continua livre enquanto houver um recurso desocupado."""
+        # Configurar clínica com duas cadeiras
+        with patch.dict(os.environ, {**self.ENV, "CLINIC_RESOURCES": json.dumps([{"id": "chair-1"}, {"id": "chair-2"}])}):
+            calendar_manager = CalendarManager(self.supabase_manager)
+        
+        appointment = {
+            "id": "1",
+            "start": "2025-05-01T10:00:00+09:00",
+            "end": "2025-05-01T10:30:00+09:00",
+            "source": "database"
+        }
+        calendar_manager.get_events_with_status = MagicMock(return_value={
+            "events": [appointment],
+            "stale_sources": [],
+            "partial": False
+        })
+        
+        # Uma cadeira ocupada às 10:00: o horário continua disponível na outra
+        slots = calendar_manager.get_available_slots_with_status("2025-05-01", with_resources=True)["slots"]
+        slot = next(slot for slot in slots if slot["time"] == "10:00")
+        self.assertEqual(slot["resources"], ["chair-2"])
+        
+        # Com as duas cadeiras ocupadas, o horário deixa de aparecer
+        calendar_manager.get_events_with_status.return_value["events"] = [appointment, {**appointment, "id": "2"}]
+        slots = calendar_manager.get_available_slots_with_status("2025-05-01")["slots"]
+        self.assertNotIn("10:00", [slot["time"] for slot in slots])
+    
+    def test_iter_free_slots_fetches_lazily(self):
+        """Testa que os próximos slots livres só consultam os dias necessários."""
+        self.calendar_manager.get_events = MagicMock(return_value=[
+            {"start": "2025-05-01T09:00:00", "end": "2025-05-01T10:00:00"}
+        ])
+        
+        # Pedir os dois próximos slots depois das 8:00 de uma quinta-feira
+        from itertools import islice
+        slots = list(islice(self.calendar_manager.iter_free_slots(datetime(2025, 5, 1, 8, 0)), 2))
+        
+        self.assertEqual([(slot["date"], slot["time"]) for slot in slots], [("2025-05-01", "10:00"), ("2025-05-01", "10:30")])
+        self.calendar_manager.get_events.assert_called_once_with("2025-05-01", "2025-05-01")
+        
+        # Um horário reservado por outro paciente é pulado; fins de semana e feriados não são consultados
+        self.calendar_manager.slot_holds.hold("2025-05-02", "09:00", "user2")
+        slot = next(self.calendar_manager.iter_free_slots(datetime(2025, 5, 1, 17, 45), resource="clinic"))
+        
+        self.assertEqual((slot["date"], slot["time"], slot["resources"]), ("2025-05-02", "09:30", ["clinic"]))
+        self.assertEqual(self.calendar_manager.get_events.call_count, 3)
+    
+    def test_calendar_outbox_creates_and_removes_event(self):
+        """Testa a entrega da fila de calendários, com nova tentativa após falha."""
+        appointment = {"id": 7, "patient_id": 1, "appointment_date": "2025-05-01", "appointment_time": "10:00", "reason": "Limpeza", "status": "confirmed"}
+        self.supabase_manager.get_appointment_by_id.side_effect = lambda appointment_id: dict(appointment)
+        self.supabase_manager.get_patients_by_ids.return_value = [{"id": 1, "name": "Taro"}]
+        self.calendar_manager.calendar_settings["google"]["enabled"] = True
+        self.calendar_manager.google_calendar = MagicMock()
+        events = self.calendar_manager.google_calendar.events.return_value
+        events.insert.return_value.execute.side_effect = [Exception("timeout"), {"id": "evt1"}]
+        
+        # O registro não chama o provedor
+        self.assertTrue(self.calendar_manager.create_calendar_event(7))
+        events.insert.assert_not_called()
+        
+        # A primeira entrega falha e fica para depois
+        self.assertEqual(self.calendar_manager.process_calendar_outbox(), 1)
+        self.assertEqual(self.calendar_manager.calendar_outbox.get_stats()["pending"], 1)
+        self.assertEqual(self.calendar_manager.process_calendar_outbox(), 0)
+        
+        # A nova tentativa usa a mesma chave de idempotência
+        self.calendar_manager.calendar_outbox._conn.execute("UPDATE calendar_outbox SET next_attempt_at = 0")
+        self.calendar_manager.process_calendar_outbox()
+        first_key, second_key = [call.kwargs["body"]["id"] for call in events.insert.call_args_list]
+        self.assertEqual(first_key, second_key)
+        self.assertEqual(self.calendar_manager.calendar_outbox.get_external_id(7, "google"), "evt1")
+        
+        # O cancelamento remove o evento vinculado
+        appointment["status"] = "cancelled"
+        self.supabase_manager.update_appointment_status.return_value = True
+        self.calendar_manager.update_appointment_status(7, "cancelled")
+        self.calendar_manager.process_calendar_outbox()
+        
+        events.delete.assert_called_once_with(calendarId="primary", eventId="evt1")
+        self.assertIsNone(self.calendar_manager.calendar_outbox.get_external_id(7, "google"))
+    
+    def test_resync_uses_google_batches(self):
+        """Testa a sincronização em massa em lotes do Google Calendar, com erro por item."""
+        appointments = [
+            {"id": index, "patient_id": 1, "appointment_date": "2025-05-01", "appointment_time": "10:00", "status": "confirmed"}
+            for index in range(60)
+        ]
+        self.supabase_manager.get_appointments_by_date_range.return_value = appointments
+        self.supabase_manager.get_appointment_by_id.side_effect = lambda appointment_id: appointments[int(appointment_id)]
+        self.supabase_manager.get_patients_by_ids.return_value = [{"id": 1, "name": "Taro"}]
+        self.calendar_manager.calendar_settings["google"]["enabled"] = True
+        self.calendar_manager.google_calendar = MagicMock()
+        events = self.calendar_manager.google_calendar.events.return_value
+        events.insert.side_effect = lambda calendarId, body: body
+        
+        # Lote falso: o item do agendamento 3 falha
+        batches = []
+        
+        class FakeBatch:
+            def __init__(self, callback):
+                self.callback = callback
+                self.items = []
+                batches.append(self)
+            
+            def add(self, request, request_id):
+                self.items.append((request_id, request))
+            
+            def execute(self):
+                for request_id, body in self.items:
+                    error = Exception("quota") if body["id"] == idempotency_key("google", 3) else None
+                    self.callback(request_id, None if error else body, error)
+        
+        self.calendar_manager.google_calendar.new_batch_http_request.side_effect = FakeBatch
+        
+        # Testar sincronização do mês
+        self.assertEqual(self.calendar_manager.resync_calendar_events("2025-05-01", "2025-05-31"), 60)
+        self.calendar_manager.process_calendar_outbox()
+        self.calendar_manager.process_calendar_outbox()
+        
+        # 60 inserções em dois lotes (limite de 50), sem requisições individuais
+        self.assertEqual([len(batch.items) for batch in batches], [50, 10])
+        events.insert.return_value.execute.assert_not_called()
+        
+        stats = self.calendar_manager.calendar_outbox.get_stats()
+        self.assertEqual((stats["done"], stats["pending"]), (59, 1))
+        self.assertIsNone(self.calendar_manager.calendar_outbox.get_external_id(3, "google"))
+        self.assertEqual(self.calendar_manager.calendar_outbox.get_external_id(4, "google"), idempotency_key("google", 4))
+    
+    def test_events_normalized_to_clinic_time(self):
+        """Testa que eventos de provedores e do banco são comparados no horário da clínica."""
+        # Outlook devolve UTC por padrão: 01:00 UTC é 10:00 em Tóquio
+        outlook_event = format_outlook_event({
+            "id": "1",
+            "subject": "Reunião",
+            "start": {"dateTime": "2025-05-01T01:00:00.0000000", "timeZone": "UTC"},
+            "end": {"dateTime": "2025-05-01T01:30:00.0000000", "timeZone": "UTC"}
+        })
+        self.assertEqual(outlook_event["start_min"], to_clinic_minutes(datetime(2025, 5, 1, 10, 0)))
+        
+        # Agendamentos do banco estão no horário da clínica, independente do servidor
+        db_event = self.calendar_manager._format_db_appointment(
+            {"id": 2, "patient_id": 1, "appointment_date": "2025-05-01", "appointment_time": "11:00"}, None
+        )
+        self.assertEqual(db_event["start"], "2025-05-01T11:00:00+09:00")
+        
+        all_slots = self.calendar_manager._generate_all_slots(datetime(2025, 5, 1), datetime(2025, 5, 2), 30)
+        times = [slot["time"] for slot in self.calendar_manager._filter_available_slots(all_slots, [outlook_event, db_event], 30)]
+        self.assertNotIn("10:00", times)
+        self.assertNotIn("11:00", times)
+        self.assertIn("10:30", times)
+    
+    def test_availability_summary_counts_and_invalidation(self):
+        """Testa o resumo de horários livres por dia e período, com cache e invalidação."""
+        self.calendar_manager.get_events_with_status = MagicMock(return_value={
+            "events": [{"id": "1", "start": "2025-05-08T10:00:00+09:00", "end": "2025-05-08T12:00:00+09:00"}],
+            "stale_sources": [],
+            "partial": False
+        })
+        
+        summary = self.calendar_manager.get_availability_summary("2025-05-07", 2)
+        wednesday, thursday = summary
+        
+        # Uma única busca de eventos cobre os dois dias
+        self.calendar_manager.get_events_with_status.assert_called_once_with("2025-05-07", "2025-05-08")
+        self.assertEqual(wednesday["morning"] - thursday["morning"], 4)
+        self.assertEqual(wednesday["afternoon"], thursday["afternoon"])
+        self.assertEqual(thursday["free"], len(self.calendar_manager.get_free_times("2025-05-08")))
+        
+        # Dias em cache não são recalculados; um agendamento invalida o dia
+        self.calendar_manager.get_availability_summary("2025-05-07", 2)
+        self.assertEqual(self.calendar_manager.get_events_with_status.call_count, 1)
+        self.calendar_manager.availability_index.invalidate("2025-05-08")
+        self.calendar_manager.get_availability_summary("2025-05-07", 2)
+        self.calendar_manager.get_events_with_status.assert_called_with("2025-05-08", "2025-05-08")
+    
+    def test_full_mode_serves_events_from_default_store_file(self):
+        """Testa que o modo full usa o arquivo padrão e responde do armazenamento local."""
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = {"LINE_BOT_DATA_DIR": data_dir, "CALENDAR_SYNC_MODE": "full"}
+            with patch.dict(os.environ, env):
+                os.environ.pop("EVENT_STORE_PATH", None)
+                calendar_manager = CalendarManager(self.supabase_manager)
+            
+            # Parar a sincronização em segundo plano para controlar as chamadas
+            calendar_manager.stop_background_sync()
+            calendar_manager._sync_thread.join()
+            
+            self.assertEqual(calendar_manager.event_store.path, os.path.join(data_dir, "line_bot.db"))
+            
+            # Sincronizar o banco de dados com um agendamento
+            day = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+            appointment = {"id": "1", "start": f"{day}T10:00:00+09:00", "end": f"{day}T10:30:00+09:00", "source": "database"}
+            calendar_manager._get_db_appointments = MagicMock(return_value=[appointment])
+            calendar_manager.sync_event_store()
+            
+            # A consulta é respondida pelo armazenamento, sem nova busca no banco
+            result = calendar_manager.get_events_with_status(day)
+            
+            self.assertEqual([event["id"] for event in result["events"]], ["1"])
+            calendar_manager._get_db_appointments.assert_called_once()
+    
+    def test_outbox_defaults_to_store_file_and_is_purged(self):
+        """Testa que a fila usa o arquivo compartilhado e é limpa periodicamente pelos workers."""
+        with tempfile.TemporaryDirectory() as data_dir:
+            with patch.dict(os.environ, {"LINE_BOT_DATA_DIR": data_dir, "CALENDAR_SYNC_MODE": "live"}):
+                os.environ.pop("EVENT_STORE_PATH", None)
+                os.environ.pop("CALENDAR_OUTBOX_PATH", None)
+                calendar_manager = CalendarManager(self.supabase_manager)
+            
+            self.assertEqual(calendar_manager.calendar_outbox.path, os.path.join(data_dir, "line_bot.db"))
+            
+            # A limpeza roda no primeiro ciclo e depois só após o intervalo
+            calendar_manager.calendar_outbox.purge = MagicMock()
+            calendar_manager._purge_outbox_if_due()
+            calendar_manager._purge_outbox_if_due()
+            
+            calendar_manager.calendar_outbox.purge.assert_called_once_with(calendar_manager.outbox_retention)
+    
+    def test_sync_invalidates_only_changed_dates(self):
+        """Testa que a sincronização e a mudança de status invalidam só as datas afetadas."""
+        day1, day2, day3 = [(datetime.now() + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in (1, 2, 3)]
+        appointments = {
+            "1": {"id": "1", "start": f"{day1}T10:00:00+09:00", "end": f"{day1}T10:30:00+09:00", "source": "database"},
+            "2": {"id": "2", "start": f"{day2}T10:00:00+09:00", "end": f"{day2}T10:30:00+09:00", "source": "database"}
+        }
+        self.calendar_manager._get_db_appointments = MagicMock(side_effect=lambda start_date, end_date: list(appointments.values()))
+        self.calendar_manager.availability_index.invalidate = MagicMock()
+        invalidated = lambda: sorted(call.args[0] for call in self.calendar_manager.availability_index.invalidate.call_args_list)
+        
+        # A primeira sincronização marca as datas com eventos
+        self.calendar_manager.sync_event_store()
+        self.assertEqual(invalidated(), [day1, day2])
+        
+        # Sem alterações, nenhuma data é invalidada
+        self.calendar_manager.availability_index.invalidate.reset_mock()
+        self.calendar_manager.sync_event_store()
+        self.assertEqual(invalidated(), [])
+        
+        # Um agendamento remarcado invalida a data antiga e a nova
+        appointments["2"] = {"id": "2", "start": f"{day3}T10:00:00+09:00", "end": f"{day3}T10:30:00+09:00", "source": "database"}
+        self.calendar_manager.sync_event_store()
+        self.assertEqual(invalidated(), [day2, day3])
+        
+        # A mudança de status invalida só a data do agendamento
+        self.calendar_manager.availability_index.invalidate.reset_mock()
+        self.supabase_manager.update_appointment_status.return_value = True
+        self.supabase_manager.get_appointment_by_id.return_value = {"id": 1, "appointment_date": day1, "appointment_time": "10:00"}
+        self.calendar_manager.update_appointment_status(1, "cancelled")
+        self.calendar_manager.availability_index.invalidate.assert_called_once_with(day1)
+    
+    def test_report_rollups_are_shared_with_reporting_manager(self):
+        """Testa que o calendário e os relatórios usam as mesmas contagens, na clínica do agendamento."""
+        rollups = ReportRollupStore()
+        with patch.dict(os.environ, self.ENV):
+            calendar_manager = CalendarManager(self.supabase_manager, report_rollups=rollups)
+        reporting_manager = ReportingManager(self.supabase_manager, rollups=calendar_manager.report_rollups)
+        
+        appointment = {"id": 7, "patient_id": 1, "clinic_id": 5, "appointment_date": "2025-05-01", "appointment_time": "10:00", "status": "confirmed"}
+        self.supabase_manager.get_patients_by_ids.return_value = [{"id": 1, "name": "Taro", "preferred_language": "ja"}]
+        self.supabase_manager.get_appointment_by_id.return_value = appointment
+        self.supabase_manager.update_appointment_status.return_value = True
+        
+        # O cancelamento move a contagem dentro da clínica 5
+        calendar_manager.register_appointment(appointment)
+        calendar_manager.update_appointment_status(7, "cancelled")
+        
+        self.assertIs(reporting_manager.rollups, rollups)
+        self.assertEqual(rollups.appointment_totals("2025-05-01", "2025-05-01", 5)["by_status"], {"cancelled": 1})
+        self.assertEqual(rollups.appointment_totals("2025-05-01", "2025-05-01")["by_status"], {})
+    
+    def test_availability_refresh_skips_dates_invalidated_meanwhile(self):
+        """Testa que uma atualização não regrava datas invalidadas durante o cálculo e é compartilhada."""
+        import threading
+        import time
+        index = self.calendar_manager.availability_index
+        started, release = threading.Event(), threading.Event()
+        free = {"date": "2025-05-08", "time": "10:00", "resources": ["clinic"]}
+        
+        def slots(start_date, end_date, slot_minutes, with_resources=False):
+            started.set()
+            release.wait(5)
+            return {"slots": [free], "stale_sources": [], "partial": False}
+        
+        self.calendar_manager.get_available_slots_with_status = MagicMock(side_effect=slots)
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(index.get_free_times("2025-05-08"))) for _ in range(3)]
+        workers[0].start()
+        started.wait(5)
+        for worker in workers[1:]:
+            worker.start()
+        time.sleep(0.2)
+        
+        # Um agendamento invalida a data enquanto a atualização calcula
+        index.invalidate("2025-05-08")
+        release.set()
+        for worker in workers:
+            worker.join(5)
+        
+        # Os pedidos anteriores à invalidação compartilham uma atualização; a data não fica em cache
+        self.assertEqual(results, [["10:00"]] * 3)
+        self.assertEqual(self.calendar_manager.get_available_slots_with_status.call_count, 1)
+        self.assertNotIn("2025-05-08", index._bitmaps)
+        
+        # O próximo pedido recalcula a data
+        index.get_free_times("2025-05-08")
+        self.assertEqual(self.calendar_manager.get_available_slots_with_status.call_count, 2)
+    
+    def test_availability_index_keeps_off_grid_slot_starts(self):
+        """Testa horários livres e resumo com um calendário que começa fora da grade de 30 minutos."""
+        hours = {"start": "09:15", "end": "18:15", "lunch_start": "12:15", "lunch_end": "13:15"}
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"weekly": {str(weekday): hours for weekday in range(5)}, "holidays": "none"}, f)
+        self.addCleanup(os.remove, f.name)
+        
+        with patch.dict(os.environ, dict(self.ENV, CLINIC_SCHEDULE_FILE=f.name)):
+            calendar_manager = CalendarManager(self.supabase_manager)
+        calendar_manager.get_events_with_status = MagicMock(return_value={
+            "events": [{"id": "1", "start": "2026-10-20T09:15:00+09:00", "end": "2026-10-20T09:45:00+09:00"}],
+            "stale_sources": [],
+            "partial": False
+        })
+        
+        starts = [format_minutes(minutes) for minutes in calendar_manager.schedule.slot_starts(date(2026, 10, 20))]
+        free_times = calendar_manager.get_free_times("2026-10-20")
+        
+        # Só o horário ocupado fica de fora; os demais inícios (09:45, 13:15...) são mantidos
+        self.assertEqual(free_times, starts[1:])
+        self.assertIn("13:15", free_times)
+        summary = calendar_manager.get_availability_summary("2026-10-20", 1)[0]
+        self.assertEqual(summary["free"], len(starts) - 1)
+        self.assertEqual(summary["morning"], len([start for start in starts[1:] if start < "12:00"]))
+        self.assertTrue(calendar_manager.hold_slot("2026-10-20", "13:15", "user1"))
 
 
 class TestReportingManager(unittest.TestCase):
@@ -231,8 +696,8 @@ class TestReportingManager(unittest.TestCase):
         # Mock para Supabase
         self.supabase_manager = MagicMock()
         
-        # Inicializar gerenciador de relatórios
-        self.reporting_manager = ReportingManager(self.supabase_manager)
+        # Inicializar gerenciador de relatórios com contagens em memória
+        self.reporting_manager = ReportingManager(self.supabase_manager, rollups=ReportRollupStore())
     
     def test_generate_appointment_report(self):
         """Testa a geração de relatório de agendamentos."""
@@ -303,6 +768,152 @@ class TestReportingManager(unittest.TestCase):
         self.assertTrue(summary["success"])
         self.assertEqual(summary["appointments"]["total"], 1)
         self.assertEqual(summary["patients"]["total"], 1)
+    
+    def test_report_frames_are_typed_and_refreshed_incrementally(self):
+        """Testa o cache tipado de agendamentos e a atualização por updated_at."""
+        self.supabase_manager.get_appointments_by_date_range.return_value = [
+            {"id": 1, "patient_id": 101, "appointment_date": "2025-05-01", "appointment_time": "10:00", "status": "confirmed", "updated_at": "2025-04-20T09:00:00+00:00"},
+            {"id": 2, "patient_id": 102, "appointment_date": "2025-05-02", "appointment_time": "14:30", "status": "pending", "updated_at": "2025-04-21T09:00:00+00:00"}
+        ]
+        frames = self.reporting_manager.frames
+        
+        df = frames.appointments("2025-05-01", "2025-05-31")
+        self.assertEqual(str(df["id"].dtype), "int32")
+        self.assertEqual(str(df["status"].dtype), "category")
+        self.assertEqual(df.loc[1, "start"], datetime(2025, 5, 2, 14, 30))
+        self.assertEqual(df.loc[1, "hour"], 14)
+        
+        # Períodos já cobertos não consultam o banco
+        self.assertEqual(len(frames.appointments("2025-05-02", "2025-05-10")), 1)
+        self.supabase_manager.get_appointments_by_date_range.assert_called_once()
+        
+        # Após o intervalo, só as linhas alteradas são buscadas
+        frames.refresh_interval = 0
+        self.supabase_manager.get_appointments_updated_since.return_value = [
+            {"id": 2, "patient_id": 102, "appointment_date": "2025-05-02", "appointment_time": "14:30", "status": "cancelled", "updated_at": "2025-04-22T09:00:00+00:00"}
+        ]
+        df = frames.appointments("2025-05-01", "2025-05-31")
+        
+        self.supabase_manager.get_appointments_updated_since.assert_called_once_with("2025-04-21T09:00:00+00:00", None)
+        self.supabase_manager.get_appointments_by_date_range.assert_called_once()
+        self.assertEqual(len(df), 2)
+        self.assertEqual(self.reporting_manager._count_categories(df["status"]), {"cancelled": 1, "confirmed": 1})
+    
+    def test_report_rollups_are_updated_incrementally(self):
+        """Testa as contagens diárias pré-agregadas dos relatórios de agendamentos e uso."""
+        self.supabase_manager.get_appointments_by_date_range.return_value = [
+            {"id": 1, "patient_id": 101, "appointment_date": "2025-05-01", "appointment_time": "10:00", "status": "confirmed", "language": "ja"},
+            {"id": 2, "patient_id": 102, "appointment_date": "2025-05-02", "appointment_time": "14:30", "status": "pending", "language": "en"}
+        ]
+        self.supabase_manager.get_usage_logs.return_value = [
+            {"line_user_id": "U1", "timestamp": "2025-05-01T01:00:00+00:00", "interaction_type": "message", "language": "ja", "conversation_duration": 30},
+            {"line_user_id": "U1", "timestamp": "2025-05-01T02:00:00+00:00", "interaction_type": "appointment", "language": "ja", "conversation_duration": 90}
+        ]
+        
+        self.reporting_manager.generate_appointment_report("2025-05-01", "2025-05-31")
+        
+        # Gravações atualizam as contagens sem consultar as linhas brutas de novo
+        self.reporting_manager.rollups.record_appointment({"id": 2, "appointment_date": "2025-05-02", "appointment_time": "14:30", "status": "cancelled"})
+        self.reporting_manager.rollups.record_appointment({"id": 3, "appointment_date": "2025-05-05", "appointment_time": "09:00", "status": "confirmed", "language": "ja"})
+        report = self.reporting_manager.generate_appointment_report("2025-05-01", "2025-05-31")
+        
+        self.supabase_manager.get_appointments_by_date_range.assert_called_once_with("2025-05-01", "2025-05-31", None)
+        self.assertEqual(report["summary"]["total_appointments"], 3)
+        self.assertEqual(report["distributions"]["by_status"], {"cancelled": 1, "confirmed": 2})
+        self.assertEqual(report["distributions"]["by_day"]["Monday"], 1)
+        self.assertEqual(self.reporting_manager.rollups.appointment_totals("2025-05-01", "2025-05-31")["by_language"], {"en": 1, "ja": 2})
+        
+        # Logs de uso são contados no horário da clínica e reagregados após rollup_max_age
+        self.reporting_manager.generate_usage_report("2025-05-01", "2025-05-31")
+        self.supabase_manager.get_usage_logs.return_value.append({"line_user_id": "U2", "timestamp": "2025-05-01T03:00:00+00:00", "interaction_type": "message", "language": "en"})
+        self.reporting_manager.rollup_max_age = 0
+        report = self.reporting_manager.generate_usage_report("2025-05-01", "2025-05-31")
+        
+        self.assertEqual(report["summary"]["total_interactions"], 3)
+        self.assertEqual(report["summary"]["unique_users"], 2)
+        self.assertEqual(report["summary"]["avg_conversation_time"], 60)
+        self.assertEqual(report["distributions"]["by_hour"], {10: 1, 11: 1, 12: 1})
+    
+    def test_import_defers_heavy_modules(self):
+        """Testa que importar e criar o ReportingManager não carrega pandas, matplotlib nem seaborn."""
+        line_bot_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "line_bot")
+        code = (
+            f"import sys; sys.path.insert(0, {line_bot_dir!r})\n"
+            "from reporting_manager import ReportingManager\n"
+            "ReportingManager(object())\n"
+            "print(','.join(name for name in ('pandas', 'matplotlib', 'seaborn') if name in sys.modules))\n"
+        )
+        env = dict(os.environ, REPORT_ROLLUP_PATH=":memory:")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env).stdout
+        self.assertEqual(output.strip(), "")
+    
+    def test_graphs_keep_png_bytes_for_exports(self):
+        """Testa que os gráficos dos relatórios mantêm os bytes PNG sem perder o formato base64."""
+        future = MagicMock()
+        future.result.return_value = b"\x89PNG-dados"
+        graphs = self.reporting_manager._resolve_graphs({"por_dia": future})
+        
+        self.assertEqual(graphs["por_dia"], "data:image/png;base64,iVBORy1kYWRvcw==")
+        self.assertEqual(json.loads(json.dumps(graphs))["por_dia"], graphs["por_dia"])
+        self.assertEqual(chart_png(graphs["por_dia"]), b"\x89PNG-dados")
+        self.assertEqual(chart_png(str(graphs["por_dia"])), b"\x89PNG-dados")
+        
+        # Formatos desconhecidos não geram documento
+        self.assertIsNone(self.reporting_manager.export_report("appointment", {"success": True}, "docx"))
+    
+    def test_report_frames_full_reload_drops_deleted_rows(self):
+        """Testa que a recarga completa periódica descarta agendamentos e pacientes apagados."""
+        self.supabase_manager.get_appointments_by_date_range.return_value = [
+            {"id": 1, "patient_id": 101, "appointment_date": "2025-05-01", "appointment_time": "10:00", "status": "confirmed", "updated_at": "2025-04-20T09:00:00+00:00"},
+            {"id": 2, "patient_id": 102, "appointment_date": "2025-05-02", "appointment_time": "14:30", "status": "pending", "updated_at": "2025-04-21T09:00:00+00:00"}
+        ]
+        self.supabase_manager.get_all_patients.return_value = [
+            {"id": 101, "name": "Taro", "preferred_language": "ja"},
+            {"id": 102, "name": "John", "preferred_language": "en"}
+        ]
+        self.supabase_manager.get_appointments_updated_since.return_value = []
+        self.supabase_manager.get_patients_updated_since.return_value = []
+        frames = self.reporting_manager.frames
+        frames.appointments("2025-05-01", "2025-05-31")
+        frames.patients()
+        
+        # O agendamento 2 e o paciente 102 são apagados no banco
+        self.supabase_manager.get_appointments_by_date_range.return_value = self.supabase_manager.get_appointments_by_date_range.return_value[:1]
+        self.supabase_manager.get_all_patients.return_value = self.supabase_manager.get_all_patients.return_value[:1]
+        frames.refresh_interval = 0
+        
+        # A busca incremental não vê a remoção
+        self.assertEqual(len(frames.appointments("2025-05-01", "2025-05-31")), 2)
+        
+        # A recarga completa descarta as linhas apagadas
+        frames.full_reload_interval = 0
+        self.assertEqual(list(frames.appointments("2025-05-01", "2025-05-31")["id"]), [1])
+        self.assertEqual(list(frames.patients()["id"]), [101])
+        self.assertEqual(self.supabase_manager.get_appointments_by_date_range.call_count, 2)
+    
+    def test_report_frames_refresh_keeps_only_covered_dates(self):
+        """Testa que a atualização incremental ignora datas fora do período e remove agendamentos que saíram dele."""
+        self.supabase_manager.get_appointments_by_date_range.return_value = [
+            {"id": 1, "patient_id": 101, "appointment_date": "2026-10-05", "appointment_time": "10:00", "status": "confirmed", "updated_at": "2026-09-20T09:00:00+00:00"},
+            {"id": 2, "patient_id": 102, "appointment_date": "2026-10-06", "appointment_time": "14:30", "status": "pending", "updated_at": "2026-09-21T09:00:00+00:00"}
+        ]
+        frames = self.reporting_manager.frames
+        frames.appointments("2026-10-01", "2026-10-31")
+        
+        # Um agendamento de dezembro é alterado e o 2 é remarcado para novembro
+        frames.refresh_interval = 0
+        self.supabase_manager.get_appointments_updated_since.return_value = [
+            {"id": 3, "patient_id": 103, "appointment_date": "2026-12-05", "appointment_time": "09:00", "status": "confirmed", "updated_at": "2026-09-22T09:00:00+00:00"},
+            {"id": 2, "patient_id": 102, "appointment_date": "2026-11-02", "appointment_time": "14:30", "status": "pending", "updated_at": "2026-09-23T09:00:00+00:00"}
+        ]
+        df = frames.appointments("2026-10-01", "2026-10-31")
+        
+        self.assertEqual(list(df["id"]), [1])
+        
+        # As linhas fora do período também avançam o updated_at da próxima busca
+        self.supabase_manager.get_appointments_updated_since.return_value = []
+        frames.appointments("2026-10-01", "2026-10-31")
+        self.supabase_manager.get_appointments_updated_since.assert_called_with("2026-09-23T09:00:00+00:00", None)
 
 
 class TestLineManager(unittest.TestCase):
@@ -444,5 +1055,596 @@ class TestSupabaseManager(unittest.TestCase):
         self.assertEqual(result, 1)
 
 
+class TestICalFeed(unittest.TestCase):
+    """Testes para o cache e a leitura de feeds iCal."""
+    
+    FEED = (
+        b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+        b"BEGIN:VEVENT\r\nUID:1\r\nSUMMARY:Consulta\r\n"
+        b"DTSTART:20250501T010000Z\r\nDTEND:20250501T013000Z\r\nEND:VEVENT\r\n"
+        b"END:VCALENDAR\r\n"
+    )
+    
+    def test_refresh_revalidates_with_etag(self):
+        """Testa que o feed só é interpretado novamente quando muda."""
+        # Configurar sessão mock: primeira resposta 200, segunda 304
+        first = MagicMock(status_code=200, content=self.FEED, headers={"ETag": '"v1"', "Content-Length": str(len(self.FEED))})
+        second = MagicMock(status_code=304, headers={})
+        session = MagicMock()
+        session.get.side_effect = [first, second]
+        
+        feed = ICalFeedCache("https://example.com/feed.ics", session=session)
+        
+        # Testar carga inicial e revalidação
+        self.assertTrue(feed.refresh())
+        self.assertFalse(feed.refresh())
+        
+        # Verificar requisição condicional e versão mantida
+        self.assertEqual(session.get.call_args.kwargs["headers"]["If-None-Match"], '"v1"')
+        self.assertEqual(feed.version, 1)
+    
+    def test_event_index_expands_recurrence(self):
+        """Testa a expansão de eventos recorrentes com exceções."""
+        import icalendar
+        
+        calendar = icalendar.Calendar.from_ical(
+            b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+            b"BEGIN:VEVENT\r\nUID:weekly\r\nSUMMARY:Reuniao\r\n"
+            b"DTSTART:20250505T010000Z\r\nDTEND:20250505T020000Z\r\n"
+            b"RRULE:FREQ=WEEKLY;COUNT=4\r\nEXDATE:20250512T010000Z\r\nEND:VEVENT\r\n"
+            b"END:VCALENDAR\r\n"
+        )
+        
+        index = ICalEventIndex()
+        index.build(calendar, 1, datetime(2025, 5, 1, tzinfo=timezone.utc))
+        
+        # Testar consulta do mês
+        occurrences = index.query(datetime(2025, 5, 1, tzinfo=timezone.utc), datetime(2025, 6, 1, tzinfo=timezone.utc))
+        
+        # Verificar ocorrências sem a data excluída
+        self.assertEqual([start.day for start, _, _, _ in occurrences], [5, 19, 26])
+    
+    def test_iter_vevents_streams_window(self):
+        """Testa a leitura em blocos com linhas dobradas e filtro de janela."""
+        feed = (
+            b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+            b"BEGIN:VEVENT\r\nUID:old\r\nSUMMARY:Antigo\r\n"
+            b"DTSTART:20200101T010000Z\r\nDTEND:20200101T013000Z\r\nEND:VEVENT\r\n"
+            b"BEGIN:VEVENT\r\nUID:new\r\nSUMMARY:Consulta com t\xc3\xadtulo\r\n  dobrado\r\n"
+            b"DTSTART:20250501T010000Z\r\nDTEND:20250501T013000Z\r\nEND:VEVENT\r\n"
+            b"END:VCALENDAR\r\n"
+        )
+        
+        # Dividir o feed em blocos pequenos, cortando linhas e caracteres
+        chunks = [feed[i:i + 7] for i in range(0, len(feed), 7)]
+        
+        events = list(iter_vevents(chunks, datetime(2025, 4, 1, tzinfo=timezone.utc), datetime(2025, 6, 1, tzinfo=timezone.utc)))
+        
+        # Verificar que apenas o evento da janela foi lido, com o título completo
+        self.assertEqual([str(event["UID"]) for event in events], ["new"])
+        self.assertEqual(str(events[0]["SUMMARY"]), "Consulta com título dobrado")
+    
+    def test_expand_all_day_rrule_with_date_until(self):
+        """Testa séries de dia inteiro com UNTIL só com a data."""
+        import icalendar
+        from line_bot.ical_feed import expand_ical_events
+        
+        calendar = icalendar.Calendar.from_ical(
+            b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+            b"BEGIN:VEVENT\r\nUID:allday\r\nSUMMARY:Feriado interno\r\n"
+            b"DTSTART;VALUE=DATE:20250505\r\nDTEND;VALUE=DATE:20250506\r\n"
+            b"RRULE:FREQ=WEEKLY;UNTIL=20250519\r\nEND:VEVENT\r\n"
+            b"END:VCALENDAR\r\n"
+        )
+        
+        window_start = datetime(2025, 5, 1, tzinfo=timezone.utc)
+        window_end = datetime(2025, 6, 30, tzinfo=timezone.utc)
+        occurrences = expand_ical_events(calendar, window_start, window_end)
+        
+        # O dia do UNTIL é incluído e a série não é descartada
+        days = [occurrence[0].date().isoformat() for occurrence in occurrences]
+        self.assertEqual(days, ["2025-05-05", "2025-05-12", "2025-05-19"])
+    
+    def test_range_outside_streamed_window_forces_full_download(self):
+        """Testa que um intervalo fora da janela guardada ignora o ETag."""
+        # Respostas sem Content-Length são lidas em blocos e filtradas pela janela
+        first = MagicMock(status_code=200, headers={"ETag": '"v1"'})
+        first.iter_content.return_value = [self.FEED]
+        second = MagicMock(status_code=304, headers={})
+        third = MagicMock(status_code=200, headers={"ETag": '"v1"'})
+        third.iter_content.return_value = [self.FEED]
+        session = MagicMock()
+        session.get.side_effect = [first, second, third]
+        
+        feed = ICalFeedCache("https://example.com/feed.ics", session=session, future_days=30)
+        feed.get_calendar()
+        
+        # Dentro da janela, a revalidação continua condicional
+        self.assertFalse(feed.refresh())
+        self.assertEqual(session.get.call_args.kwargs["headers"]["If-None-Match"], '"v1"')
+        
+        # Fora da janela, o feed é baixado inteiro sem cabeçalhos condicionais
+        far = datetime.now(timezone.utc) + timedelta(days=90)
+        feed.get_calendar(far, far + timedelta(hours=1))
+        
+        self.assertEqual(session.get.call_count, 3)
+        self.assertEqual(session.get.call_args.kwargs["headers"], {})
+        self.assertTrue(feed.covers(far, far + timedelta(hours=1)))
+        self.assertEqual(feed.version, 2)
+    
+    def test_iter_vevents_keeps_duration_only_events(self):
+        """Testa que eventos só com DURATION que alcançam a janela são mantidos."""
+        feed = (
+            b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+            b"BEGIN:VEVENT\r\nUID:long\r\nSUMMARY:Reforma\r\n"
+            b"DTSTART:20250325T010000Z\r\nDURATION:P10D\r\nEND:VEVENT\r\n"
+            b"END:VCALENDAR\r\n"
+        )
+        
+        events = list(iter_vevents([feed], datetime(2025, 4, 1, tzinfo=timezone.utc), datetime(2025, 6, 1, tzinfo=timezone.utc)))
+        
+        self.assertEqual([str(event["UID"]) for event in events], ["long"])
+
+
+class TestCalendarSync(unittest.TestCase):
+    """Testes para a sincronização incremental de calendários."""
+    
+    def setUp(self):
+        """Configuração para cada teste."""
+        self.store = EventStore()
+        self.service = MagicMock()
+        self.syncer = GoogleCalendarSyncer(self.service, "primary", self.store)
+    
+    def test_google_sync_applies_changes(self):
+        """Testa a sincronização completa seguida de uma incremental."""
+        start = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=1, minute=0, second=0, microsecond=0)
+        event = {
+            "id": "evt1",
+            "summary": "Consulta",
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": (start + timedelta(minutes=30)).isoformat()}
+        }
+        
+        # Configurar respostas: carga completa e depois um cancelamento
+        self.service.events.return_value.list.return_value.execute.side_effect = [
+            {"items": [event], "nextSyncToken": "token1"},
+            {"items": [{"id": "evt1", "status": "cancelled"}], "nextSyncToken": "token2"}
+        ]
+        
+        # Testar carga completa
+        self.syncer.sync()
+        self.assertEqual(len(self.store.query(start, start + timedelta(hours=1))), 1)
+        
+        # Testar sincronização incremental
+        self.syncer.sync()
+        
+        # Verificar uso do syncToken e remoção do evento
+        self.assertEqual(self.service.events.return_value.list.call_args.kwargs["syncToken"], "token1")
+        self.assertEqual(self.store.query(start, start + timedelta(hours=1)), [])
+        self.assertEqual(self.syncer.sync_token, "token2")
+    
+    def test_event_store_range_query(self):
+        """Testa a consulta por intervalo no armazenamento local."""
+        self.store.upsert("database", {"id": "1", "start": "2025-05-01T10:00:00Z", "end": "2025-05-01T10:30:00Z"})
+        self.store.upsert("database", {"id": "2", "start": "2025-05-02T10:00:00Z", "end": "2025-05-02T10:30:00Z"})
+        self.store.upsert("google", {"id": "3", "start": "2025-04-30T22:00:00Z", "end": "2025-05-01T02:00:00Z"})
+        
+        # Testar consulta de um dia
+        events = self.store.query(datetime(2025, 5, 1, tzinfo=timezone.utc), datetime(2025, 5, 2, tzinfo=timezone.utc))
+        
+        # Verificar eventos do dia, incluindo o que começou na véspera
+        self.assertEqual([event["id"] for event in events], ["3", "1"])
+        
+        # Verificar remoção
+        self.store.delete("database", "1")
+        events = self.store.query(datetime(2025, 5, 1, tzinfo=timezone.utc), datetime(2025, 5, 2, tzinfo=timezone.utc))
+        self.assertEqual([event["id"] for event in events], ["3"])
+    
+    def test_google_sync_token_gone_triggers_full_resync(self):
+        """Testa syncToken, resposta 410 GONE e nova sincronização completa."""
+        start = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=1, minute=0, second=0, microsecond=0)
+        
+        def make_event(event_id):
+            return {
+                "id": event_id,
+                "summary": "Consulta",
+                "start": {"dateTime": start.isoformat()},
+                "end": {"dateTime": (start + timedelta(minutes=30)).isoformat()}
+            }
+        
+        # Servidor falso: tokens válidos e eventos atuais do calendário
+        server = {"events": [make_event("evt1")], "tokens": set(), "issued": 0}
+        requests_seen = []
+        
+        def respond(pageToken=None, **params):
+            requests_seen.append("token" if "syncToken" in params else "full")
+            request = MagicMock()
+            
+            if "syncToken" in params and params["syncToken"] not in server["tokens"]:
+                error = Exception("410 Gone")
+                error.resp = MagicMock(status=410)
+                request.execute.side_effect = error
+                return request
+            
+            server["issued"] += 1
+            token = f"token{server['issued']}"
+            server["tokens"].add(token)
+            items = [] if "syncToken" in params else server["events"]
+            request.execute.return_value = {"items": items, "nextSyncToken": token}
+            return request
+        
+        self.service.events.return_value.list.side_effect = respond
+        
+        # Carga completa e uma sincronização incremental sem alterações
+        self.syncer.sync()
+        self.syncer.sync()
+        self.assertEqual(self.syncer.sync_token, "token2")
+        
+        # O servidor descarta os tokens e o evento é trocado enquanto isso
+        server["tokens"].clear()
+        server["events"] = [make_event("evt2")]
+        self.syncer.sync()
+        
+        # Verificar a sequência de requisições e o armazenamento refeito
+        self.assertEqual(requests_seen, ["full", "token", "token", "full"])
+        self.assertEqual(self.syncer.sync_token, "token3")
+        self.assertEqual([event["id"] for event in self.store.query(start, start + timedelta(hours=1))], ["evt2"])
+    
+    def test_outlook_delta_link_cycle(self):
+        """Testa nextLink, deltaLink, remoções e deltaLink expirado contra um Graph falso."""
+        import requests
+        
+        start = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=1, minute=0, second=0, microsecond=0)
+        base_url = "https://graph.example.com/v1.0"
+        
+        def make_event(event_id):
+            return {
+                "id": event_id,
+                "subject": "Consulta",
+                "start": {"dateTime": start.strftime("%Y-%m-%dT%H:%M:%S"), "timeZone": "UTC"},
+                "end": {"dateTime": (start + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M:%S"), "timeZone": "UTC"}
+            }
+        
+        # Respostas HTTP do Graph falso por URL
+        pages = {
+            f"{base_url}/delta?page=2": (200, {"value": [make_event("evt2")], "@odata.deltaLink": f"{base_url}/delta?token=d1"}),
+            f"{base_url}/delta?token=d1": (200, {"value": [{"id": "evt1", "@removed": {"reason": "deleted"}}], "@odata.deltaLink": f"{base_url}/delta?token=d2"}),
+            f"{base_url}/delta?token=d2": (410, {"error": {"code": "syncStateNotFound"}})
+        }
+        urls_seen = []
+        
+        def respond(method, url, **kwargs):
+            urls_seen.append(url)
+            if url.startswith(f"{base_url}/me/calendarView/delta?startDateTime="):
+                status, body = 200, {"value": [make_event("evt1")], "@odata.nextLink": f"{base_url}/delta?page=2"}
+            else:
+                status, body = pages[url]
+            
+            response = requests.Response()
+            response.status_code = status
+            response.url = url
+            response._content = json.dumps(body).encode("utf-8")
+            return response
+        
+        app = MagicMock()
+        app.acquire_token_for_client.return_value = {"access_token": "token", "expires_in": 3600}
+        client = OutlookGraphClient(app, ["scope"], base_url=base_url)
+        client.session = MagicMock()
+        client.session.request.side_effect = respond
+        
+        syncer = OutlookCalendarSyncer(client.get_json, self.store, base_url=base_url)
+        window = (start, start + timedelta(hours=1))
+        
+        # Carga completa em duas páginas
+        self.assertEqual(syncer.sync(), 2)
+        self.assertEqual(syncer.delta_link, f"{base_url}/delta?token=d1")
+        self.assertEqual(sorted(event["id"] for event in self.store.query(*window)), ["evt1", "evt2"])
+        
+        # Sincronização incremental com remoção
+        self.assertEqual(syncer.sync(), 1)
+        self.assertEqual([event["id"] for event in self.store.query(*window)], ["evt2"])
+        
+        # deltaLink expirado: nova sincronização completa
+        syncer.sync()
+        self.assertEqual(syncer.delta_link, f"{base_url}/delta?token=d1")
+        self.assertEqual(sum(url.startswith(f"{base_url}/me/calendarView/delta") for url in urls_seen), 2)
+        self.assertEqual(sorted(event["id"] for event in self.store.query(*window)), ["evt1", "evt2"])
+    
+    def test_event_store_keeps_appointment_resource(self):
+        """Testa que o recurso do agendamento é gravado e pode filtrar a consulta."""
+        self.store.upsert("database", {"id": "1", "start": "2025-05-01T10:00:00Z", "end": "2025-05-01T10:30:00Z", "resource": "chair-2"})
+        self.store.upsert("google", {"id": "2", "start": "2025-05-01T11:00:00Z", "end": "2025-05-01T11:30:00Z"})
+        
+        window = (datetime(2025, 5, 1, tzinfo=timezone.utc), datetime(2025, 5, 2, tzinfo=timezone.utc))
+        
+        # Sem recurso, a consulta traz todos os eventos
+        self.assertEqual([event["id"] for event in self.store.query(*window)], ["1", "2"])
+        
+        # Eventos sem recurso ocupam a clínica inteira
+        self.assertEqual([event["id"] for event in self.store.query(*window, resource="chair-2")], ["1"])
+        self.assertEqual([event["id"] for event in self.store.query(*window, resource="clinic")], ["2"])
+    
+    def test_full_resync_replaces_store_atomically(self):
+        """Testa que a sincronização completa mantém os eventos anteriores até a última página."""
+        start = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=1, minute=0, second=0, microsecond=0)
+        
+        def make_event(event_id):
+            return {
+                "id": event_id,
+                "summary": "Consulta",
+                "start": {"dateTime": start.isoformat()},
+                "end": {"dateTime": (start + timedelta(minutes=30)).isoformat()}
+            }
+        
+        stored_ids = lambda: [event["id"] for event in self.store.query(start, start + timedelta(hours=1))]
+        execute = self.service.events.return_value.list.return_value.execute
+        execute.side_effect = [{"items": [make_event("evt1")], "nextSyncToken": "token1"}]
+        self.syncer.sync()
+        
+        # Uma falha no meio da nova carga completa não apaga os eventos anteriores
+        self.syncer.reset()
+        execute.side_effect = [{"items": [make_event("evt2")], "nextPageToken": "p2"}, Exception("timeout")]
+        with self.assertRaises(Exception):
+            self.syncer.sync()
+        self.assertEqual(stored_ids(), ["evt1"])
+        
+        # A carga completa seguinte substitui a janela só ao receber a última página
+        seen_during_pull = []
+        pages = iter([
+            {"items": [make_event("evt2")], "nextPageToken": "p2"},
+            {"items": [make_event("evt3")], "nextSyncToken": "token2"}
+        ])
+        
+        def page():
+            seen_during_pull.append(stored_ids())
+            return next(pages)
+        
+        execute.side_effect = page
+        self.syncer.sync()
+        
+        self.assertEqual(seen_during_pull, [["evt1"], ["evt1"]])
+        self.assertEqual(stored_ids(), ["evt2", "evt3"])
+        self.assertEqual(self.syncer.sync_token, "token2")
+
+
+class TestOutlookGraphClient(unittest.TestCase):
+    """Testes para o cliente do Microsoft Graph."""
+    
+    def test_token_is_cached(self):
+        """Testa que o token é reaproveitado entre chamadas."""
+        # Configurar aplicativo MSAL mock
+        app = MagicMock()
+        app.acquire_token_for_client.return_value = {"access_token": "token", "expires_in": 3600}
+        
+        client = OutlookGraphClient(app, ["scope"])
+        client.session = MagicMock()
+        client.session.request.return_value.status_code = 200
+        client.session.request.return_value.json.return_value = {"value": []}
+        
+        # Testar duas chamadas
+        client.get_json("/me/calendarView")
+        client.get_json("/me/calendarView")
+        
+        # Verificar um único token e a mesma sessão
+        app.acquire_token_for_client.assert_called_once()
+        self.assertEqual(client.session.request.call_count, 2)
+        self.assertEqual(client.session.request.call_args.kwargs["headers"]["Authorization"], "Bearer token")
+
+
+class TestSlotHolds(unittest.TestCase):
+    """Testes para as reservas temporárias de horários."""
+    
+    def test_hold_is_exclusive_until_expired(self):
+        """Testa que um horário reservado não pode ser reservado por outro paciente."""
+        holds = SlotHoldManager(ttl_seconds=0.2)
+        
+        # Testar reservas concorrentes
+        first = holds.hold("2025-05-01", "10:00", "user1")
+        second = holds.hold("2025-05-01", "10:00", "user2")
+        
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+        self.assertEqual(holds.get_metrics()["contended"], 1)
+        
+        # Após expirar, o horário pode ser reservado de novo e a reserva antiga não confirma
+        import time
+        time.sleep(0.3)
+        third = holds.hold("2025-05-01", "10:00", "user2")
+        
+        self.assertIsNotNone(third)
+        self.assertFalse(holds.confirm(first))
+        self.assertTrue(holds.confirm(third))
+    
+    def test_concurrent_holds_grant_each_slot_once(self):
+        """Testa que conexões concorrentes ao mesmo arquivo reservam cada horário uma única vez."""
+        import threading
+        
+        with tempfile.TemporaryDirectory() as data_dir:
+            path = os.path.join(data_dir, "holds.db")
+            threads = 8
+            times = ["09:00", "09:30", "10:00", "10:30"]
+            
+            # Cada thread usa a própria conexão, como processos diferentes
+            managers = [SlotHoldManager(path) for _ in range(threads)]
+            barrier = threading.Barrier(threads)
+            granted = {time_str: [] for time_str in times}
+            
+            def run(index):
+                for time_str in times:
+                    barrier.wait()
+                    hold_id = managers[index].hold("2030-01-07", time_str, f"user{index}")
+                    if hold_id and managers[index].confirm(hold_id):
+                        granted[time_str].append(index)
+            
+            workers = [threading.Thread(target=run, args=(index,)) for index in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            
+            # Cada horário foi concedido e confirmado para exatamente um paciente
+            self.assertEqual({time_str: len(winners) for time_str, winners in granted.items()}, {time_str: 1 for time_str in times})
+            self.assertEqual(sum(manager.get_metrics()["contended"] for manager in managers), (threads - 1) * len(times))
+
+
+class TestClinicSchedule(unittest.TestCase):
+    """Testes para o calendário de funcionamento da clínica."""
+    
+    def test_japanese_holidays_close_clinic(self):
+        """Testa feriados japoneses, feriados substitutos e dias entre feriados."""
+        schedule = ClinicSchedule()
+        
+        # Golden Week de 2025: 5/5 (segunda) e 5/6 (substituto de 5/4, domingo)
+        self.assertFalse(schedule.is_open(date(2025, 5, 5)))
+        self.assertEqual(schedule.holiday_name(date(2025, 5, 6)), "振替休日")
+        self.assertTrue(schedule.is_open(date(2025, 5, 7)))
+        
+        # 2026-09-22 fica entre 敬老の日 e 秋分の日
+        self.assertEqual(schedule.holiday_name(date(2026, 9, 22)), "国民の休日")
+    
+    def test_exceptions_override_weekly_hours(self):
+        """Testa exceções por data na geração e na validação de horários."""
+        schedule = ClinicSchedule(exceptions={
+            "2025-05-10": {"start": "09:00", "end": "12:00"},
+            "2025-05-12": None
+        })
+        
+        # Sábado com horário especial e segunda fechada
+        self.assertEqual(schedule.slot_starts(date(2025, 5, 10), 60), (540, 600, 660))
+        self.assertFalse(schedule.is_open(date(2025, 5, 12)))
+        
+        # A consulta precisa caber inteira antes do almoço ou do fim do expediente
+        self.assertTrue(schedule.is_bookable(date(2025, 5, 13), "11:30"))
+        self.assertFalse(schedule.is_bookable(date(2025, 5, 13), "12:00"))
+        self.assertFalse(schedule.is_bookable(date(2025, 5, 13), "17:45"))
+        
+        # O motor de disponibilidade segue o mesmo calendário
+        engine = AvailabilityEngine(schedule.weekly_hours, schedule=schedule)
+        slots = engine.find_slots(date(2025, 5, 10), 3, [], [], 60)
+        self.assertEqual([slot["time"] for slot in slots], ["09:00", "10:00", "11:00"])
+    
+    def test_engine_uses_schedule_slot_starts(self):
+        """Testa que o motor oferece os mesmos inícios de slot do calendário."""
+        schedule = ClinicSchedule()
+        engine = AvailabilityEngine(schedule.weekly_hours, schedule=schedule)
+        day = date(2025, 5, 13)
+        
+        # Consultas de 45 minutos seguem a grade do calendário em cada segmento
+        slots = engine.find_slots(day, 1, [], [], 45)
+        expected = [format_minutes(start) for start in schedule.slot_starts(day, 45)]
+        self.assertEqual([slot["time"] for slot in slots], expected)
+        
+        # Durações fora da grade de ticks são rejeitadas
+        with self.assertRaises(ValueError):
+            engine.find_slots(day, 1, [], [], 32)
+    
+    def test_invalid_schedule_file_falls_back_to_default_hours(self):
+        """Testa que um erro de configuração no arquivo usa o horário padrão em vez de falhar."""
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"weekly": {"0": {"open": "09:00", "end": "18:00"}}}, f)
+        self.addCleanup(os.remove, f.name)
+        
+        with patch.dict(os.environ, {"CLINIC_SCHEDULE_FILE": f.name, "CLINIC_HOLIDAYS": "none"}):
+            with self.assertLogs("line_bot.clinic_schedule", level="ERROR"):
+                schedule = ClinicSchedule.from_env()
+        
+        self.assertEqual(schedule.weekly_hours, ClinicSchedule().weekly_hours)
+        self.assertIsNone(schedule.holidays)
+
+
+class TestCalendarOutbox(unittest.TestCase):
+    """Testes para a fila de sincronização com calendários externos."""
+    
+    def test_enqueue_coalesces_and_gives_up(self):
+        """Testa a unificação de tarefas pendentes e o limite de tentativas."""
+        outbox = CalendarOutbox(max_attempts=2, base_delay=0)
+        
+        # Registros repetidos do mesmo agendamento geram uma única tarefa por provedor
+        self.assertEqual(outbox.enqueue(1, ["google", "outlook"]), 2)
+        self.assertEqual(outbox.enqueue(1, ["google"]), 0)
+        
+        jobs = outbox.claim()
+        self.assertEqual(sorted(job["provider"] for job in jobs), ["google", "outlook"])
+        self.assertEqual(outbox.claim(), [])
+        
+        # Após max_attempts falhas, a tarefa é marcada como failed
+        google_job = next(job for job in jobs if job["provider"] == "google")
+        outbox.fail(google_job["job_id"], "erro")
+        outbox.fail(outbox.claim()[0]["job_id"], "erro")
+        
+        self.assertEqual(outbox.get_stats()["failed"], 1)
+        self.assertEqual(outbox.get_stats()["running"], 1)
+
+
+class TestChartRenderer(unittest.TestCase):
+    """Testes para a renderização e o cache de gráficos."""
+    
+    def test_charts_are_cached_by_content(self):
+        """Testa que gráficos iguais são renderizados uma única vez e reaproveitados do disco."""
+        with tempfile.TemporaryDirectory() as directory:
+            renderer = ChartRenderer(max_workers=0, cache=ChartCache(max_items=2, directory=directory))
+            data = {"Monday": 3, "Tuesday": 1}
+            
+            with patch("line_bot.chart_renderer.render_chart", return_value=b"png") as render:
+                self.assertEqual(renderer.render("bar", data, "Agendamentos", "Dia", "Total"), b"png")
+                renderer.render("bar", dict(data), "Agendamentos", "Dia", "Total")
+                self.assertEqual(render.call_count, 1)
+                
+                # Outra ordem dos dados é outro gráfico
+                renderer.render("bar", {"Tuesday": 1, "Monday": 3}, "Agendamentos", "Dia", "Total")
+                self.assertEqual(render.call_count, 2)
+                
+                # Um novo processo encontra a imagem no cache em disco
+                other = ChartRenderer(max_workers=0, cache=ChartCache(directory=directory))
+                self.assertEqual(other.render("bar", data, "Agendamentos", "Dia", "Total"), b"png")
+                self.assertEqual(render.call_count, 2)
+    
+    def test_render_chart_returns_png(self):
+        """Testa a renderização de cada tipo de gráfico."""
+        for kind in ("bar", "pie", "line"):
+            image = render_chart(kind, {"09": 2, "10": 1}, "Teste", "Hora", "Total")
+            self.assertTrue(image.startswith(b"\x89PNG"))
+    
+    def test_disk_cache_evicts_least_recently_used_images(self):
+        """Testa que o cache em disco apaga as imagens usadas há mais tempo ao passar do limite."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ChartCache(max_items=1, directory=directory, max_disk_bytes=12)
+            cache.put("a", b"aaaaaa")
+            cache.put("b", b"bbbbbb")
+            for key, age in (("a", 200), ("b", 100)):
+                past = datetime.now().timestamp() - age
+                os.utime(os.path.join(directory, f"{key}.png"), (past, past))
+            
+            # Ler "a" do disco o torna o mais recente; "b" é o descartado
+            self.assertEqual(cache.get("a"), b"aaaaaa")
+            cache.put("c", b"cccccc")
+            
+            self.assertEqual(sorted(os.listdir(directory)), ["a.png", "c.png"])
+    
+    def test_broken_pool_renders_fallback_in_another_thread(self):
+        """Testa que, com o pool interrompido, o gráfico é desenhado fora da thread do callback."""
+        import threading
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+        
+        renderer = ChartRenderer(max_workers=1)
+        pool_future = Future()
+        renderer._get_pool = MagicMock(return_value=MagicMock(submit=MagicMock(return_value=pool_future)))
+        threads = []
+        
+        def render(*args):
+            threads.append(threading.current_thread())
+            return b"png"
+        
+        with patch("line_bot.chart_renderer.render_chart", side_effect=render):
+            future = renderer.submit("bar", {"Monday": 3}, "Agendamentos")
+            pool_future.set_exception(BrokenProcessPool("interrompido"))
+            
+            self.assertEqual(future.result(timeout=5), b"png")
+        
+        self.assertEqual(threads[0].name, "chart-fallback")
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
 if __name__ == '__main__':
     unittest.main()